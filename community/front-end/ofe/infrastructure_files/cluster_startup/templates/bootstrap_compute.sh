@@ -27,7 +27,12 @@ echo "This is the startup script for the compute nodes on cluster ${CLUSTER_ID}"
 
 set -x
 set -e
-if [[ $(type -P yum) ]]; then
+# Golden images already have ansible and everything which doesn't need the
+# cluster's filesystems
+PLAYBOOK=./compute.yaml
+if [[ -f /etc/ghpcfe/image_hash ]]; then
+	PLAYBOOK=./compute_runtime.yaml
+elif [[ $(type -P yum) ]]; then
 	yum install -y ansible
 else
 	apt install -y ansible
@@ -46,4 +51,4 @@ cluster_bucket=${BUCKET}
 spack_dir=${SPACK_DIR}
 EOF
 
-exec ansible-playbook ./compute.yaml
+exec ansible-playbook "${PLAYBOOK}"
@@ -0,0 +1,69 @@
+#!/bin/bash
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# shellcheck disable=SC1083
+BUCKET={{ server_bucket }}
+CLUSTER_ID={{ cluster.id }}
+SPACK_DIR={{ spack_dir }}
+
+echo "This is the startup script for building a compute node image for cluster ${CLUSTER_ID}"
+
+# Runs once, on a builder VM: install ansible and run the parts of compute
+# node setup which don't need the cluster, then record that the image has
+# them.  The front end images the VM once it reports it is done.
+
+METADATA=http://metadata.google.internal/computeMetadata/v1/instance
+report() {
+	curl -s -X PUT --data "$1" -H "Metadata-Flavor: Google" \
+		"${METADATA}/guest-attributes/ghpcfe/image-build"
+}
+
+# Only build once, not on every boot
+if [[ -f /etc/ghpcfe/image_hash ]]; then
+	exit 0
+fi
+
+set -x
+trap 'report failed' ERR
+set -e
+if [[ $(type -P yum) ]]; then
+	yum install -y ansible
+else
+	apt install -y ansible
+fi
+
+cd /tmp
+gsutil -m cp -r "gs://${BUCKET}/clusters/ansible_setup" /tmp
+cd /tmp/ansible_setup
+
+mkdir -p /etc/ansible/facts.d
+cat >/etc/ansible/facts.d/ghpcfe.fact <<EOT
+[config]
+cluster_id=${CLUSTER_ID}
+cluster_bucket=${BUCKET}
+spack_dir=${SPACK_DIR}
+EOT
+
+ansible-playbook ./compute_image.yaml
+
+# Nodes re-create these at boot
+cd /
+rm -rf /tmp/ansible_setup /etc/ansible/facts.d/ghpcfe.fact
+
+mkdir -p /etc/ghpcfe
+curl -s -H "Metadata-Flavor: Google" \
+	"${METADATA}/attributes/ghpcfe-image-hash" >/etc/ghpcfe/image_hash
+sync
+report done
@@ -192,7 +192,6 @@ sudo su - gcluster -c /bin/bash <<EOF
   printf "\nInitalising Django environments...\n"
   mkdir /opt/gcluster/run
   pushd website
-  python manage.py makemigrations
   python manage.py migrate
   printf "\nCreating django super user..."
   DJANGO_SUPERUSER_PASSWORD=$DJANGO_PASSWORD python manage.py createsuperuser --username $DJANGO_USERNAME --email $DJANGO_EMAIL --noinput
@@ -201,6 +200,8 @@ sudo su - gcluster -c /bin/bash <<EOF
   printf "\nSet up static contents..."
   python manage.py collectstatic
   python manage.py seed_workbench_presets
+  printf "\nMirroring Terraform providers..."
+  python manage.py mirror_terraform_providers
   popd
 
   printf "\nUpdating nginx config...\n"
@@ -232,7 +233,18 @@ autostart=true
 autorestart=true
 user=gcluster
 redirect_stderr=true
-stdout_logfile=/opt/gcluster/run/supvisor.log" >/etc/supervisord.d/gcluster.ini
+stdout_logfile=/opt/gcluster/run/supvisor.log
+
+[program:gcluster-task-worker]
+directory=/opt/gcluster/hpc-toolkit/community/front-end/website
+command=/opt/gcluster/django-env/bin/python manage.py run_task_worker
+autostart=true
+autorestart=true
+user=gcluster
+stopsignal=TERM
+stopwaitsecs=3600
+redirect_stderr=true
+stdout_logfile=/opt/gcluster/run/task-worker.log" >/etc/supervisord.d/gcluster.ini
 
 printf "Creating systemd service..."
 echo "[Unit]
@@ -14,9 +14,23 @@
 
 """Top level Django app definitions"""
 
+import sys
+from pathlib import Path
+
 from django.apps import AppConfig
 from .cluster_manager import c2
 
+
+def _is_management_command():
+    """True for one-shot manage.py commands (migrate, collectstatic, ...)"""
+    return Path(sys.argv[0]).name == "manage.py" and "runserver" not in sys.argv
+
+
+def _is_test_run():
+    """True for manage.py test, which must not talk to the cloud"""
+    return Path(sys.argv[0]).name == "manage.py" and sys.argv[1:2] == ["test"]
+
+
 class GHPCFEConfig(AppConfig):
     name = "ghpcfe"
     default_auto_field = "django.db.models.AutoField"
@@ -25,4 +39,12 @@ class GHPCFEConfig(AppConfig):
         # Has side effect of registering various receiver callbacks
         import ghpcfe.signals # pylint:disable=unused-import,import-outside-toplevel
 
-        c2.startup()
+        if not _is_test_run():
+            c2.startup()
+
+        # Pre-populate the cloud metadata caches so interactive page loads
+        # don't have to wait on the GCP APIs
+        if not _is_management_command():
+            from .cluster_manager import cache_warmer # pylint:disable=import-outside-toplevel
+
+            cache_warmer.start_refresher()
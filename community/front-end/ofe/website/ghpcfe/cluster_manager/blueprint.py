@@ -0,0 +1,169 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HPC Toolkit blueprint generation
+
+Blueprints are assembled from Module objects and serialized once, so values
+are always quoted correctly and the same inputs always give byte-identical
+YAML (which the content hashes in clusterinfo rely on).
+"""
+
+import functools
+
+import yaml
+
+
+class Module:
+    """One module of a blueprint deployment group
+
+    Modules may be shared between blueprints (see partition_modules()), so
+    must not be modified once built.
+    """
+
+    def __init__(
+        self, source, module_id, settings=None, use=None, outputs=None,
+        kind="terraform",
+    ):
+        self.source = source
+        self.id = module_id
+        self.kind = kind
+        self.settings = settings if settings else {}
+        self.use = list(use) if use else []
+        self.outputs = list(outputs) if outputs else []
+
+    def to_dict(self):
+        res = {"source": self.source, "kind": self.kind, "id": self.id}
+        if self.use:
+            res["use"] = list(self.use)
+        if self.settings:
+            res["settings"] = dict(self.settings)
+        if self.outputs:
+            res["outputs"] = list(self.outputs)
+        return res
+
+
+class Blueprint:
+    """A blueprint with a single "primary" deployment group"""
+
+    def __init__(self, name, variables):
+        self.name = name
+        self.vars = variables
+        self.modules = []
+
+    def add(self, *modules):
+        self.modules.extend(modules)
+
+    def to_dict(self):
+        return {
+            "blueprint_name": self.name,
+            "vars": self.vars,
+            "deployment_groups": [
+                {
+                    "group": "primary",
+                    "modules": [module.to_dict() for module in self.modules],
+                }
+            ],
+        }
+
+    def to_yaml(self):
+        return yaml.dump(
+            self.to_dict(),
+            Dumper=_BlueprintDumper,
+            sort_keys=False,
+            default_flow_style=False,
+            width=float("inf"),
+        )
+
+
+class _BlueprintDumper(yaml.SafeDumper):
+    pass
+
+
+def _represent_str(dumper, data):
+    # Startup scripts and the like read better as literal blocks
+    style = "|" if "\n" in data else None
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data, style=style)
+
+
+_BlueprintDumper.add_representer(str, _represent_str)
+
+
+def instance_image(image):
+    """The node group instance_image setting for an image path
+
+    Takes "projects/<project>/global/images/<name>" or
+    "projects/<project>/global/images/family/<family>", optionally as a
+    full URL.
+    """
+    parts = image.split("/")
+    if "projects" in parts:
+        parts = parts[parts.index("projects"):]
+    if len(parts) == 6 and parts[2:5] == ["global", "images", "family"]:
+        return {"family": parts[5], "project": parts[1]}
+    if len(parts) == 5 and parts[2:4] == ["global", "images"]:
+        return {"name": parts[4], "project": parts[1]}
+    raise ValueError(f"Unrecognised image path {image}")
+
+
+@functools.lru_cache(maxsize=1024)
+def partition_modules(
+    part_id,
+    uses,
+    subnetwork,
+    name,
+    enable_placement,
+    exclusive,
+    enable_smt,
+    machine_type,
+    max_node_count,
+    image="",
+    gpu_count=0,
+    gpu_type="",
+):
+    """Partition and node group modules for a cluster partition
+
+    All arguments are plain values, so the modules for unchanged partitions
+    are built once and then re-used.
+    """
+    group_settings = {
+        "enable_smt": enable_smt,
+        "machine_type": machine_type,
+        "node_count_dynamic_max": max_node_count,
+    }
+    if image:
+        group_settings["instance_image"] = instance_image(image)
+    # Temporarily hack in some A100 support
+    if gpu_count > 0:
+        group_settings["gpu.count"] = gpu_count
+        group_settings["gpu.type"] = gpu_type
+
+    return (
+        Module(
+            "community/modules/compute/schedmd-slurm-gcp-v5-partition",
+            part_id,
+            use=[f"{part_id}-group"] + list(uses),
+            settings={
+                "partition_name": name,
+                "subnetwork_self_link": subnetwork,
+                "enable_placement": enable_placement,
+                "exclusive": exclusive,
+            },
+        ),
+        Module(
+            "community/modules/compute/schedmd-slurm-gcp-v5-node-group",
+            f"{part_id}-group",
+            use=uses,
+            settings=group_settings,
+        ),
+    )
@@ -16,6 +16,7 @@ import json
 import logging
 import uuid
 
+from django.db import close_old_connections
 from google.api_core.exceptions import AlreadyExists
 from google.cloud import pubsub
 
@@ -150,6 +151,17 @@ def cb_cluster_status(message, source_id):
 
 
 def _c2_response_callback(message):
+    # Runs on a pubsub worker thread, outside of any request, so do the
+    # connection housekeeping Django would otherwise do per request: drop
+    # connections which have expired (CONN_MAX_AGE) or broken.
+    close_old_connections()
+    try:
+        _c2_dispatch(message)
+    finally:
+        close_old_connections()
+
+
+def _c2_dispatch(message):
     logger.debug("Received message %s ", message)
 
     cmd = message.attributes.get("command", None)
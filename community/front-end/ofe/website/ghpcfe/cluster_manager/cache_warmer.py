@@ -0,0 +1,149 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background pre-population of the cloud metadata caches
+
+The cloud_info caches live in-process, so this has to run inside the web
+server process itself (see GHPCFEConfig.ready) rather than as a separate
+management command.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DatabaseError, connection
+
+from . import cloud_info
+from . import utils
+from ..models import Cluster, Credential, VirtualSubnet
+
+logger = logging.getLogger(__name__)
+
+_refresher_thread = None
+
+
+def _zones_in_use(credential, region_info):
+    """Zones an admin is likely to pick for this credential: every zone of a
+    region with a usable subnet, plus zones of existing clusters"""
+    regions = VirtualSubnet.objects.filter(
+        cloud_credential=credential, cloud_state__in=["i", "m"]
+    ).values_list("cloud_region", flat=True)
+    zones = set(
+        Cluster.objects.filter(cloud_credential=credential)
+        .exclude(status="d")
+        .exclude(cloud_zone__isnull=True)
+        .values_list("cloud_zone", flat=True)
+    )
+    for region in set(regions):
+        zones.update(region_info.get(region, []))
+    return zones
+
+
+def _call(ahead, func, *args):
+    with cloud_info.ttl_offset(ahead):
+        return func("GCP", *args)
+
+
+def _warm(ahead, func, *args):
+    try:
+        _call(ahead, func, *args)
+    # Failures just mean the first interactive request pays the cost instead
+    except Exception as err:  # pylint: disable=broad-except
+        logger.warning(
+            "Failed to warm %s for zone %s", func.__name__, args[-1],
+            exc_info=err
+        )
+
+
+def warm_caches(max_workers=8, ahead=0):
+    """Populate region/zone, machine type and disk type caches for every
+    credential, querying the cloud APIs concurrently
+
+    With ahead, the caches are filled for that many seconds from now.
+    """
+    start = time.time()
+    credentials = list(Credential.objects.all())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        region_futures = {
+            cred: executor.submit(
+                _call, ahead, cloud_info.get_region_zone_info, cred.detail
+            )
+            for cred in credentials
+        }
+        for (cred, future) in region_futures.items():
+            try:
+                region_info = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning(
+                    "Failed to warm region info for credential %s",
+                    cred.name,
+                    exc_info=err,
+                )
+                continue
+            for zone in _zones_in_use(cred, region_info):
+                region = zone.rsplit("-", 1)[0]
+                for func in [
+                    cloud_info.get_machine_types,
+                    cloud_info.get_disk_types,
+                ]:
+                    executor.submit(
+                        _warm, ahead, func, cred.detail, region, zone
+                    )
+    logger.info(
+        "Warmed cloud metadata caches for %d credentials in %.1fs",
+        len(credentials),
+        time.time() - start,
+    )
+
+
+def _refresh_loop(interval):
+    while True:
+        try:
+            warm_caches()
+            # The caches expire together at fixed times.  If that is before
+            # the next refresh, fill the following period's entries now, so
+            # that no page load has to.
+            rollover = cloud_info.next_ttl_rollover()
+            if rollover < interval:
+                warm_caches(ahead=rollover + 1)
+        except DatabaseError as err:
+            # e.g. tables not yet migrated - try again next time around
+            logger.info("Skipping cloud cache warm-up: %s", err)
+        finally:
+            # This thread's connection would otherwise sit idle until the
+            # next refresh
+            connection.close()
+        time.sleep(interval)
+
+
+def start_refresher(interval=None):
+    """Start a daemon thread to warm the caches now, and then periodically
+    re-warm them so they never expire under an interactive request"""
+    global _refresher_thread
+    if _refresher_thread:
+        return
+
+    if interval is None:
+        interval = utils.load_config()["server"].get(
+            "cache_refresh_interval", 3600
+        )
+    _refresher_thread = threading.Thread(
+        target=_refresh_loop,
+        args=(interval,),
+        name="cloud-cache-refresher",
+        daemon=True,
+    )
+    _refresher_thread.start()
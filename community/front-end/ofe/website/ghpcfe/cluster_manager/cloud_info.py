@@ -14,21 +14,36 @@
 
 """Cloud interrogation routines"""
 
+import contextlib
+import hashlib
+import io
 import json
 import logging
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 
 import archspec.cpu
+import google.api_core.exceptions
 import google.cloud.exceptions
+import google_auth_httplib2
 import googleapiclient.discovery
+import googleapiclient.errors
+import googleapiclient.http
+import httplib2
+import requests.adapters
 from google.cloud import storage as gcs
 from google.cloud.billing_v1.services import cloud_catalog
 from google.oauth2 import service_account
 
+from ..models import CacheGeneration
+
 logger = logging.getLogger(__name__)
 
+_gcp_cloud_platform_scope = "https://www.googleapis.com/auth/cloud-platform"
+
 gcp_machine_table = defaultdict(
     lambda: defaultdict(lambda: "x86_64"),
     {
@@ -60,15 +75,68 @@ def _get_arch_for_node_type_gcp(instance):
     return gcp_machine_table[family][group]
 
 
-def _get_gcp_client(credentials, service="compute", api_version="v1"):
+# Discovery clients are expensive to build (discovery document parsing plus
+# credential setup), so keep a bounded LRU pool of them keyed by credential
+# fingerprint, service and API version.
+_gcp_client_pool_size = 32
+_gcp_client_pool = OrderedDict()
+_gcp_client_pool_lock = threading.Lock()
+
+
+def _credential_fingerprint(credentials):
+    return hashlib.sha256(credentials.encode("utf-8")).hexdigest()
+
+
+def _build_gcp_client(credentials, service, api_version):
     cred_info = json.loads(credentials)
-    creds = service_account.Credentials.from_service_account_info(cred_info)
-    return (
-        cred_info["project_id"],
-        googleapiclient.discovery.build(
-            service, api_version, credentials=creds, cache_discovery=False
-        ),
+    creds = service_account.Credentials.from_service_account_info(
+        cred_info, scopes=[_gcp_cloud_platform_scope]
+    )
+
+    # httplib2.Http objects are not thread-safe, so give every request its
+    # own connection while sharing the credentials (and so the access token,
+    # which AuthorizedHttp refreshes on expiry) across all of them.
+    def build_request(unused_http, *args, **kwargs):
+        new_http = google_auth_httplib2.AuthorizedHttp(
+            creds, http=httplib2.Http()
+        )
+        return googleapiclient.http.HttpRequest(new_http, *args, **kwargs)
+
+    client = googleapiclient.discovery.build(
+        service,
+        api_version,
+        credentials=creds,
+        cache_discovery=False,
+        requestBuilder=build_request,
     )
+    return (cred_info["project_id"], client)
+
+
+def _get_gcp_client(credentials, service="compute", api_version="v1"):
+    key = (_credential_fingerprint(credentials), service, api_version)
+    with _gcp_client_pool_lock:
+        entry = _gcp_client_pool.get(key)
+        if entry:
+            _gcp_client_pool.move_to_end(key)
+            return entry
+
+    # Build outside the lock - it can take a while and other callers using
+    # already-pooled clients shouldn't have to wait on it.
+    entry = _build_gcp_client(credentials, service, api_version)
+    with _gcp_client_pool_lock:
+        entry = _gcp_client_pool.setdefault(key, entry)
+        _gcp_client_pool.move_to_end(key)
+        while len(_gcp_client_pool) > _gcp_client_pool_size:
+            _gcp_client_pool.popitem(last=False)
+    return entry
+
+
+def evict_gcp_clients(credentials):
+    """Drop any pooled discovery clients built from these credentials"""
+    fingerprint = _credential_fingerprint(credentials)
+    with _gcp_client_pool_lock:
+        for key in [k for k in _gcp_client_pool if k[0] == fingerprint]:
+            del _gcp_client_pool[key]
 
 
 @lru_cache
@@ -165,12 +233,44 @@ def _get_gcp_machine_types(
     return data
 
 
+# Subnets and Filestore instances change far more often than zones or machine
+# types, so cache them for a shorter period (and invalidate explicitly when we
+# create or destroy them ourselves).  That happens in the task worker, so the
+# caches are also keyed on a generation shared through the database.
+_discovery_cache_seconds = 3600
+
+
+# Offset applied to the clock by _get_ttl_hash(), per thread
+_ttl_clock = threading.local()
+
+
 def _get_ttl_hash(seconds=3600 * 24):
     """Return the same value within `seconds` time period.
 
     Default to 1 day of caching
     """
-    return round(time.time() / seconds)
+    return int((time.time() + getattr(_ttl_clock, "offset", 0)) // seconds)
+
+
+def next_ttl_rollover(seconds=3600 * 24):
+    """Seconds until _get_ttl_hash(seconds) next changes"""
+    now = time.time()
+    return (now // seconds + 1) * seconds - now
+
+
+@contextlib.contextmanager
+def ttl_offset(seconds):
+    """Look up cache entries in this thread as if it were `seconds` from now
+
+    So that the next period's entries can be filled before the current
+    ones expire.
+    """
+    previous = getattr(_ttl_clock, "offset", 0)
+    _ttl_clock.offset = seconds
+    try:
+        yield
+    finally:
+        _ttl_clock.offset = previous
 
 
 def get_machine_types(cloud_provider, credentials, unused_region, zone):
@@ -241,34 +341,55 @@ def get_region_zone_info(cloud_provider, credentials):
         raise Exception("Unsupport Cloud Provider")
 
 
-def _get_gcp_subnets(credentials):
+@lru_cache
+def _get_gcp_subnets(
+    credentials, ttl_hash=None
+):  # pylint: disable=unused-argument
     (project, client) = _get_gcp_client(credentials)
 
     req = client.subnetworks().listUsable(project=project)
-    results = req.execute()
-    entries = results["items"]
     subnets = []
-    for entry in entries:
-        # subnet in the form of https://www.googleapis.com/compute/v1/projects/<project>/regions/<region>/subnetworks/<name>
-        tokens = entry["subnetwork"].split("/")
-        region = tokens[8]
-        subnet = tokens[10]
-        # vpc in the form of https://www.googleapis.com/compute/v1/projects/<project>/global/networks/<name>
-        tokens = entry["network"].split("/")
-        vpc = tokens[9]
-        # cidr in standard form xxx.xxx.xxx.xxx/yy
-        cidr = entry["ipCidrRange"]
-        subnets.append([vpc, region, subnet, cidr])
+    while req is not None:
+        resp = req.execute()
+        for entry in resp.get("items", []):
+            # subnet in the form of https://www.googleapis.com/compute/v1/projects/<project>/regions/<region>/subnetworks/<name>
+            tokens = entry["subnetwork"].split("/")
+            region = tokens[8]
+            subnet = tokens[10]
+            # vpc in the form of https://www.googleapis.com/compute/v1/projects/<project>/global/networks/<name>
+            tokens = entry["network"].split("/")
+            vpc = tokens[9]
+            # cidr in standard form xxx.xxx.xxx.xxx/yy
+            cidr = entry["ipCidrRange"]
+            subnets.append([vpc, region, subnet, cidr])
+        req = client.subnetworks().listUsable_next(
+            previous_request=req, previous_response=resp
+        )
     return subnets
 
 
 def get_subnets(cloud_provider, credentials):
     if cloud_provider == "GCP":
-        return _get_gcp_subnets(credentials)
+        return _get_gcp_subnets(
+            credentials,
+            ttl_hash=(
+                _get_ttl_hash(_discovery_cache_seconds),
+                CacheGeneration.current("subnets"),
+            ),
+        )
     else:
         raise Exception("Unsupport Cloud Provider")
 
 
+def invalidate_subnet_cache():
+    """Drop cached subnet listings after VPCs/subnets are created or destroyed
+
+    In every process, not just this one.
+    """
+    CacheGeneration.bump("subnets")
+    _get_gcp_subnets.cache_clear()
+
+
 _gcp_services_list = None
 _gcp_compute_sku_list = None
 
@@ -488,6 +609,30 @@ def get_instance_pricing(
         raise Exception(f'Unsupported Cloud Provider "{cloud_provider}"')
 
 
+# Share one GCS client (and so one keep-alive HTTP session) across the whole
+# process rather than authenticating and connecting afresh on every call.
+_gcs_client = None
+_gcs_client_lock = threading.Lock()
+_gcs_max_workers = 8
+
+
+def _get_gcs_client():
+    global _gcs_client
+
+    with _gcs_client_lock:
+        if not _gcs_client:
+            _gcs_client = gcs.Client()
+            # Size the connection pool for concurrent batch uploads
+            _gcs_client._http.mount(  # pylint: disable=protected-access
+                "https://",
+                requests.adapters.HTTPAdapter(
+                    pool_connections=_gcs_max_workers,
+                    pool_maxsize=_gcs_max_workers,
+                ),
+            )
+        return _gcs_client
+
+
 def gcs_apply_bucket_acl(
     bucket, account, permission="roles/storage.objectViewer"
 ):
@@ -498,7 +643,7 @@ def gcs_apply_bucket_acl(
         bucket,
         account,
     )
-    client = gcs.Client()
+    client = _get_gcs_client()
     try:
         gcs_bucket = client.get_bucket(bucket)
         policy = gcs_bucket.get_iam_policy()
@@ -523,7 +668,7 @@ def gcs_upload_file(bucket, path, contents, extra_acl=None):
     logger.info(
         "Attempting to upload to gs://%s/%s", bucket, path if path else ""
     )
-    client = gcs.Client()
+    client = _get_gcs_client()
     gcs_bucket = client.bucket(bucket)
     blob = gcs_bucket.blob(path)
     blob.upload_from_string(contents)
@@ -534,11 +679,25 @@ def gcs_upload_file(bucket, path, contents, extra_acl=None):
             if permission in ["OWNER", "READER", "WRITER"]:
                 blob.acl.user(user).grant(permission)
         blob.acl.save()
-    client.close()
+
+
+def gcs_upload_files(bucket, files, extra_acl=None):
+    """Upload several files concurrently
+
+    `files` is a dictionary of path -> contents.  Raises the first upload
+    error encountered, after all uploads have finished.
+    """
+    with ThreadPoolExecutor(max_workers=_gcs_max_workers) as executor:
+        futures = [
+            executor.submit(gcs_upload_file, bucket, path, contents, extra_acl)
+            for (path, contents) in files.items()
+        ]
+    for future in futures:
+        future.result()
 
 
 def gcs_fetch_file(bucket, paths):
-    client = gcs.Client()
+    client = _get_gcs_client()
     gcs_bucket = client.bucket(bucket)
     results = {}
     for path in paths:
@@ -554,17 +713,36 @@ def gcs_fetch_file(bucket, paths):
             logger.info(
                 "Attempt failed (Not Found) to download {path}", exc_info=nf
             )
-    client.close()
     return results
 
 
 def gcs_get_blob(bucket, path):
     """Returns a blob object - it may or may not exist"""
-    client = gcs.Client()
+    client = _get_gcs_client()
     gcs_bucket = client.bucket(bucket)
     return gcs_bucket.blob(path)
 
 
+def gcs_open_blob(bucket, path, chunk_size=4096):
+    """Returns a readable stream for a blob, or None if it does not exist
+
+    The first chunk is fetched immediately, so the existence check and the
+    start of the download cost a single request.
+    """
+    blob = gcs_get_blob(bucket, path)
+    reader = io.BufferedReader(
+        blob.open(mode="rb", chunk_size=chunk_size), buffer_size=chunk_size
+    )
+    try:
+        reader.peek(1)
+    except google.cloud.exceptions.NotFound:
+        return None
+    except google.api_core.exceptions.RequestRangeNotSatisfiable:
+        # Object exists, but is empty
+        return io.BytesIO(b"")
+    return reader
+
+
 def get_gcp_workbench_region_zone_info(
     credentials, service="notebooks", api_version="v1"
 ):
@@ -596,12 +774,118 @@ def get_gcp_filestores(credentials):
       ...
     ]
     """
-    (project, client) = _get_gcp_client(credentials, "file", "v1")
-    request = (
-        client.projects()
-        .locations()
-        .instances()
-        .list(parent=f"projects/{project}/locations/-")
+    return _get_gcp_filestores(
+        credentials,
+        ttl_hash=(
+            _get_ttl_hash(_discovery_cache_seconds),
+            CacheGeneration.current("filestores"),
+        ),
     )
-    result = request.execute()
-    return result["instances"]
+
+
+@lru_cache
+def _get_gcp_filestores(
+    credentials, ttl_hash=None
+):  # pylint: disable=unused-argument
+    (project, client) = _get_gcp_client(credentials, "file", "v1")
+    instances = client.projects().locations().instances()
+    req = instances.list(parent=f"projects/{project}/locations/-")
+    results = []
+    while req is not None:
+        resp = req.execute()
+        results.extend(resp.get("instances", []))
+        req = instances.list_next(previous_request=req, previous_response=resp)
+    return results
+
+
+def invalidate_filestore_cache():
+    """Drop cached Filestore listings after filesystems are created/destroyed
+
+    In every process, not just this one.
+    """
+    CacheGeneration.bump("filestores")
+    _get_gcp_filestores.cache_clear()
+
+
+def _wait_for_gcp_operation(client, project, operation, zone=None):
+    """Wait for a Compute Engine operation, raising if it failed"""
+    while operation["status"] != "DONE":
+        # wait() returns after at most two minutes, done or not
+        if zone:
+            operation = client.zoneOperations().wait(
+                project=project, zone=zone, operation=operation["name"]
+            ).execute()
+        else:
+            operation = client.globalOperations().wait(
+                project=project, operation=operation["name"]
+            ).execute()
+    if "error" in operation:
+        errors = operation["error"].get("errors", [])
+        raise Exception(
+            f"{operation['operationType']} of {operation['targetLink']} "
+            f"failed: {'; '.join(e.get('message', '') for e in errors)}"
+        )
+    return operation
+
+
+def gcp_create_instance(credentials, zone, body):
+    (project, client) = _get_gcp_client(credentials)
+    operation = client.instances().insert(
+        project=project, zone=zone, body=body
+    ).execute()
+    _wait_for_gcp_operation(client, project, operation, zone=zone)
+
+
+def gcp_stop_instance(credentials, zone, name):
+    (project, client) = _get_gcp_client(credentials)
+    operation = client.instances().stop(
+        project=project, zone=zone, instance=name
+    ).execute()
+    _wait_for_gcp_operation(client, project, operation, zone=zone)
+
+
+def gcp_delete_instance(credentials, zone, name):
+    (project, client) = _get_gcp_client(credentials)
+    operation = client.instances().delete(
+        project=project, zone=zone, instance=name
+    ).execute()
+    _wait_for_gcp_operation(client, project, operation, zone=zone)
+
+
+def gcp_get_guest_attribute(credentials, zone, name, path):
+    """Value of an instance's guest attribute, or None if not set"""
+    (project, client) = _get_gcp_client(credentials)
+    try:
+        result = client.instances().getGuestAttributes(
+            project=project, zone=zone, instance=name, queryPath=path
+        ).execute()
+    except googleapiclient.errors.HttpError as err:
+        if err.resp.status == 404:
+            return None
+        raise
+    for item in result.get("queryValue", {}).get("items", []):
+        if f"{item['namespace']}/{item['key']}" == path:
+            return item["value"]
+    return None
+
+
+def gcp_get_serial_port_output(credentials, zone, name):
+    (project, client) = _get_gcp_client(credentials)
+    result = client.instances().getSerialPortOutput(
+        project=project, zone=zone, instance=name
+    ).execute()
+    return result.get("contents", "")
+
+
+def gcp_create_image(credentials, body):
+    """Create an image, returning its path"""
+    (project, client) = _get_gcp_client(credentials)
+    operation = client.images().insert(project=project, body=body).execute()
+    _wait_for_gcp_operation(client, project, operation)
+    return f"projects/{project}/global/images/{body['name']}"
+
+
+def gcp_delete_image(credentials, name):
+    (project, client) = _get_gcp_client(credentials)
+    operation = client.images().delete(project=project, image=name).execute()
+    _wait_for_gcp_operation(client, project, operation)
@@ -21,23 +21,43 @@
 # 3 - Supplied via commandline
 """Cluster specification and management routines"""
 
+import hashlib
 import json
 import logging
 import subprocess
 
+from django.db import transaction
 from django.template import engines as template_engines
 from google.api_core.exceptions import PermissionDenied as GCPPermissionDenied
 from website.settings import SITE_NAME
 
+from . import blueprint
 from . import c2
 from . import cloud_info
+from . import golden_image
+from . import tfstate
 from . import utils
 
 from .. import grafana
-from ..models import Cluster, ApplicationInstallationLocation, ComputeInstance
+from ..models import (
+    ApplicationInstallationLocation,
+    Cluster,
+    ClusterPartition,
+    ComputeInstance,
+)
 
 logger = logging.getLogger(__name__)
 
+# Terraform modules of the Slurm controller and login instances
+_controller_module = (
+    "module.slurm_controller.module.slurm_controller_instance"
+    ".module.slurm_controller_instance"
+)
+_login_module = (
+    "module.slurm_login.module.slurm_login_instance"
+    ".module.slurm_login_instance"
+)
+
 
 class ClusterInfo:
     """Expected process:
@@ -67,8 +87,30 @@ class ClusterInfo:
         self.update()
 
     def update(self):
-        self._prepare_ghpc_yaml()
+        """Bring the cluster's configuration up to date with the database
+
+        Only what has changed since it was last deployed is redone, so an
+        update which changes nothing makes no cloud API calls.
+        """
+        replaced_image = None
+        if self._golden_images_enabled() and self.cluster.status == "r":
+            try:
+                replaced_image = self._update_golden_image()
+            # Nodes still set themselves up at boot without one
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error(
+                    "Failed to build compute node image for cluster %s",
+                    self.cluster.id,
+                    exc_info=err,
+                )
+        blueprint_changed = self._prepare_ghpc_yaml()
         self._prepare_bootstrap_gcs()
+        # Clusters which aren't running yet are deployed by start_cluster()
+        if blueprint_changed and self.cluster.status == "r":
+            self._update_deployment()
+        # Only once no instance template uses it
+        if replaced_image:
+            self._delete_golden_image(replaced_image)
 
     def start_cluster(self):
         self.cluster.cloud_state = "nm"
@@ -79,6 +121,7 @@ class ClusterInfo:
             self._run_ghpc()
             self._initialize_terraform()
             self._apply_terraform()
+            self._save_blueprint_hash()
 
             dash = grafana.create_cluster_dashboard(self.cluster)
             self.cluster.grafana_dashboard_url = dash.get("url", "")
@@ -101,6 +144,127 @@ class ClusterInfo:
     def _create_cluster_dir(self):
         self.cluster_dir.mkdir(parents=True)
 
+    def _content_hashes_file(self):
+        return self.cluster_dir / "content_hashes.json"
+
+    def _load_content_hashes(self):
+        """Hashes of the blueprint and bootstrap scripts last deployed"""
+        try:
+            with self._content_hashes_file().open("r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+
+    def _save_content_hash(self, name, content_hash):
+        hashes = self._load_content_hashes()
+        hashes[name] = content_hash
+        with self._content_hashes_file().open("w") as fp:
+            json.dump(hashes, fp, indent=2)
+
+    @staticmethod
+    def _content_hash(content):
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _blueprint_file(self):
+        return self.cluster_dir / "cluster.yaml"
+
+    def _save_blueprint_hash(self):
+        content = self._blueprint_file().read_text(encoding="utf-8")
+        self._save_content_hash("cluster.yaml", self._content_hash(content))
+
+    def _golden_images_enabled(self):
+        return self.config["server"].get("golden_images", False)
+
+    def _golden_image_file(self):
+        return self.cluster_dir / "golden_image.json"
+
+    def _golden_image_builder(self):
+        base_image = self.config["server"].get("golden_image_base")
+        if not base_image:
+            # The Slurm on GCP image the controller was given
+            state = tfstate.load(self.get_terraform_dir() / "terraform.tfstate")
+            controller = state.instances(_controller_module, "slurm_instance")
+            boot_disk = controller[0]["attributes"]["boot_disk"][0]
+            base_image = boot_disk["initialize_params"][0]["image"]
+        return golden_image.ImageBuilder(
+            self.cluster,
+            self._render_bootstrap("image"),
+            base_image,
+            self.cluster.controller_node.service_account,
+        )
+
+    def _update_golden_image(self):
+        """Build the compute node image if it is out of date, and switch
+        partitions to it
+
+        Partitions with an image of their own are left alone.  Returns the
+        image this replaces, if any, to be deleted once the cluster has been
+        redeployed without it.
+        """
+        try:
+            with self._golden_image_file().open("r") as fp:
+                current = json.load(fp)
+        except FileNotFoundError:
+            current = {}
+
+        builder = self._golden_image_builder()
+        image_hash = builder.image_hash()
+        image = current.get("image")
+        if image_hash != current.get("hash"):
+            image = builder.build(image_hash)
+            with self._golden_image_file().open("w") as fp:
+                json.dump({"hash": image_hash, "image": image}, fp, indent=2)
+
+        partitions = [
+            part
+            for part in self.cluster.partitions.all()
+            if part.image in ["", current.get("image")]
+            and part.image != image
+        ]
+        for part in partitions:
+            part.image = image
+        ClusterPartition.objects.bulk_update(partitions, ["image"])
+
+        if current.get("image") not in [None, image]:
+            return current["image"]
+        return None
+
+    def _delete_golden_image(self, image):
+        try:
+            golden_image.delete_image(self.cluster, image)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning(
+                "Failed to delete compute node image %s",
+                image,
+                exc_info=err,
+            )
+            return False
+        return True
+
+    def _delete_cluster_golden_image(self):
+        """Delete the image of a cluster which has been destroyed"""
+        try:
+            with self._golden_image_file().open("r") as fp:
+                image = json.load(fp).get("image")
+        except FileNotFoundError:
+            return
+        if image and self._delete_golden_image(image):
+            self._golden_image_file().unlink()
+
+    def build_golden_image(self):
+        """Bring the cluster's compute node image up to date, redeploying
+        the cluster to use it if it changed"""
+        if self.cluster.status != "r":
+            raise RuntimeError(
+                f"Cluster {self.cluster.id} is not running, so can't build "
+                "its compute node image"
+            )
+        replaced_image = self._update_golden_image()
+        if self._prepare_ghpc_yaml():
+            self._update_deployment()
+        if replaced_image:
+            self._delete_golden_image(replaced_image)
+
     def _get_credentials_file(self):
         return self.cluster_dir / "cloud_credentials"
 
@@ -138,110 +302,78 @@ class ClusterInfo:
         )
 
     def _prepare_ghpc_filesystems(self):
-        yaml = []
+        modules = []
         refs = []
         for (count, mp) in enumerate(
             self.cluster.mount_points.order_by("mount_order")
         ):
             storage_id = f"mount_num_{count}"
             ip = (
-                "'$controller'"
+                "$controller"
                 if mp.export in self.cluster.shared_fs.exports.all()
                 else mp.export.server_name
             )
-            yaml.append(
-                f"""
-  - source: modules/file-system/pre-existing-network-storage
-    kind: terraform
-    id: {storage_id}
-    settings:
-      server_ip: {ip}
-      remote_mount: {mp.export.export_name}
-      local_mount: {mp.mount_path}
-      mount_options: {mp.mount_options}
-      fs_type: {mp.fstype_name}
-"""
+            modules.append(
+                blueprint.Module(
+                    "modules/file-system/pre-existing-network-storage",
+                    storage_id,
+                    settings={
+                        "server_ip": ip,
+                        "remote_mount": mp.export.export_name,
+                        "local_mount": mp.mount_path,
+                        "mount_options": mp.mount_options or None,
+                        "fs_type": mp.fstype_name,
+                    },
+                )
             )
             refs.append(storage_id)
 
-        return ("\n\n".join(yaml), refs)
+        return (modules, refs)
 
     def _prepare_ghpc_partitions(self, part_uses):
-        yaml = []
+        modules = []
         refs = []
-        uses_str = self._yaml_refs_to_uses(part_uses)
         for (count, part) in enumerate(self.cluster.partitions.all()):
             part_id = f"partition_{count}"
-            yaml.append(
-                f"""
-  - source: community/modules/compute/schedmd-slurm-gcp-v5-partition
-    kind: terraform
-    id: {part_id}
-    use:
-    - {part_id}-group
-{uses_str}
-    settings:
-      partition_name: {part.name}
-      subnetwork_self_link: {self.cluster.subnet.cloud_id}
-      enable_placement: {part.enable_placement}
-      exclusive: {part.enable_placement or not part.enable_node_reuse}
-  - source: community/modules/compute/schedmd-slurm-gcp-v5-node-group
-    id: {part_id}-group
-    use:
-{uses_str}
-    settings:
-      enable_smt: {part.enable_hyperthreads}
-      machine_type: {part.machine_type}
-      node_count_dynamic_max: {part.max_node_count}
-"""
-            )
-
-            if part.image:
-                yaml[-1] += (
-                    f"""\
-      source_image: {part.image}
-"""
-                )
-
-            # Temporarily hack in some A100 support
-            if part.GPU_per_node > 0:
-                yaml[-1] += (
-                    f"""\
-      gpu.count: {part.GPU_per_node}
-      gpu.type: {part.GPU_type}
-"""
+            modules.extend(
+                blueprint.partition_modules(
+                    part_id,
+                    tuple(part_uses),
+                    self.cluster.subnet.cloud_id,
+                    part.name,
+                    part.enable_placement,
+                    part.enable_placement or not part.enable_node_reuse,
+                    part.enable_hyperthreads,
+                    part.machine_type,
+                    part.max_node_count,
+                    image=part.image or "",
+                    gpu_count=part.GPU_per_node,
+                    gpu_type=part.GPU_type,
                 )
+            )
             refs.append(part_id)
 
-        return ("\n\n".join(yaml), refs)
-
-    def _yaml_refs_to_uses(self, use_list):
-        return "\n".join([f"    - {x}" for x in use_list])
+        return (modules, refs)
 
     def _prepare_ghpc_yaml(self):
-        yaml_file = self.cluster_dir / "cluster.yaml"
+        """Write the blueprint, and return whether it differs from the one
+        last deployed"""
+        yaml_file = self._blueprint_file()
         project_id = json.loads(self.cluster.cloud_credential.detail)[
             "project_id"
         ]
 
         (
-            filesystems_yaml,
+            filesystems_modules,
             filesystems_references,
         ) = self._prepare_ghpc_filesystems()
         (
-            partitions_yaml,
+            partitions_modules,
             partitions_references,
         ) = self._prepare_ghpc_partitions(
             ["hpc_network"] + filesystems_references
         )
 
-        controller_uses = self._yaml_refs_to_uses(
-            ["hpc_network"] + partitions_references + filesystems_references
-        )
-        login_uses = self._yaml_refs_to_uses(
-            ["hpc_network"] + filesystems_references
-        )
-
         controller_sa = f"{self.cluster.cloud_id}-sa"
         # TODO: Determine if these all should be different, and if so, add to
         # resource to be created. NOTE though, that at the moment, GHPC won't
@@ -250,140 +382,179 @@ class ClusterInfo:
         # compute_sa = controller_sa
         # login_sa = controller_sa
 
-        # pylint: disable=line-too-long
         startup_bucket = self.config["server"]["gcs_bucket"]
-        with yaml_file.open("w") as f:
-            f.write(
-                f"""
-blueprint_name: {self.cluster.cloud_id}
-
-vars:
-  project_id: {project_id}
-  deployment_name: {self.cluster.cloud_id}
-  region: {self.cluster.cloud_region}
-  zone: {self.cluster.cloud_zone}
-  labels:
-    created_by: {SITE_NAME}
-
-deployment_groups:
-- group: primary
-  modules:
-  - source: modules/network/pre-existing-vpc
-    kind: terraform
-    settings:
-      network_name: {self.cluster.subnet.vpc.cloud_id}
-      subnetwork_name: {self.cluster.subnet.cloud_id}
-    id: hpc_network
-
-{filesystems_yaml}
-
-  - source: community/modules/project/service-account
-    kind: terraform
-    id: hpc_service_account
-    settings:
-      project_id: {project_id}
-      names: [ {controller_sa} ]
-      project_roles:
-      - compute.instanceAdmin.v1
-      - iam.serviceAccountUser
-      - monitoring.metricWriter
-      - logging.logWriter
-      - storage.objectAdmin
-      - pubsub.publisher
-      - pubsub.subscriber
-      - compute.securityAdmin
-      - iam.serviceAccountAdmin
-      - resourcemanager.projectIamAdmin
-      - compute.networkAdmin
-
-{partitions_yaml}
-
-  - source: community/modules/scheduler/schedmd-slurm-gcp-v5-controller
-    kind: terraform
-    id: slurm_controller
-    settings:
-      machine_type: {self.cluster.controller_instance_type}
-      disk_type: {self.cluster.controller_disk_type}
-      disk_size_gb: {self.cluster.controller_disk_size}
-      service_account:
-        email: $(hpc_service_account.email)
-        scopes:
-        - https://www.googleapis.com/auth/cloud-platform
-        - https://www.googleapis.com/auth/monitoring.write
-        - https://www.googleapis.com/auth/logging.write
-        - https://www.googleapis.com/auth/devstorage.read_write
-        - https://www.googleapis.com/auth/pubsub
-      controller_startup_script: |
-        #!/bin/bash
-        echo "******************************************** CALLING CONTROLLER STARTUP"
-        gsutil cp gs://{startup_bucket}/clusters/{self.cluster.id}/bootstrap_controller.sh - | bash
-      compute_startup_script: |
-        #!/bin/bash
-        gsutil cp gs://{startup_bucket}/clusters/{self.cluster.id}/bootstrap_compute.sh - | bash
-#TODO:     enable_cleanup_compute: True
-#TODO:     enable_cleanup_subscriptions: True
-    use:
-{controller_uses}
-
-  - source: community/modules/scheduler/schedmd-slurm-gcp-v5-login
-    kind: terraform
-    id: slurm_login
-    settings:
-      num_instances: {self.cluster.num_login_nodes}
-      subnetwork_self_link: {self.cluster.subnet.cloud_id}
-      machine_type: {self.cluster.login_node_instance_type}
-      disk_type: {self.cluster.login_node_disk_type}
-      disk_size_gb: {self.cluster.login_node_disk_size}
-      service_account:
-        email: $(hpc_service_account.email)
-        scopes:
-        - https://www.googleapis.com/auth/cloud-platform
-        - https://www.googleapis.com/auth/monitoring.write
-        - https://www.googleapis.com/auth/logging.write
-        - https://www.googleapis.com/auth/devstorage.read_write
-      startup_script: |
-        #!/bin/bash
-        echo "******************************************** CALLING LOGIN STARTUP"
-        gsutil cp gs://{startup_bucket}/clusters/{self.cluster.id}/bootstrap_login.sh - | bash
-    use:
-    - slurm_controller
-{login_uses}
-
-"""
+        scripts_url = f"gs://{startup_bucket}/clusters/{self.cluster.id}"
+        scopes = [
+            "https://www.googleapis.com/auth/cloud-platform",
+            "https://www.googleapis.com/auth/monitoring.write",
+            "https://www.googleapis.com/auth/logging.write",
+            "https://www.googleapis.com/auth/devstorage.read_write",
+        ]
+
+        bp = blueprint.Blueprint(
+            self.cluster.cloud_id,
+            {
+                "project_id": project_id,
+                "deployment_name": self.cluster.cloud_id,
+                "region": self.cluster.cloud_region,
+                "zone": self.cluster.cloud_zone,
+                "labels": {"created_by": SITE_NAME},
+            },
+        )
+        bp.add(
+            blueprint.Module(
+                "modules/network/pre-existing-vpc",
+                "hpc_network",
+                settings={
+                    "network_name": self.cluster.subnet.vpc.cloud_id,
+                    "subnetwork_name": self.cluster.subnet.cloud_id,
+                },
+            )
+        )
+        bp.add(*filesystems_modules)
+        bp.add(
+            blueprint.Module(
+                "community/modules/project/service-account",
+                "hpc_service_account",
+                settings={
+                    "project_id": project_id,
+                    "names": [controller_sa],
+                    "project_roles": [
+                        "compute.instanceAdmin.v1",
+                        "iam.serviceAccountUser",
+                        "monitoring.metricWriter",
+                        "logging.logWriter",
+                        "storage.objectAdmin",
+                        "pubsub.publisher",
+                        "pubsub.subscriber",
+                        "compute.securityAdmin",
+                        "iam.serviceAccountAdmin",
+                        "resourcemanager.projectIamAdmin",
+                        "compute.networkAdmin",
+                    ],
+                },
             )
+        )
+        bp.add(*partitions_modules)
+        # pylint: disable=line-too-long
+        bp.add(
+            blueprint.Module(
+                "community/modules/scheduler/schedmd-slurm-gcp-v5-controller",
+                "slurm_controller",
+                settings={
+                    "machine_type": self.cluster.controller_instance_type,
+                    "disk_type": self.cluster.controller_disk_type,
+                    "disk_size_gb": self.cluster.controller_disk_size,
+                    "service_account": {
+                        "email": "$(hpc_service_account.email)",
+                        "scopes": scopes
+                        + ["https://www.googleapis.com/auth/pubsub"],
+                    },
+                    "controller_startup_script": (
+                        "#!/bin/bash\n"
+                        'echo "******************************************** CALLING CONTROLLER STARTUP"\n'
+                        f"gsutil cp {scripts_url}/bootstrap_controller.sh - | bash\n"
+                    ),
+                    "compute_startup_script": (
+                        "#!/bin/bash\n"
+                        f"gsutil cp {scripts_url}/bootstrap_compute.sh - | bash\n"
+                    ),
+                    # TODO: enable_cleanup_compute: True
+                    # TODO: enable_cleanup_subscriptions: True
+                },
+                use=["hpc_network"]
+                + partitions_references
+                + filesystems_references,
+            ),
+            blueprint.Module(
+                "community/modules/scheduler/schedmd-slurm-gcp-v5-login",
+                "slurm_login",
+                settings={
+                    "num_instances": self.cluster.num_login_nodes,
+                    "subnetwork_self_link": self.cluster.subnet.cloud_id,
+                    "machine_type": self.cluster.login_node_instance_type,
+                    "disk_type": self.cluster.login_node_disk_type,
+                    "disk_size_gb": self.cluster.login_node_disk_size,
+                    "service_account": {
+                        "email": "$(hpc_service_account.email)",
+                        "scopes": scopes,
+                    },
+                    "startup_script": (
+                        "#!/bin/bash\n"
+                        'echo "******************************************** CALLING LOGIN STARTUP"\n'
+                        f"gsutil cp {scripts_url}/bootstrap_login.sh - | bash\n"
+                    ),
+                },
+                use=["slurm_controller", "hpc_network"]
+                + filesystems_references,
+            ),
+        )
+        # pylint: enable=line-too-long
+        blueprint_yaml = bp.to_yaml()
 
-    # pylint: enable=line-too-long
+        if (
+            not yaml_file.exists()
+            or yaml_file.read_text(encoding="utf-8") != blueprint_yaml
+        ):
+            with yaml_file.open("w") as f:
+                f.write(blueprint_yaml)
 
-    def _prepare_bootstrap_gcs(self):
-        template_dir = (
+        deployed_hash = self._load_content_hashes().get("cluster.yaml")
+        return self._content_hash(blueprint_yaml) != deployed_hash
+
+    def _render_bootstrap(self, templ):
+        template_fn = (
             self.config["baseDir"]
             / "infrastructure_files"
             / "cluster_startup"
             / "templates"
+            / f"bootstrap_{templ}.sh"
         )
         engine = template_engines["django"]
-        for templ in ["controller", "login", "compute"]:
-            template_fn = template_dir / f"bootstrap_{templ}.sh"
-            with open(template_fn, "r", encoding="utf-8") as fp:
-                tstr = fp.read()
-                template = engine.from_string(tstr)
-                # TODO: Add to context any other information we may need in the
-                # startup script
-                rendered_file = template.render(
-                    context={
-                        "server_bucket": self.config["server"]["gcs_bucket"],
-                        "cluster": self.cluster,
-                        "spack_dir": self.cluster.spackdir,
-                        "fec2_topic": c2.get_topic_path(),
-                        "fec2_subscription": c2.get_cluster_subscription_path(
-                            self.cluster.id
-                        ),
-                    }
-                )
-                blobpath = f"clusters/{self.cluster.id}/{template_fn.name}"
-                cloud_info.gcs_upload_file(
-                    self.config["server"]["gcs_bucket"], blobpath, rendered_file
-                )
+        with open(template_fn, "r", encoding="utf-8") as fp:
+            tstr = fp.read()
+            template = engine.from_string(tstr)
+            # TODO: Add to context any other information we may need in the
+            # startup script
+            return template.render(
+                context={
+                    "server_bucket": self.config["server"]["gcs_bucket"],
+                    "cluster": self.cluster,
+                    "spack_dir": self.cluster.spackdir,
+                    "fec2_topic": c2.get_topic_path(),
+                    "fec2_subscription": c2.get_cluster_subscription_path(
+                        self.cluster.id
+                    ),
+                }
+            )
+
+    def _prepare_bootstrap_gcs(self):
+        rendered_files = {
+            f"clusters/{self.cluster.id}/bootstrap_{templ}.sh": (
+                self._render_bootstrap(templ)
+            )
+            for templ in ["controller", "login", "compute"]
+        }
+
+        # Only upload scripts which differ from those already uploaded
+        uploaded_hashes = self._load_content_hashes()
+        changed_files = {
+            blobpath: rendered_file
+            for (blobpath, rendered_file) in rendered_files.items()
+            if uploaded_hashes.get(blobpath)
+            != self._content_hash(rendered_file)
+        }
+        if not changed_files:
+            return
+        logger.info(
+            "Uploading changed bootstrap scripts: %s",
+            ", ".join(sorted(changed_files)),
+        )
+        cloud_info.gcs_upload_files(
+            self.config["server"]["gcs_bucket"], changed_files
+        )
+        for (blobpath, rendered_file) in changed_files.items():
+            self._save_content_hash(blobpath, self._content_hash(rendered_file))
 
     def _initialize_terraform(self):
         terraform_dir = self.get_terraform_dir()
@@ -393,9 +564,9 @@ deployment_groups:
         try:
             logger.info("Invoking Terraform Init")
             utils.run_terraform(terraform_dir, "init")
-            utils.run_terraform(terraform_dir, "validate", extra_env=extra_env)
+            # Plan also validates; the plan is saved for _apply_terraform()
             logger.info("Invoking Terraform Plan")
-            utils.run_terraform(terraform_dir, "plan", extra_env=extra_env)
+            utils.plan_terraform(terraform_dir, extra_env=extra_env)
         except subprocess.CalledProcessError as cpe:
             logger.error("Terraform exec failed", exc_info=cpe)
             if cpe.stdout:
@@ -406,6 +577,10 @@ deployment_groups:
 
     def _run_ghpc(self):
         target_dir = self.cluster_dir
+        ghpc_cmd = [self.ghpc_path.as_posix(), "create", "cluster.yaml"]
+        # Re-generating an existing deployment keeps its Terraform state
+        if (target_dir / self.cluster.cloud_id).is_dir():
+            ghpc_cmd.append("-w")
         try:
             logger.info("Invoking ghpc create")
             log_out_fn = target_dir / "ghpc_create_log.stdout"
@@ -413,7 +588,7 @@ deployment_groups:
             with log_out_fn.open("wb") as log_out:
                 with log_err_fn.open("wb") as log_err:
                     subprocess.run(
-                        [self.ghpc_path.as_posix(), "create", "cluster.yaml"],
+                        ghpc_cmd,
                         cwd=target_dir,
                         stdout=log_out,
                         stderr=log_err,
@@ -424,78 +599,152 @@ deployment_groups:
             # No logs from stdout/err - get dumped to files
             raise
 
-    def _get_tf_state_resource(self, state, filters):
-        """Given a Terraform State json file, look for the Resource that matches
-        each entry in the supplied filters dictionary.
+    def _instance_fields_from_tf(self, tf):
+        """ComputeInstance field values for an instance in Terraform state"""
+        fields = {
+            "cloud_credential_id": self.cluster.cloud_credential_id,
+            "cloud_state": "m",
+            "cloud_region": self.cluster.cloud_region,
+            "cloud_zone": self.cluster.cloud_zone,
+            "cloud_id": None,
+            "instance_type": "",
+            "internal_ip": None,
+            "public_ip": None,
+            "service_account": "",
+        }
 
-        Returns each match
-        """
+        try:
+            fields["cloud_id"] = tf["attributes"]["name"]
+            fields["instance_type"] = tf["attributes"]["machine_type"]
+        except KeyError:
+            pass
 
-        def matches(x):
-            try:
-                for k, v in filters.items():
-                    if x[k] != v:
-                        return False
-                return True
-            except KeyError:
-                return False
-
-        return list(filter(matches, state["resources"]))
-
-    def _create_model_instances_from_tf_state(self, state, filters):
-        tf_nodes = self._get_tf_state_resource(state, filters)[0]["instances"]
-
-        def model_from_tf(tf):
-            ci_kwargs = {
-                "id": None,
-                "cloud_credential": self.cluster.cloud_credential,
-                "cloud_state": "m",
-                "cloud_region": self.cluster.cloud_region,
-                "cloud_zone": self.cluster.cloud_zone,
-            }
+        try:
+            nic = tf["attributes"]["network_interface"][0]
+            fields["internal_ip"] = nic["network_ip"]
+            fields["public_ip"] = nic["access_config"][0]["nat_ip"]
+        except (KeyError, IndexError):
+            pass
 
-            try:
-                ci_kwargs["cloud_id"] = tf["attributes"]["name"]
-                ci_kwargs["instance_type"] = tf["attributes"]["machine_type"]
-            except KeyError:
-                pass
+        try:
+            service_acct = tf["attributes"]["service_account"][0]
+            fields["service_account"] = service_acct["email"]
+        except (KeyError, IndexError):
+            pass
+
+        return fields
+
+    @staticmethod
+    def _merge_instance_fields(instance, fields):
+        """Set fields on instance, returning the names of those that changed"""
+        changed = [
+            name for (name, value) in fields.items()
+            if getattr(instance, name) != value
+        ]
+        for name in changed:
+            setattr(instance, name, fields[name])
+        return changed
 
-            try:
-                nic = tf["attributes"]["network_interface"][0]
-                ci_kwargs["internal_ip"] = nic["network_ip"]
-                ci_kwargs["public_ip"] = nic["access_config"][0]["nat_ip"]
-            except (KeyError, IndexError):
-                pass
+    def import_instances(self, state):
+        """Create or update the controller and login node records
 
-            try:
-                service_acct = tf["attributes"]["service_account"][0]
-                ci_kwargs["service_account"] = service_acct["email"]
-            except (KeyError, IndexError):
-                pass
+        Records are matched to the instances in the Terraform state by name.
+        Only new and changed records are written, in one transaction, and
+        records of login nodes no longer in the state are removed, so
+        importing an unchanged state again writes nothing.
+        """
+        controllers = [
+            self._instance_fields_from_tf(tf)
+            for tf in state.instances(_controller_module, "slurm_instance")
+        ]
+        if len(controllers) != 1:
+            logger.warning(
+                "Found %d contoller nodes, there should be only 1",
+                len(controllers),
+            )
+        logins = [
+            self._instance_fields_from_tf(tf)
+            for tf in state.instances(_login_module, "slurm_instance")
+        ]
+        if len(logins) != self.cluster.num_login_nodes:
+            logger.warning(
+                "Found %d login nodes, expected %d from config",
+                len(logins),
+                self.cluster.num_login_nodes,
+            )
 
-            return ComputeInstance(**ci_kwargs)
+        created = 0
+        to_update = []
+        changed_fields = set()
+        with transaction.atomic():
+            controller = self.cluster.controller_node
+            if controllers:
+                if controller is None:
+                    # Saved alone, as the cluster needs its ID
+                    controller = ComputeInstance(**controllers[0])
+                    controller.save()
+                else:
+                    changed = self._merge_instance_fields(
+                        controller, controllers[0]
+                    )
+                    if changed:
+                        to_update.append(controller)
+                        changed_fields.update(changed)
+                logger.info(
+                    "Cluster controller node has IP address %s",
+                    controller.public_ip
+                    if controller.public_ip
+                    else controller.internal_ip,
+                )
 
-        return [model_from_tf(instance) for instance in tf_nodes]
+            existing = {
+                node.cloud_id: node for node in self.cluster.login_nodes.all()
+            }
+            for fields in logins:
+                node = existing.pop(fields["cloud_id"], None)
+                if node is None:
+                    # ComputeInstance inherits from CloudResource, so new
+                    # records can't be created in bulk
+                    ComputeInstance(cluster_login=self.cluster, **fields).save()
+                    created += 1
+                else:
+                    changed = self._merge_instance_fields(node, fields)
+                    if changed:
+                        to_update.append(node)
+                        changed_fields.update(changed)
+
+            if to_update:
+                ComputeInstance.objects.bulk_update(
+                    to_update, sorted(changed_fields)
+                )
+            if existing:
+                ComputeInstance.objects.filter(
+                    pk__in=[node.pk for node in existing.values()]
+                ).delete()
+
+            if controller and self.cluster.controller_node_id != controller.pk:
+                self.cluster.controller_node = controller
+                self.cluster.save(update_fields=["controller_node"])
+
+        logger.info(
+            "Login nodes: %d created, %d updated, %d removed",
+            created,
+            len([node for node in to_update if node is not controller]),
+            len(existing),
+        )
 
-    def _get_service_accounts(self, tf_state):
+    def _get_service_accounts(self, state):
         # TODO:  Once we're creating service accounts, can pull them from those
         # resources At the moment, pull from controller & login instances. This
         # misses "compute" nodes, but they're going to just be the same as
         # controller & login until we start setting them.
 
-        filters = {
-            "module": "module.slurm_controller.module.slurm_controller_instance.module.slurm_controller_instance",  #pylint:disable=line-too-long
-            "name": "slurm_instance",
-        }
-        tf_node = self._get_tf_state_resource(tf_state, filters)[0]["instances"][0]  #pylint:disable=line-too-long
-        ctrl_sa = tf_node["attributes"]["service_account"][0]["email"]
-
-        filters = {
-            "module": "module.slurm_login.module.slurm_login_instance.module.slurm_login_instance",  #pylint:disable=line-too-long
-            "name": "slurm_instance",
-        }
-        tf_node = self._get_tf_state_resource(tf_state, filters)[0]["instances"][0]  #pylint:disable=line-too-long
-        login_sa = tf_node["attributes"]["service_account"][0]["email"]
+        (ctrl_node, login_node) = (
+            state.instances(module, "slurm_instance")[0]
+            for module in [_controller_module, _login_module]
+        )
+        ctrl_sa = ctrl_node["attributes"]["service_account"][0]["email"]
+        login_sa = login_node["attributes"]["service_account"][0]["email"]
 
         return {"controller": ctrl_sa, "login": login_sa, "compute": login_sa}
 
@@ -541,73 +790,29 @@ deployment_groups:
         }
         try:
             logger.info("Invoking Terraform Apply")
-            utils.run_terraform(terraform_dir, "apply", extra_env=extra_env)
+            utils.apply_terraform(terraform_dir, extra_env=extra_env)
 
             # Look for Management and Login Nodes in TF state file
-            tf_state_file = terraform_dir / "terraform.tfstate"
-            with tf_state_file.open("r") as statefp:
-                state = json.load(statefp)
-
-                # Apply Perms to the service accounts
-                service_accounts = self._get_service_accounts(state)
-                self._apply_service_account_permissions(service_accounts)
-
-                # Cluster is now being initialized
-                self.cluster.internal_name = self.cluster.name
-                self.cluster.cloud_state = "m"
-
-                # Cluster initialization is now running.
-                self.cluster.status = "i"
-                self.cluster.save()
-
-                mgmt_nodes = self._create_model_instances_from_tf_state(
-                    state,
-                    {
-                        "module": "module.slurm_controller.module.slurm_controller_instance.module.slurm_controller_instance",  # pylint: disable=line-too-long
-                        "name": "slurm_instance",
-                    },
-                )
-                if len(mgmt_nodes) != 1:
-                    logger.warning(
-                        "Found %d contoller nodes, there should be only 1",
-                        len(mgmt_nodes),
-                    )
-                if len(mgmt_nodes):
-                    node = mgmt_nodes[0]
-                    node.save()
-                    self.cluster.controller_node = node
-                    logger.info(
-                        "Created cluster controller node with IP address %s",
-                        node.public_ip if node.public_ip else node.internal_ip,
-                    )
+            state = tfstate.load(terraform_dir / "terraform.tfstate")
 
-                login_nodes = self._create_model_instances_from_tf_state(
-                    state,
-                    {
-                        "module": "module.slurm_login.module.slurm_login_instance.module.slurm_login_instance",   # pylint: disable=line-too-long
-                        "name": "slurm_instance",
-                    },
-                )
-                if len(login_nodes) != self.cluster.num_login_nodes:
-                    logger.warning(
-                        "Found %d login nodes, expected %d from config",
-                        len(login_nodes),
-                        self.cluster.num_login_nodes,
-                    )
-                for lnode in login_nodes:
-                    lnode.cluster_login = self.cluster
-                    lnode.save()
-                    logger.info(
-                        "Created login node with IP address %s",
-                        lnode.public_ip
-                        if lnode.public_ip
-                        else lnode.internal_ip,
-                    )
+            # Apply Perms to the service accounts
+            service_accounts = self._get_service_accounts(state)
+            self._apply_service_account_permissions(service_accounts)
+
+            # Cluster is now being initialized
+            self.cluster.internal_name = self.cluster.name
+            self.cluster.cloud_state = "m"
 
-                # Set up Spack Install location
-                self._configure_spack_install_loc()
+            # Cluster initialization is now running.
+            self.cluster.status = "i"
+            self.cluster.save()
+
+            self.import_instances(state)
 
-                self.cluster.save()
+            # Set up Spack Install location
+            self._configure_spack_install_loc()
+
+            self.cluster.save()
 
         except subprocess.CalledProcessError as err:
             # We can error during provisioning, in which case Terraform
@@ -620,6 +825,27 @@ deployment_groups:
             self._destroy_terraform()
             raise
 
+    def _update_deployment(self):
+        """Apply a changed blueprint to a running cluster"""
+        logger.info("Blueprint changed, updating cluster %s", self.cluster.id)
+        self._run_ghpc()
+        self._initialize_terraform()
+        extra_env = {
+            "GOOGLE_APPLICATION_CREDENTIALS": self._get_credentials_file()
+        }
+        try:
+            logger.info("Invoking Terraform Apply")
+            utils.apply_terraform(self.get_terraform_dir(), extra_env=extra_env)
+        except subprocess.CalledProcessError as err:
+            # Unlike a new cluster, leave whatever is running as it is
+            logger.error("Terraform apply failed", exc_info=err)
+            raise
+        self._save_blueprint_hash()
+        # The login nodes may have been added, removed or replaced
+        self.import_instances(
+            tfstate.load(self.get_terraform_dir() / "terraform.tfstate")
+        )
+
     def _destroy_terraform(self):
         terraform_dir = self.get_terraform_dir()
         extra_env = {
@@ -646,6 +872,8 @@ deployment_groups:
             self.cluster.save()
 
             c2.delete_cluster_subscription(self.cluster.id, controller_sa)
+            # Nothing uses the cluster's image any more
+            self._delete_cluster_golden_image()
             logger.info("Terraform destroy completed")
 
         except subprocess.CalledProcessError as err:
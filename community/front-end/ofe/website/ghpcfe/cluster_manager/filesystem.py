@@ -22,6 +22,8 @@ from pathlib import Path
 
 from ..models import GCPFilestoreFilesystem, Filesystem, FilesystemImpl
 
+from . import blueprint
+from . import cloud_info
 from . import utils
 
 from website.settings import SITE_NAME
@@ -35,35 +37,32 @@ def write_filestore_yaml(fs: GCPFilestoreFilesystem, target_dir: Path) -> None:
     # Get first (only) export
     export_name = fs.exports.first().export_name
 
-    with yaml_file.open("w") as f:
-        f.write(
-            f"""
-blueprint_name: {fs.name}
-
-vars:
-  project_id: {project_id}
-  deployment_name: {fs.name}
-  region: {fs.cloud_region}
-  zone: {fs.cloud_zone}
-  labels:
-    created_by: {SITE_NAME}
-
-deployment_groups:
-- group: primary
-  modules:
-  - source: modules/file-system/filestore
-    kind: terraform
-    id: {fs.name}
-    settings:
-      filestore_share_name: {export_name[1:]}
-      network_name: {fs.vpc.cloud_id}
-      zone: {fs.cloud_zone}
-      size_gb: {fs.capacity}
-      filestore_tier: {fs.get_performance_tier_display()}
-    outputs:
-    - network_storage
-"""
+    bp = blueprint.Blueprint(
+        fs.name,
+        {
+            "project_id": project_id,
+            "deployment_name": fs.name,
+            "region": fs.cloud_region,
+            "zone": fs.cloud_zone,
+            "labels": {"created_by": SITE_NAME},
+        },
+    )
+    bp.add(
+        blueprint.Module(
+            "modules/file-system/filestore",
+            fs.name,
+            settings={
+                "filestore_share_name": export_name[1:],
+                "network_name": fs.vpc.cloud_id,
+                "zone": fs.cloud_zone,
+                "size_gb": fs.capacity,
+                "filestore_tier": fs.get_performance_tier_display(),
+            },
+            outputs=["network_storage"],
         )
+    )
+    with yaml_file.open("w") as f:
+        f.write(bp.to_yaml())
 
 
 def update_filesystem(fs: Filesystem) -> None:
@@ -122,10 +121,9 @@ def start_filesystem(fs: Filesystem) -> None:
         }
         target_dir = _tf_dir_for_fs(fs)
         utils.run_terraform(target_dir, "init")
-        utils.run_terraform(target_dir, "plan", extra_env=extra_env)
 
         logger.info("Invoking terraform apply for fs %s:%s", fs.id, fs.name)
-        utils.run_terraform(target_dir, "apply", extra_env=extra_env)
+        utils.apply_terraform(target_dir, extra_env=extra_env)
 
         logger.info(
             "terraform apply complete, getting status for fs %s:%s",
@@ -142,6 +140,7 @@ def start_filesystem(fs: Filesystem) -> None:
             fs.hostname_or_ip = data["server_ip"]
             fs.cloud_state = "m"
             fs.save()
+        cloud_info.invalidate_filestore_cache()
     except subprocess.CalledProcessError as cpe:
         fs.cloud_state = "nm"
         fs.save()
@@ -157,6 +156,7 @@ def destroy_filesystem(fs: Filesystem) -> None:
     target_dir = _tf_dir_for_fs(fs)
     extra_env = {"GOOGLE_APPLICATION_CREDENTIALS": _get_credentials_file(fs)}
     utils.run_terraform(target_dir, "destroy", extra_env=extra_env)
+    cloud_info.invalidate_filestore_cache()
 
 
 def get_terraform_dir(fs: Filesystem) -> Path:
@@ -0,0 +1,218 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Golden images for cluster compute nodes
+
+Compute nodes otherwise install ansible and run the whole compute playbook
+each time they boot, which takes minutes per node.  A golden image has the
+parts of that which don't need the cluster's filesystems (compute_image.yaml)
+done already, so nodes booted from it only run compute_runtime.yaml.
+
+Images are built in the style of Packer: a builder VM boots the base image
+with bootstrap_image.sh as its startup script, reports through a guest
+attribute when that is done, and is then stopped and imaged.
+"""
+
+import hashlib
+import logging
+import time
+
+from website.settings import SITE_NAME
+
+from . import cloud_info
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks on the builder VM
+_poll_interval = 30
+
+_status_attribute = "ghpcfe/image-build"
+
+
+def _update_tree_hash(digest, path):
+    for file_path in sorted(path.rglob("*")):
+        if file_path.is_file():
+            digest.update(file_path.relative_to(path).as_posix().encode())
+            digest.update(file_path.read_bytes())
+
+
+class ImageBuilder:
+    """Builds the golden image for one cluster's compute nodes"""
+
+    def __init__(self, cluster, bootstrap_script, base_image, service_account):
+        self.config = utils.load_config()
+        self.cluster = cluster
+        self.credentials = cluster.cloud_credential.detail
+        self.bootstrap_script = bootstrap_script
+        self.base_image = base_image
+        self.service_account = service_account
+
+    def image_hash(self):
+        """Hash of everything which goes into the image
+
+        A change to any of these (the base image, the rendered bootstrap
+        script or the ansible roles) means the image must be rebuilt.
+        """
+        digest = hashlib.sha256()
+        digest.update(self.base_image.encode("utf-8"))
+        digest.update(self.bootstrap_script.encode("utf-8"))
+        _update_tree_hash(
+            digest,
+            self.config["baseDir"]
+            / "infrastructure_files"
+            / "gcs_bucket"
+            / "clusters"
+            / "ansible_setup",
+        )
+        return digest.hexdigest()
+
+    def _name(self, kind, image_hash):
+        # GCE names are at most 63 characters
+        return f"{self.cluster.cloud_id[:40]}-{kind}-{image_hash[:12]}"
+
+    def image_name(self, image_hash):
+        return self._name("image", image_hash)
+
+    def _report(self, message):
+        logger.info("Cluster %s image: %s", self.cluster.id, message)
+        report = utils.current_progress_reporter()
+        if report:
+            report(image=message)
+
+    def _builder_body(self, name, image_hash):
+        server = self.config["server"]
+        zone = self.cluster.cloud_zone
+        return {
+            "name": name,
+            "machineType": (
+                f"zones/{zone}/machineTypes/"
+                f"{server.get('golden_image_machine_type', 'n2-standard-4')}"
+            ),
+            "labels": {"created_by": SITE_NAME},
+            "disks": [
+                {
+                    "boot": True,
+                    "autoDelete": True,
+                    "initializeParams": {
+                        "sourceImage": self.base_image,
+                        "diskSizeGb": server.get("golden_image_disk_size", 50),
+                    },
+                }
+            ],
+            # No external IP, the same as the compute nodes
+            "networkInterfaces": [
+                {
+                    "subnetwork": (
+                        f"regions/{self.cluster.cloud_region}/subnetworks/"
+                        f"{self.cluster.subnet.cloud_id}"
+                    )
+                }
+            ],
+            "serviceAccounts": [
+                {
+                    "email": self.service_account,
+                    "scopes": [
+                        "https://www.googleapis.com/auth/cloud-platform"
+                    ],
+                }
+            ],
+            "metadata": {
+                "items": [
+                    {"key": "startup-script", "value": self.bootstrap_script},
+                    {"key": "enable-guest-attributes", "value": "TRUE"},
+                    {"key": "ghpcfe-image-hash", "value": image_hash},
+                ]
+            },
+        }
+
+    def _wait_for_builder(self, name):
+        zone = self.cluster.cloud_zone
+        timeout = self.config["server"].get("golden_image_timeout", 3600)
+        start = time.monotonic()
+        while True:
+            status = cloud_info.gcp_get_guest_attribute(
+                self.credentials, zone, name, _status_attribute
+            )
+            if status == "done":
+                return
+            elapsed = int(time.monotonic() - start)
+            if status == "failed" or elapsed > timeout:
+                output = cloud_info.gcp_get_serial_port_output(
+                    self.credentials, zone, name
+                )
+                logger.error(
+                    "Image builder %s output (last 100 lines):\n%s",
+                    name,
+                    "\n".join(output.splitlines()[-100:]),
+                )
+                raise RuntimeError(
+                    f"Image builder {name} "
+                    + ("failed" if status == "failed" else "timed out")
+                )
+            self._report(
+                f"setting up builder VM {name} "
+                f"({elapsed // 60}m {elapsed % 60}s)"
+            )
+            time.sleep(_poll_interval)
+
+    def build(self, image_hash):
+        """Build the image, returning its path"""
+        zone = self.cluster.cloud_zone
+        name = self._name("imgbuild", image_hash)
+        self._report(f"creating builder VM {name} from {self.base_image}")
+        try:
+            # The insert can fail after the VM has been created, such as
+            # waiting for the operation, so clean up after that too
+            cloud_info.gcp_create_instance(
+                self.credentials, zone, self._builder_body(name, image_hash)
+            )
+            self._wait_for_builder(name)
+            self._report("stopping builder VM")
+            cloud_info.gcp_stop_instance(self.credentials, zone, name)
+            image_name = self.image_name(image_hash)
+            self._report(f"creating image {image_name}")
+            image = cloud_info.gcp_create_image(
+                self.credentials,
+                {
+                    "name": image_name,
+                    "sourceDisk": f"zones/{zone}/disks/{name}",
+                    "labels": {"created_by": SITE_NAME},
+                    "description": (
+                        f"Compute node image for cluster {self.cluster.name}"
+                    ),
+                },
+            )
+        finally:
+            try:
+                cloud_info.gcp_delete_instance(self.credentials, zone, name)
+            # Don't hide the error which got us here
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning(
+                    "Failed to delete image builder %s", name, exc_info=err
+                )
+        self._report(f"created {image}")
+        return image
+
+
+def delete_image(cluster, image):
+    """Delete an image built for a cluster, given its path
+
+    Unlike building, this needs nothing from the cluster's deployment, so
+    works once the cluster has been destroyed.
+    """
+    logger.info("Cluster %s image: deleting %s", cluster.id, image)
+    cloud_info.gcp_delete_image(
+        cluster.cloud_credential.detail, image.rsplit("/", 1)[-1]
+    )
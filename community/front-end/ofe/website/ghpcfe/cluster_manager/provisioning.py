@@ -0,0 +1,307 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bring up several related cloud resources at once
+
+A Pipeline is given the resources wanted (VPCs, filesystems, clusters and
+workbenches) and works out what each depends on: a filesystem needs its VPC,
+a cluster needs its VPC and the filesystems it mounts, and so on.  Each
+resource's Terraform runs as soon as everything it needs is up, so
+independent resources are created concurrently rather than one after
+another.
+"""
+
+import contextlib
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import filesystem as cm_fs
+from . import utils
+from . import vpc as cm_vpc
+from .clusterinfo import ClusterInfo
+from .workbenchinfo import WorkbenchInfo
+from ..models import FilesystemImpl
+
+logger = logging.getLogger(__name__)
+
+# For each state field: states of resources which are already up, so
+# aren't provisioned again; states of those which are being created or
+# destroyed elsewhere, or are gone, so can't be; the transitional state
+# while provisioning; and the state left after a failure.
+_states = {
+    "cloud_state": {
+        "ready": ["i", "m"],
+        "busy": ["cm", "dm"],
+        "destroyed": ["xm"],
+        "starting": "cm",
+        "failed": "um",
+    },
+    "status": {
+        "ready": ["i", "r"],
+        "busy": ["c", "t"],
+        "destroyed": ["d"],
+        "starting": "c",
+        "failed": "e",
+    },
+}
+
+_current_step = threading.local()
+
+
+def _is_ready(resource, field):
+    return getattr(resource, field) in _states[field]["ready"]
+
+
+@contextlib.contextmanager
+def _provisioning(resource, field):
+    """Hold a resource in its transitional state while it is provisioned
+
+    Fails if the resource is busy or destroyed.  The check and the change of
+    state are one update, so two pipelines can't both start a resource.
+    """
+    states = _states[field]
+    started = (
+        type(resource)
+        .objects.filter(pk=resource.pk)
+        .exclude(**{f"{field}__in": states["busy"] + states["destroyed"]})
+        .update(**{field: states["starting"]})
+    )
+    if not started:
+        resource.refresh_from_db(fields=[field])
+        state = getattr(resource, field)
+        reason = "destroyed" if state in states["destroyed"] else "busy"
+        raise RuntimeError(
+            f"{resource} is {reason} "
+            f"({getattr(resource, f'get_{field}_display')()})"
+        )
+    setattr(resource, field, states["starting"])
+    try:
+        yield
+    except Exception:
+        resource.refresh_from_db(fields=[field])
+        if getattr(resource, field) == states["starting"]:
+            setattr(resource, field, states["failed"])
+            resource.save()
+        raise
+
+
+class Step:
+    """Provisioning of one resource"""
+
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = set(requires)
+        # waiting, running, done, failed or skipped (a requirement failed)
+        self.state = "waiting"
+        self.error = None
+
+
+class Pipeline:
+    """Runs provisioning steps concurrently, in dependency order"""
+
+    def __init__(self, max_workers=None, log_dir=None, on_progress=None):
+        config = utils.load_config()
+        self.max_workers = max_workers or config["server"].get(
+            "provisioning_concurrency", 4
+        )
+        self.log_dir = log_dir or (
+            config["baseDir"]
+            / "provisioning"
+            / timezone.now().strftime("%Y%m%d-%H%M%S")
+        )
+        self.on_progress = on_progress
+        self.steps = {}
+
+    def add(self, name, func, requires=()):
+        """Add a step, which runs once all steps named in requires are done"""
+        if name not in self.steps:
+            unknown = set(requires) - set(self.steps)
+            if unknown:
+                raise ValueError(f"Step {name} requires unknown {unknown}")
+            self.steps[name] = Step(name, func, requires)
+        return name
+
+    def add_vpc(self, vpc):
+        if _is_ready(vpc, "cloud_state"):
+            return None
+
+        def provision():
+            with _provisioning(vpc, "cloud_state"):
+                if not cm_vpc.get_terraform_dir(vpc).is_dir():
+                    cm_vpc.create_vpc(vpc)
+                for subnet in vpc.subnets.all():
+                    if subnet.is_managed:
+                        cm_vpc.create_subnet(subnet)
+                cm_vpc.start_vpc(vpc)
+                vpc.cloud_state = "m"
+                vpc.save()
+
+        return self.add(f"vpc-{vpc.id}", provision)
+
+    def add_filesystem(self, fs):
+        if (
+            _is_ready(fs, "cloud_state")
+            or fs.impl_type != FilesystemImpl.GCPFILESTORE
+        ):
+            return None
+        requires = self._names(self.add_vpc(fs.vpc))
+
+        def provision():
+            with _provisioning(fs, "cloud_state"):
+                cm_fs.create_filesystem(fs)
+                cm_fs.start_filesystem(fs)
+                fs.cloud_state = "m"
+                fs.save()
+
+        return self.add(f"filesystem-{fs.id}", provision, requires)
+
+    def _add_mount_filesystems(self, mount_points):
+        return [
+            self.add_filesystem(mp.export.filesystem)
+            for mp in mount_points.select_related("export__filesystem")
+        ]
+
+    def add_cluster(self, cluster):
+        if _is_ready(cluster, "status"):
+            return None
+        requires = self._names(
+            self.add_vpc(cluster.subnet.vpc),
+            *self._add_mount_filesystems(cluster.mount_points),
+        )
+
+        def provision():
+            with _provisioning(cluster, "status"):
+                ci = ClusterInfo(cluster)
+                if ci.cluster_dir.is_dir():
+                    ci.update()
+                else:
+                    ci.prepare(None)
+                ci.start_cluster()
+
+        return self.add(f"cluster-{cluster.id}", provision, requires)
+
+    def add_workbench(self, workbench):
+        if _is_ready(workbench, "status"):
+            return None
+        requires = self._names(
+            self.add_vpc(workbench.subnet.vpc),
+            *self._add_mount_filesystems(workbench.mount_points),
+        )
+
+        def provision():
+            with _provisioning(workbench, "status"):
+                wi = WorkbenchInfo(workbench)
+                if not wi.workbench_dir.is_dir():
+                    wi.create_workbench_dir(None)
+                wi.start()
+                # start() logs rather than raises errors
+                if workbench.status != "r":
+                    raise RuntimeError(
+                        f"Workbench {workbench.name} failed to start"
+                    )
+
+        return self.add(f"workbench-{workbench.id}", provision, requires)
+
+    @staticmethod
+    def _names(*names):
+        return [name for name in names if name]
+
+    def status(self):
+        return {
+            name: f"failed: {step.error}" if step.error else step.state
+            for (name, step) in self.steps.items()
+        }
+
+    def _progress(self):
+        if self.on_progress:
+            self.on_progress(self.status())
+
+    def _run_step(self, step, report):
+        # Each step's log records go to its own file too
+        handler = logging.FileHandler(self.log_dir / f"{step.name}.log")
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+        )
+        handler.addFilter(
+            lambda record: getattr(_current_step, "name", None) == step.name
+        )
+        logging.getLogger().addHandler(handler)
+        _current_step.name = step.name
+        close_old_connections()
+        try:
+            logger.info("Provisioning step %s started", step.name)
+            if report:
+                # Keep concurrent steps' Terraform progress apart
+                with utils.progress_reporter(
+                    lambda **data: report(
+                        **{
+                            f"{key}-{step.name}": value
+                            for (key, value) in data.items()
+                        }
+                    )
+                ):
+                    step.func()
+            else:
+                step.func()
+            logger.info("Provisioning step %s complete", step.name)
+        except Exception as err:
+            logger.error("Provisioning step %s failed", step.name, exc_info=err)
+            raise
+        finally:
+            _current_step.name = None
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+            close_old_connections()
+
+    def run(self):
+        """Run every step, and return whether all of them succeeded"""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        # Steps run on other threads, so pass on this thread's reporter
+        report = utils.current_progress_reporter()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                # Steps are added after those they require, so one pass
+                # also skips everything downstream of a failure
+                for step in self.steps.values():
+                    if step.state != "waiting":
+                        continue
+                    required = [self.steps[name] for name in step.requires]
+                    if any(r.state in ["failed", "skipped"] for r in required):
+                        step.state = "skipped"
+                    elif all(r.state == "done" for r in required):
+                        step.state = "running"
+                        future = pool.submit(self._run_step, step, report)
+                        running[future] = step
+                self._progress()
+                if not running:
+                    break
+
+                (finished, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        future.result()
+                        step.state = "done"
+                    # Dependents are skipped, but independent steps go on
+                    except Exception as err:  # pylint: disable=broad-except
+                        step.state = "failed"
+                        step.error = str(err)
+
+        return all(step.state == "done" for step in self.steps.values())
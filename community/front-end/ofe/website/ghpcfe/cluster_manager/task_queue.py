@@ -0,0 +1,340 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Database backed queue for long running backend operations
+
+Web requests only record a Task; the run_task_worker management command runs
+them in a separate process, so Terraform runs are neither tied to, nor lost
+with, a web worker.  Tasks name a BackendAsyncView subclass whose cmd() is
+called as cmd(task_id, token, *args), with model instance arguments
+re-fetched from the database when the task starts.
+"""
+
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import close_old_connections, models
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from . import utils
+from ..models import CloudResource, Task
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a heartbeat before a running task is considered orphaned,
+# and how often to check for them.  A worker restarted straight after a
+# crash only finds its old tasks orphaned once their heartbeats go stale.
+_orphan_timeout = 120
+_recover_interval = 60
+_retry_delay = 60
+# Failed and cancelled tasks are kept this long, so their errors can be
+# shown, and checked for removal this often (seconds)
+_finished_retention = timedelta(days=1)
+_purge_interval = 300
+
+# For resources left mid-operation by a failed or cancelled task:
+# field -> (in progress values, value to set)
+_failed_states = {
+    "cloud_state": (["cm", "dm"], "um"),
+    "status": (["c", "i", "t"], "e"),
+}
+
+# Tasks may report progress from several threads (see provisioning)
+_progress_lock = threading.Lock()
+
+_default_concurrency = {
+    "default": 4,
+    "cluster": 4,
+    "vpc": 2,
+    "filesystem": 2,
+    "workbench": 2,
+}
+
+
+def encode_args(args):
+    """Model instances are stored by reference, everything else as JSON"""
+    return [
+        {"model": arg._meta.label_lower, "pk": arg.pk}
+        if isinstance(arg, models.Model)
+        else {"value": arg}
+        for arg in args
+    ]
+
+
+def decode_args(args):
+    return [
+        apps.get_model(arg["model"]).objects.get(pk=arg["pk"])
+        if "model" in arg
+        else arg["value"]
+        for arg in args
+    ]
+
+
+def enqueue(owner, title, command, args, resource="default", max_attempts=1,
+            data=None):
+    """Queue command (a BackendAsyncView subclass) to run with args"""
+    task = Task.objects.create(
+        owner=owner,
+        title=title,
+        data=data or {},
+        command=f"{command.__module__}.{command.__qualname__}",
+        args=encode_args(args),
+        resource=resource,
+        max_attempts=max_attempts,
+    )
+    logger.info("Queued task %d-%s", task.id, title)
+    return task
+
+
+def report_progress(task_id, **data):
+    """Merge data into the task's progress data, for the browser"""
+    with _progress_lock:
+        task = Task.objects.get(pk=task_id)
+        task.data.update(data)
+        task.save(update_fields=["data"])
+
+
+def _tasks_for(instance, states):
+    ref = {"model": instance._meta.label_lower, "pk": instance.pk}
+    return [
+        task
+        for task in Task.objects.filter(state__in=states).order_by("id")
+        if ref in task.args
+    ]
+
+
+def active_tasks_for(instance):
+    """Queued and running tasks with instance as an argument"""
+    return _tasks_for(instance, ["q", "r"])
+
+
+def failed_tasks_for(instance):
+    """Failed tasks with instance as an argument"""
+    return _tasks_for(instance, ["e"])
+
+
+def _mark_resources_failed(task):
+    """Take the task's cloud resource arguments out of the in progress
+    states (creating, destroying...) the task may have left them in"""
+    for arg in task.args:
+        if "model" not in arg:
+            continue
+        model = apps.get_model(arg["model"])
+        if not issubclass(model, CloudResource):
+            continue
+        instance = model.objects.filter(pk=arg["pk"]).first()
+        if not instance:
+            continue
+        changed = False
+        for (field, (in_progress, failed)) in _failed_states.items():
+            if getattr(instance, field, None) in in_progress:
+                setattr(instance, field, failed)
+                changed = True
+        if changed:
+            logger.info(
+                "Task %d-%s left %s %d unfinished, marked as failed",
+                task.id, task.title, arg["model"], instance.pk
+            )
+            instance.save()
+
+
+def cancel(task_id):
+    """Cancel a queued task, or ask a running one to stop
+
+    Running commands are only stopped if they check is_cancelled().
+    """
+    if Task.objects.filter(pk=task_id, state="q").update(
+        state="x", finished=timezone.now()
+    ):
+        _mark_resources_failed(Task.objects.get(pk=task_id))
+    else:
+        Task.objects.filter(pk=task_id, state="r").update(
+            cancel_requested=True
+        )
+
+
+def is_cancelled(task_id):
+    return Task.objects.filter(pk=task_id, cancel_requested=True).exists()
+
+
+def _fail_or_retry(task, error):
+    task.data["error"] = error
+    if task.attempts < task.max_attempts and not task.cancel_requested:
+        task.state = "q"
+        task.not_before = timezone.now() + timedelta(seconds=_retry_delay)
+        logger.info(
+            "Task %d-%s will be retried (attempt %d of %d)",
+            task.id, task.title, task.attempts, task.max_attempts
+        )
+    else:
+        task.state = "x" if task.cancel_requested else "e"
+        task.finished = timezone.now()
+    task.save()
+    if task.state != "q":
+        _mark_resources_failed(task)
+
+
+def recover_orphans(exclude=()):
+    """Requeue (or fail) running tasks whose worker has stopped
+
+    Tasks with IDs in exclude (those this worker is running) are left alone.
+    """
+    cutoff = timezone.now() - timedelta(seconds=_orphan_timeout)
+    for task in (
+        Task.objects.filter(state="r")
+        .filter(Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True))
+        .exclude(pk__in=list(exclude))
+    ):
+        logger.warning("Recovering orphaned task %d-%s", task.id, task.title)
+        _fail_or_retry(task, "Task worker stopped while running this task")
+
+
+def purge_finished():
+    """Delete failed and cancelled tasks once past their retention time"""
+    cutoff = timezone.now() - _finished_retention
+    (deleted, _) = Task.objects.filter(state__in=["e", "x"]).filter(
+        # Tasks which finished before the time was recorded
+        Q(finished__lt=cutoff) | Q(finished__isnull=True)
+    ).delete()
+    if deleted:
+        logger.info("Deleted %d old failed or cancelled tasks", deleted)
+
+
+class TaskWorker:
+    """Runs queued tasks on a thread pool, within per-resource type
+    concurrency limits"""
+
+    def __init__(self, max_workers=None, concurrency=None, poll_interval=2):
+        config = utils.load_config()["server"]
+        self.max_workers = max_workers or config.get("task_workers", 8)
+        self.concurrency = dict(_default_concurrency)
+        self.concurrency.update(
+            concurrency or config.get("task_concurrency", {})
+        )
+        self.poll_interval = poll_interval
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def _limit(self, resource):
+        return self.concurrency.get(resource, self.concurrency["default"])
+
+    def _claim(self):
+        now = timezone.now()
+        running = dict(
+            Task.objects.filter(state="r")
+            .values_list("resource")
+            .annotate(Count("id"))
+            .order_by()
+        )
+        candidates = (
+            Task.objects.filter(state="q", cancel_requested=False)
+            .exclude(command="")
+            .filter(Q(not_before__isnull=True) | Q(not_before__lte=now))
+            .order_by("id")
+            .values_list("id", "resource")
+        )
+        for (task_id, resource) in candidates[:100]:
+            if running.get(resource, 0) >= self._limit(resource):
+                continue
+            # Conditional update, so a task is only ever claimed once
+            if Task.objects.filter(pk=task_id, state="q").update(
+                state="r", heartbeat=now, attempts=models.F("attempts") + 1
+            ):
+                return task_id
+        return None
+
+    def _execute(self, task):
+        logger.info("Starting task %d-%s", task.id, task.title)
+        try:
+            task.data["status"] = "Running"
+            task.save(update_fields=["data"])
+            command = import_string(task.command)()
+            token = Token.objects.get(user=task.owner_id).key
+            # Terraform runs report their progress on the task
+            with utils.progress_reporter(
+                functools.partial(report_progress, task.id)
+            ):
+                command.cmd(task.id, token, *decode_args(task.args))
+        # Whatever went wrong, the task record must be updated
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error(
+                "Task %d-%s failed", task.id, task.title, exc_info=err
+            )
+            task.refresh_from_db()
+            _fail_or_retry(task, str(err))
+        else:
+            logger.info("Task %d-%s complete", task.id, task.title)
+            task.delete()
+
+    def _run(self, task_id):
+        close_old_connections()
+        try:
+            self._execute(Task.objects.get(pk=task_id))
+        except Task.DoesNotExist:
+            logger.warning("Task %d was deleted before it could run", task_id)
+        finally:
+            with self.lock:
+                self.running.discard(task_id)
+            close_old_connections()
+
+    def _heartbeat(self):
+        with self.lock:
+            running = list(self.running)
+        if running:
+            Task.objects.filter(pk__in=running).update(
+                heartbeat=timezone.now()
+            )
+
+    def run(self):
+        next_recover = 0
+        next_purge = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not self.stopping.is_set():
+                self._heartbeat()
+                if time.monotonic() >= next_recover:
+                    with self.lock:
+                        running = set(self.running)
+                    recover_orphans(exclude=running)
+                    next_recover = time.monotonic() + _recover_interval
+                if time.monotonic() >= next_purge:
+                    purge_finished()
+                    next_purge = time.monotonic() + _purge_interval
+                while len(self.running) < self.max_workers:
+                    task_id = self._claim()
+                    if not task_id:
+                        break
+                    with self.lock:
+                        self.running.add(task_id)
+                    pool.submit(self._run, task_id)
+                close_old_connections()
+                self.stopping.wait(self.poll_interval)
+            logger.info(
+                "Waiting for %d running tasks to finish", len(self.running)
+            )
+            # Keep heartbeats going so these aren't seen as orphaned
+            while self.running:
+                self._heartbeat()
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.stopping.set()
@@ -0,0 +1,145 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Terraform state file reading
+
+The state of a large cluster runs to tens of MB.  It is parsed once per
+change of the file, with its managed resources indexed by (module, type,
+name) so that lookups don't scan the whole resource list.  Parsed states
+are shared between callers, so everything they return is read-only.
+"""
+
+import collections
+import json
+import logging
+import threading
+from pathlib import Path
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Parsed states, most recently used last
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+# Limit on the total size of the cached state files; the most recently
+# used state is kept whatever its size
+_cache_max_bytes = 64 * 1024 * 1024
+
+# The parts of a resource that are kept
+_resource_keys = ("module", "mode", "type", "name", "instances")
+
+
+def _freeze(value):
+    """Read-only copy of parsed JSON"""
+    if isinstance(value, dict):
+        return MappingProxyType(
+            {key: _freeze(item) for (key, item) in value.items()}
+        )
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class TerraformState:
+    """Outputs and managed resources of one terraform.tfstate"""
+
+    def __init__(self, state):
+        self.outputs = _freeze(
+            {
+                name: output.get("value")
+                for (name, output) in state.get("outputs", {}).items()
+            }
+        )
+        self._resources = {}
+        by_name = collections.defaultdict(list)
+        for resource in state.get("resources", []):
+            # Data sources are re-read on every run, so aren't needed
+            if resource.get("mode", "managed") != "managed":
+                continue
+            resource = _freeze(
+                {
+                    key: resource[key]
+                    for key in _resource_keys
+                    if key in resource
+                }
+            )
+            # Resources of the root module have no "module"
+            module = resource.get("module")
+            self._resources[
+                (module, resource["type"], resource["name"])
+            ] = resource
+            by_name[(module, resource["name"])].append(resource)
+        self._by_name = {
+            key: tuple(resources) for (key, resources) in by_name.items()
+        }
+
+    def output(self, name, default=None):
+        return self.outputs.get(name, default)
+
+    def resource(self, module, resource_type, name):
+        """The resource of the given address, or None"""
+        return self._resources.get((module, resource_type, name))
+
+    def resources(self, module, name, resource_type=None):
+        """All resources of the given module and name
+
+        Limited to those of resource_type if given.
+        """
+        if resource_type:
+            resource = self.resource(module, resource_type, name)
+            return (resource,) if resource else ()
+        return self._by_name.get((module, name), ())
+
+    def instances(self, module, name, resource_type=None):
+        """Instances of all matching resources, in state file order"""
+        return tuple(
+            instance
+            for resource in self.resources(module, name, resource_type)
+            for instance in resource.get("instances", ())
+        )
+
+
+def load(state_file):
+    """Read a state file, re-using the last parse if it hasn't changed
+
+    Raises FileNotFoundError if there is no state file.
+    """
+    state_file = Path(state_file).resolve()
+    stat = state_file.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(state_file)
+        if cached and cached[0] == stamp:
+            _cache.move_to_end(state_file)
+            return cached[1]
+
+    # Parse outside the lock; worst case two threads both parse a new file
+    with state_file.open("r", encoding="utf-8") as statefp:
+        state = TerraformState(json.load(statefp))
+    logger.debug("Loaded Terraform state %s", state_file)
+
+    with _cache_lock:
+        _cache[state_file] = (stamp, state)
+        _cache.move_to_end(state_file)
+        # Sizes are those of the files, from the stamps
+        cached_bytes = sum(stamp[1] for (stamp, _) in _cache.values())
+        while len(_cache) > 1 and cached_bytes > _cache_max_bytes:
+            (_, (old_stamp, _)) = _cache.popitem(last=False)
+            cached_bytes -= old_stamp[1]
+    return state
+
+
+def load_outputs(state_file):
+    """Just the output values of a state file"""
+    return load(state_file).outputs
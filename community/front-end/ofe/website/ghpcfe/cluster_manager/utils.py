@@ -14,15 +14,24 @@
 
 """Commonly used utility routines"""
 
+import contextlib
 import copy
+import fcntl
+import fnmatch
+import functools
+import hashlib
 import json
 import logging
 import os
 import subprocess
+import threading
+import time
 from pathlib import Path
 
 import yaml
 
+from . import tfstate
+
 logger = logging.getLogger(__name__)
 
 # TODO = Make some form of global config file
@@ -121,14 +130,12 @@ def load_cluster_info(args):
                 f"{args.cluster_dir.as_posix()}"
             )
 
-    tf_state_file = (
+    state = tfstate.load(
         args.cluster_dir / "terraform" / args.cloud / "terraform.tfstate"
     )
-    with tf_state_file.open("r") as statefp:
-        state = json.load(statefp)
-        args.cluster_ip = state["outputs"]["ManagementPublicIP"]["value"]
-        args.cluster_name = state["outputs"]["cluster_id"]["value"]
-        args.tf_state = state
+    args.cluster_ip = state.outputs["ManagementPublicIP"]
+    args.cluster_name = state.outputs["cluster_id"]
+    args.tf_state = state
 
     args.cluster_vars = _parse_tfvars(
         args.cluster_dir / "terraform" / args.cloud / "terraform.tfvars"
@@ -190,15 +197,266 @@ def rsync_dir(
         raise
 
 
+def terraform_plugin_dirs():
+    """Shared provider plugin cache and local provider mirror directories"""
+    config = load_config()
+    plugin_dir = config["baseDir"] / "terraform-plugins"
+    return (
+        Path(
+            config["server"].get(
+                "terraform_plugin_cache", plugin_dir / "cache"
+            )
+        ),
+        Path(
+            config["server"].get(
+                "terraform_provider_mirror", plugin_dir / "mirror"
+            )
+        ),
+    )
+
+
+def mirrored_providers(mirror_dir):
+    """Providers (hostname/namespace/type) available in a local mirror"""
+    if not mirror_dir.is_dir():
+        return []
+    return sorted(
+        "/".join(path.relative_to(mirror_dir).parts)
+        for path in mirror_dir.glob("*/*/*")
+        if path.is_dir()
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def terraform_version():
+    """Version of the installed Terraform, as a tuple of ints
+
+    (0,) if it can't be determined.
+    """
+    try:
+        proc = subprocess.run(
+            ["terraform", "version", "-json"],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        version = json.loads(proc.stdout)["terraform_version"]
+        return tuple(int(part) for part in version.split("-")[0].split("."))
+    except (OSError, subprocess.CalledProcessError, KeyError, ValueError):
+        logger.warning("Unable to determine Terraform version", exc_info=True)
+        return (0,)
+
+
+def write_terraform_cli_config():
+    """Write the Terraform CLI config used for all deployments
+
+    Providers present in the local mirror are only installed from it, so
+    deployments using them need no registry access; other providers are
+    downloaded as usual.  With terraform_registry_fallback set, versions
+    missing from the mirror are downloaded too, though Terraform then
+    prefers the newest version from either.  Either way, the plugin cache
+    means each provider version is only stored once, not in every
+    deployment's .terraform.  The file is only rewritten when it changes.
+    """
+    (cache_dir, mirror_dir) = terraform_plugin_dirs()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    providers = json.dumps(mirrored_providers(mirror_dir))
+    fallback = load_config()["server"].get(
+        "terraform_registry_fallback", False
+    )
+
+    lines = [f"plugin_cache_dir = {json.dumps(cache_dir.as_posix())}"]
+    # Otherwise a new lock file makes init fetch checksums from the
+    # registry, and the cache goes unused.  Earlier versions don't have
+    # this setting, and always use the cache.
+    if terraform_version() >= (1, 4):
+        lines.append("plugin_cache_may_break_dependency_lock_file = true")
+    if providers != "[]":
+        lines.extend(
+            [
+                "provider_installation {",
+                "  filesystem_mirror {",
+                f"    path    = {json.dumps(mirror_dir.as_posix())}",
+                f"    include = {providers}",
+                "  }",
+                "  direct {",
+            ]
+        )
+        if not fallback:
+            # Otherwise Terraform also looks up mirrored providers in the
+            # registry, which fails without access to it
+            lines.append(f"    exclude = {providers}")
+        lines.extend(["  }", "}"])
+    content = "\n".join(lines) + "\n"
+
+    config_file = cache_dir.parent / "terraformrc"
+    try:
+        if config_file.read_text(encoding="utf-8") == content:
+            return config_file
+    except FileNotFoundError:
+        pass
+    # Other deployments may be running Terraform with this file
+    tmp_file = config_file.with_suffix(f".{os.getpid()}")
+    tmp_file.write_text(content, encoding="utf-8")
+    tmp_file.replace(config_file)
+    return config_file
+
+
+@contextlib.contextmanager
+def _plugin_cache_lock():
+    # Terraform doesn't support concurrent writes to the plugin cache, so
+    # only one init at a time; these are quick once providers are cached.
+    (cache_dir, _) = terraform_plugin_dirs()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with (cache_dir / ".lock").open("w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_progress = threading.local()
+
+
+@contextlib.contextmanager
+def progress_reporter(report):
+    """Report progress of Terraform runs in this thread as report(**data)"""
+    previous = current_progress_reporter()
+    _progress.report = report
+    try:
+        yield
+    finally:
+        _progress.report = previous
+
+
+def current_progress_reporter():
+    return getattr(_progress, "report", None)
+
+
+def _change_count(event):
+    """Number of resource changes in a change_summary event"""
+    changes = event.get("changes", {})
+    return sum(changes.get(key, 0) for key in ["add", "change", "remove"])
+
+
+class TerraformProgress:
+    """Progress of a Terraform run, from its machine readable output"""
+
+    # Seconds between reports, as resources can change in quick succession
+    report_interval = 2
+
+    def __init__(self, command, report, planned=0):
+        self.command = command
+        self.report = report
+        self.start = time.monotonic()
+        self.last_report = 0
+        # A saved plan's apply doesn't list its changes up front, so this
+        # starts from the count recorded with the plan
+        self.planned = planned
+        self.done = 0
+        self.in_progress = []
+        self.errors = []
+
+    def handle(self, event):
+        kind = event.get("type")
+        resource = event.get("hook", {}).get("resource", {}).get("addr", "")
+        if kind == "planned_change":
+            self.planned += 1
+        elif kind == "change_summary" and self.command == "plan":
+            self.planned = _change_count(event)
+        elif kind == "apply_start":
+            self.in_progress.append(resource)
+        elif kind in ["apply_complete", "apply_errored"]:
+            if resource in self.in_progress:
+                self.in_progress.remove(resource)
+            if kind == "apply_complete":
+                self.done += 1
+        elif kind == "diagnostic" and event.get("@level") == "error":
+            self.errors.append(event.get("@message", ""))
+        elif kind != "apply_progress":
+            return
+        self._report()
+
+    def to_dict(self):
+        return {
+            "command": self.command,
+            "planned": self.planned,
+            "done": self.done,
+            "current": self.in_progress[-1] if self.in_progress else "",
+            "in_progress": len(self.in_progress),
+            "elapsed": int(time.monotonic() - self.start),
+            "errors": self.errors[-5:],
+        }
+
+    def _report(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last_report >= self.report_interval:
+            self.last_report = now
+            self.report(terraform=self.to_dict())
+
+    def finish(self):
+        self._report(force=True)
+
+
+def _stream_terraform(cmdline, target_dir, env, log_out, log_err, report):
+    """Run Terraform with -json output, logging its messages as they arrive
+    and passing events to a TerraformProgress"""
+    planned = (
+        _saved_plan(target_dir).get("changes", 0)
+        if cmdline[1] == "apply" and _plan_file in cmdline
+        else 0
+    )
+    progress = (
+        TerraformProgress(cmdline[1], report, planned) if report else None
+    )
+    log_json_fn = target_dir / f"terraform_{cmdline[1]}_log.json"
+    with log_json_fn.open("w", encoding="utf-8") as log_json:
+        with subprocess.Popen(
+            cmdline,
+            cwd=target_dir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=log_err,
+            text=True,
+        ) as proc:
+            for line in proc.stdout:
+                log_json.write(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    log_out.write(line)
+                    continue
+                # Keep the .stdout log readable
+                log_out.write(f"{event.get('@message', '')}\n")
+                detail = event.get("diagnostic", {}).get("detail")
+                if detail:
+                    log_out.write(f"{detail}\n")
+                log_out.flush()
+                if progress:
+                    progress.handle(event)
+            returncode = proc.wait()
+    if progress:
+        progress.finish()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmdline)
+
+
 def run_terraform(target_dir, command, arguments=None, extra_env=None):
 
     arguments = arguments if arguments else []
     extra_env = extra_env if extra_env else {}
 
     cmdline = ["terraform", command, "-no-color"]
-    cmdline.extend(arguments)
+    # Options go before arguments, which may end with a plan file
+    stream = command in ["plan", "apply", "destroy"]
+    if stream:
+        cmdline.append("-json")
     if command in ["apply", "destroy"]:
         cmdline.append("-auto-approve")
+    parallelism = load_config()["server"].get("terraform_parallelism")
+    if parallelism and command in ["plan", "apply", "destroy"]:
+        cmdline.append(f"-parallelism={parallelism}")
+    cmdline.extend(arguments)
 
     log_out_fn = target_dir / f"terraform_{command}_log.stdout"
     log_err_fn = target_dir / f"terraform_{command}_log.stderr"
@@ -208,9 +466,28 @@ def run_terraform(target_dir, command, arguments=None, extra_env=None):
     # It has its own keys
     if "SSH_AUTH_SOCK" in new_env:
         del new_env["SSH_AUTH_SOCK"]
+    # Leave an administrator's own CLI config alone
+    if "TF_CLI_CONFIG_FILE" not in new_env:
+        new_env["TF_CLI_CONFIG_FILE"] = write_terraform_cli_config().as_posix()
     new_env.update(extra_env)
 
-    with log_out_fn.open("wb") as log_out:
+    lock = (
+        _plugin_cache_lock() if command == "init" else contextlib.nullcontext()
+    )
+    if stream:
+        with log_out_fn.open("w", encoding="utf-8") as log_out:
+            with log_err_fn.open("wb") as log_err:
+                _stream_terraform(
+                    cmdline,
+                    target_dir,
+                    new_env,
+                    log_out,
+                    log_err,
+                    current_progress_reporter(),
+                )
+        return (log_out_fn, log_err_fn)
+
+    with lock, log_out_fn.open("wb") as log_out:
         with log_err_fn.open("wb") as log_err:
             subprocess.run(
                 cmdline,
@@ -222,3 +499,114 @@ def run_terraform(target_dir, command, arguments=None, extra_env=None):
             )
 
     return (log_out_fn, log_err_fn)
+
+
+_plan_file = "tfplan"
+# The hash of the plan's inputs, and its number of changes
+_plan_info_file = "tfplan.json"
+_not_plan_inputs = [
+    ".terraform",
+    "terraform.tfstate*",
+    "terraform_*_log.*",
+    f"{_plan_file}*",
+]
+
+
+def terraform_inputs_hash(target_dir):
+    """Hash of everything in a Terraform directory which affects its plan
+
+    That is the configuration, variables and provider lock file, but not
+    state, logs, or the installed providers and modules.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(target_dir.rglob("*")):
+        rel_path = path.relative_to(target_dir)
+        if not path.is_file() or any(
+            fnmatch.fnmatch(part, pattern)
+            for part in rel_path.parts
+            for pattern in _not_plan_inputs
+        ):
+            continue
+        digest.update(rel_path.as_posix().encode("utf-8") + b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _saved_plan(target_dir):
+    """Information saved with the plan, or {} if there is none"""
+    try:
+        with (target_dir / _plan_info_file).open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _plan_changes(target_dir):
+    """Number of changes in the plan just made, from its log"""
+    changes = 0
+    log_json_fn = target_dir / "terraform_plan_log.json"
+    with log_json_fn.open("r", encoding="utf-8") as log_json:
+        for line in log_json:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("type") == "change_summary":
+                changes = _change_count(event)
+    return changes
+
+
+def plan_terraform(target_dir, extra_env=None):
+    """Save a plan for apply_terraform(), unless an up to date one exists"""
+    inputs_hash = terraform_inputs_hash(target_dir)
+    if (target_dir / _plan_file).exists() and _saved_plan(target_dir).get(
+        "inputs"
+    ) == inputs_hash:
+        logger.info("Terraform inputs unchanged, reusing saved plan")
+        return
+
+    run_terraform(
+        target_dir,
+        "plan",
+        ["-input=false", f"-out={_plan_file}"],
+        extra_env=extra_env,
+    )
+    with (target_dir / _plan_info_file).open("w", encoding="utf-8") as fp:
+        json.dump(
+            {"inputs": inputs_hash, "changes": _plan_changes(target_dir)}, fp
+        )
+
+
+def apply_terraform(target_dir, extra_env=None):
+    """Apply the saved plan, rather than planning all over again
+
+    The plan is (re-)made first if there isn't one or the configuration has
+    changed since.  If Terraform rejects it as stale, because the state has
+    changed since, it is re-made and applied once more.
+    """
+    plan_terraform(target_dir, extra_env=extra_env)
+    try:
+        try:
+            return run_terraform(
+                target_dir, "apply", [_plan_file], extra_env=extra_env
+            )
+        except subprocess.CalledProcessError:
+            # With -json output, errors are reported on stdout
+            if not any(
+                "plan is stale"
+                in (target_dir / f"terraform_apply_log.{stream}").read_text(
+                    encoding="utf-8", errors="replace"
+                )
+                for stream in ["stdout", "stderr"]
+            ):
+                raise
+            logger.warning("Saved Terraform plan is stale, re-planning")
+            (target_dir / _plan_info_file).unlink()
+            plan_terraform(target_dir, extra_env=extra_env)
+            return run_terraform(
+                target_dir, "apply", [_plan_file], extra_env=extra_env
+            )
+    finally:
+        # A plan can only be applied once, successfully or not
+        for name in [_plan_file, _plan_info_file]:
+            (target_dir / name).unlink(missing_ok=True)
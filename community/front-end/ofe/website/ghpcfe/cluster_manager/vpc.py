@@ -21,6 +21,8 @@ import shutil
 import subprocess
 from pathlib import Path
 
+from . import cloud_info
+from . import tfstate
 from . import utils
 from ..models import VirtualNetwork, VirtualSubnet
 
@@ -65,8 +67,8 @@ project = "{project_id}"
 
     try:
         utils.run_terraform(target_dir, "init")
-        utils.run_terraform(target_dir, "validate", extra_env=extra_env)
-        utils.run_terraform(target_dir, "plan", extra_env=extra_env)
+        # Plan also validates; the plan is saved for start_vpc()
+        utils.plan_terraform(target_dir, extra_env=extra_env)
 
     except subprocess.CalledProcessError as err:
         logger.error("Terraform planning failed", exc_info=err)
@@ -86,20 +88,17 @@ def start_vpc(vpc: VirtualNetwork) -> None:
                 target_dir / "cloud_credentials"
             ).as_posix()
         }
-        utils.run_terraform(target_dir, "apply", extra_env=extra_env)
-        tf_state_file = target_dir / "terraform.tfstate"
-        with tf_state_file.open("r") as statefp:
-            state = json.load(statefp)
-            if vpc.is_managed:
-                vpc.cloud_id = state["outputs"]["vpc_id"]["value"]
-                vpc.save()
-            for subnet in vpc.subnets.all():
-                if subnet.is_managed:
-                    subnet.cloud_id = state["outputs"][f"subnet-{subnet.id}"][
-                        "value"
-                    ]
-                    subnet.cloud_state = "m"
-                    subnet.save()
+        utils.apply_terraform(target_dir, extra_env=extra_env)
+        outputs = tfstate.load_outputs(target_dir / "terraform.tfstate")
+        if vpc.is_managed:
+            vpc.cloud_id = outputs["vpc_id"]
+            vpc.save()
+        for subnet in vpc.subnets.all():
+            if subnet.is_managed:
+                subnet.cloud_id = outputs[f"subnet-{subnet.id}"]
+                subnet.cloud_state = "m"
+                subnet.save()
+        cloud_info.invalidate_subnet_cache()
     except subprocess.CalledProcessError as err:
         logger.error("Terraform apply failed", exc_info=err)
         if err.stdout:
@@ -119,6 +118,7 @@ def destroy_vpc(vpc: VirtualNetwork) -> None:
         ).as_posix()
     }
     utils.run_terraform(target_dir, "destroy", extra_env=extra_env)
+    cloud_info.invalidate_subnet_cache()
     vpc.cloud_state = "xm"
     vpc.save()
 
@@ -194,6 +194,11 @@ data {dstype} "subnet_{subnet.id}" {{
     return output_file
 
 
+def get_terraform_dir(vpc: VirtualNetwork) -> Path:
+    # Just a wrapper to expose as "non-private"
+    return _tf_dir_for_vpc(vpc.id)
+
+
 def _tf_dir_for_vpc(vpc_id: int) -> Path:
     config = utils.load_config()
     return config["baseDir"] / "vpcs" / f"vpc_{vpc_id}"
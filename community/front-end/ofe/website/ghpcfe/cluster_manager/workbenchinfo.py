@@ -21,6 +21,7 @@ import shutil
 import subprocess
 from retry import retry
 
+from . import tfstate
 from . import utils
 
 logger = logging.getLogger(__name__)
@@ -315,11 +316,9 @@ wb_startup_script_bucket = "{self.config["server"]["gcs_bucket"]}"
             self.workbench.cloud_state = "cm"
             self.workbench.save()
             utils.run_terraform(terraform_dir / self.cloud_dir, "init")
-            utils.run_terraform(
-                terraform_dir / self.cloud_dir, "validate", extra_env=extra_env
-            )
-            utils.run_terraform(
-                terraform_dir / self.cloud_dir, "plan", extra_env=extra_env
+            # Plan also validates; the plan is saved for _terraform_create()
+            utils.plan_terraform(
+                terraform_dir / self.cloud_dir, extra_env=extra_env
             )
         except subprocess.CalledProcessError as cpe:
             if cpe.stdout:
@@ -336,34 +335,34 @@ wb_startup_script_bucket = "{self.config["server"]["gcs_bucket"]}"
             "GOOGLE_APPLICATION_CREDENTIALS": self._get_credentials_file()
         }
         try:
-            utils.run_terraform(
-                terraform_dir / self.cloud_dir, "apply", extra_env=extra_env
+            utils.apply_terraform(
+                terraform_dir / self.cloud_dir, extra_env=extra_env
             )
             # Look for Management Public IP in terraform.tfstate
-            tf_state_file = terraform_dir / self.cloud_dir / "terraform.tfstate"
-            with tf_state_file.open("r") as statefp:
-                outputs = json.load(statefp)["outputs"]
-                wb_name = "UNKNOWN"
+            outputs = tfstate.load_outputs(
+                terraform_dir / self.cloud_dir / "terraform.tfstate"
+            )
+            wb_name = "UNKNOWN"
+            try:
+                wb_name = outputs["notebook_instance_name"]
+            except KeyError:
+                logger.error(
+                    "Failed to parse workbench instance name from TF state"
+                )
                 try:
-                    wb_name = outputs["notebook_instance_name"]["value"]
+                    deployment_id = outputs["deployment_id"]
+                    wb_name = f"notebooks-instance-{deployment_id}-0"
                 except KeyError:
                     logger.error(
-                        "Failed to parse workbench instance name from TF state"
+                        "Failed to parse deployment ID from TF state"
                     )
-                    try:
-                        deployment_id = outputs["deployment_id"]["value"]
-                        wb_name = f"notebooks-instance-{deployment_id}-0"
-                    except KeyError:
-                        logger.error(
-                            "Failed to parse deployment ID from TF state"
-                        )
-                # workbench is now being initialized
-                self.workbench.internal_name = wb_name
-                self.workbench.cloud_state = "m"
-                self.workbench.status = "i"
-
-                self.workbench.save()
-                # Ansible is now running... Probably 15-30 minutes or so
+            # workbench is now being initialized
+            self.workbench.internal_name = wb_name
+            self.workbench.cloud_state = "m"
+            self.workbench.status = "i"
+
+            self.workbench.save()
+            # Ansible is now running... Probably 15-30 minutes or so
 
         except subprocess.CalledProcessError as err:
             # We can error during provisioning, in which case Terraform
@@ -434,16 +433,16 @@ wb_startup_script_bucket = "{self.config["server"]["gcs_bucket"]}"
                 logger.info("TF stderr:\n%s\n", err.stderr.decode("utf-8"))
             raise
 
-        tf_state_file = terraform_dir / self.cloud_dir / "terraform.tfstate"
-        with tf_state_file.open("r") as statefp:
-            outputs = json.load(statefp)["outputs"]
-            try:
-                wb_uri = outputs["notebook_proxy_uri"]["value"]
-            except KeyError:
-                logger.error(
-                    "Failed to get workbench uri from TF output"
-                )
-                raise
+        outputs = tfstate.load_outputs(
+            terraform_dir / self.cloud_dir / "terraform.tfstate"
+        )
+        try:
+            wb_uri = outputs["notebook_proxy_uri"]
+        except KeyError:
+            logger.error(
+                "Failed to get workbench uri from TF output"
+            )
+            raise
 
         if not wb_uri:
             logger.info("Awaiting workbench uri update (got \"%s\")", wb_uri)
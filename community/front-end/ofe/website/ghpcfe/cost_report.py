@@ -0,0 +1,275 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Cost reporting utilities """
+
+import csv
+import io
+import json
+import tempfile
+import zlib
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+from .models import Application, Job
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Exports are collected in a temporary file, kept in memory up to this size
+EXPORT_SPOOL_SIZE = 16 * 1024 * 1024
+
+# Exported job columns: (CSV heading, JSONL/Parquet field name, Job lookup)
+# Columns are only ever added at the end; see docs/admin_guide.md
+EXPORT_COLUMNS = [
+    ("Job ID", "job_id", "id"),
+    ("User", "user", "user__username"),
+    ("Application", "application", "application__name"),
+    ("Partition", "partition", "partition__name"),
+    ("Number of Nodes", "number_of_nodes", "number_of_nodes"),
+    ("Ranks per Node", "ranks_per_node", "ranks_per_node"),
+    ("Runtime (sec)", "runtime", "runtime"),
+    ("Node Price (per hour)", "node_price", "node_price"),
+    ("Job Cost", "job_cost", "job_cost"),
+    ("Submitted", "submitted", "date_time_submission"),
+]
+
+
+class ClusterCostReport:
+    """Job spend for a cluster, optionally limited to jobs submitted within
+    date_range (a (start, end) tuple) and/or to those of one user.
+
+    Every breakdown is a single grouped aggregate query, so the cost of a
+    report does not depend on the number of users or applications.
+    """
+
+    def __init__(self, cluster, date_range=None, user=None):
+        self.cluster = cluster
+        self.date_range = date_range
+        self.user = user
+
+    def _jobs(self):
+        jobs = Job.objects.filter(cluster=self.cluster)
+        if self.date_range:
+            jobs = jobs.filter(date_time_submission__range=self.date_range)
+        if self.user:
+            jobs = jobs.filter(user=self.user)
+        return jobs
+
+    def _breakdown(self, *fields, **expressions):
+        return list(
+            self._jobs()
+            .values(*fields, **expressions)
+            .annotate(spend=Sum("job_cost"), jobs=Count("id"))
+            .order_by("-spend")
+        )
+
+    def totals(self):
+        """Returns (total cost, number of jobs)"""
+        totals = self._jobs().aggregate(spend=Sum("job_cost"), jobs=Count("id"))
+        return (totals["spend"] or Decimal(0), totals["jobs"])
+
+    def by_user(self):
+        """Users with non-zero spend on this cluster, highest spend first"""
+        return [
+            row
+            for row in self._breakdown(
+                "user",
+                username=F("user__username"),
+                quota_type=F("user__quota_type"),
+                quota_amount=F("user__quota_amount"),
+            )
+            if row["spend"] > 0
+        ]
+
+    def by_application(self):
+        """All of this cluster's applications, highest spend first"""
+        job_filter = Q(job__cluster=self.cluster)
+        if self.date_range:
+            job_filter &= Q(job__date_time_submission__range=self.date_range)
+        if self.user:
+            job_filter &= Q(job__user=self.user)
+        return list(
+            Application.objects.filter(cluster=self.cluster)
+            .select_related("cluster")
+            .annotate(
+                spend=Coalesce(
+                    Sum("job__job_cost", filter=job_filter),
+                    Value(Decimal(0)),
+                    output_field=DecimalField(),
+                ),
+                jobs=Count("job", filter=job_filter),
+            )
+            .order_by("-spend")
+        )
+
+    def by_partition(self):
+        return self._breakdown("partition", partition_name=F("partition__name"))
+
+    def by_day(self):
+        return sorted(
+            self._breakdown(day=TruncDate("date_time_submission")),
+            key=lambda row: row["day"],
+        )
+
+    def export_batches(self, batch_size=2000):
+        """Yields lists of job rows (tuples, in EXPORT_COLUMNS order)
+
+        Pages through the jobs by ID, so memory use does not depend on the
+        number of jobs - unlike QuerySet.iterator(), which can't use a server
+        side cursor behind pgbouncer.
+        """
+        jobs = self._jobs().order_by("id")
+        lookups = [column[2] for column in EXPORT_COLUMNS]
+        last_id = 0
+        while True:
+            batch = list(
+                jobs.filter(id__gt=last_id).values_list(*lookups)[:batch_size]
+            )
+            if batch:
+                yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1][0]
+
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column[0] for column in EXPORT_COLUMNS])
+    yield buffer.getvalue().encode()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+
+
+def export_jsonl(batches):
+    names = [column[1] for column in EXPORT_COLUMNS]
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + "\n"
+            for row in batch
+        ).encode()
+
+
+class _StreamSink:
+    """Write-only file object collecting output to be streamed on"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_parquet(batches):
+    """Writes a row group per batch (needs pyarrow)"""
+    schema = pyarrow.schema([
+        ("job_id", pyarrow.int64()),
+        ("user", pyarrow.string()),
+        ("application", pyarrow.string()),
+        ("partition", pyarrow.string()),
+        ("number_of_nodes", pyarrow.int64()),
+        ("ranks_per_node", pyarrow.int64()),
+        ("runtime", pyarrow.float64()),
+        ("node_price", pyarrow.decimal128(8, 3)),
+        ("job_cost", pyarrow.decimal128(12, 3)),
+        ("submitted", pyarrow.timestamp("us", tz="UTC")),
+    ])
+    sink = _StreamSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for batch in batches:
+        columns = zip(*batch)
+        writer.write_table(
+            pyarrow.Table.from_arrays(
+                [
+                    pyarrow.array(column, type=field.type)
+                    for (column, field) in zip(columns, schema)
+                ],
+                schema=schema,
+            )
+        )
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def spool(chunks):
+    """Write chunks to a temporary file, returned rewound
+
+    Exports are built in full before the response starts, as the server
+    (ASGI) sends a response from its event loop, where the database can't
+    be used.  Memory use is still bounded, as the file moves to disk once
+    larger than EXPORT_SPOOL_SIZE.  An export which takes longer to build
+    than the proxy's read timeout (see nginx.conf) fails.
+    """
+    export = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        for chunk in chunks:
+            export.write(chunk)
+    except Exception:
+        export.close()
+        raise
+    export.seek(0)
+    return export
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Export format -> (encoder, content type, file extension)
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv", "csv"),
+    "jsonl": (export_jsonl, "application/x-ndjson", "jsonl"),
+}
+if pyarrow:
+    EXPORT_FORMATS["parquet"] = (
+        export_parquet, "application/vnd.apache.parquet", "parquet"
+    )
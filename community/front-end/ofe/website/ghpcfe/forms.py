@@ -372,7 +372,7 @@ class WorkbenchForm(forms.ModelForm):
         # append final preset instance type from loop
         choices_list.append((category, tuple(instance_list)))
         category = ""
-        if Role.CLUSTERADMIN in [x.id for x in user.roles.all()]:
+        if user.has_admin_role():
             for instance_type in sorted(instance_types):
                 # if family variable has changed from last loop then append
                 # instances to overall choices list as tuple and clear
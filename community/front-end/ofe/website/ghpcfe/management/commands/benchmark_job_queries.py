@@ -0,0 +1,187 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time the hot Job queries against a large synthetic job table"""
+
+import contextlib
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from ghpcfe.cost_report import ClusterCostReport
+from ghpcfe.models import ACTIVE_JOB_STATUSES, ClusterPartition, Job, User
+
+
+@contextlib.contextmanager
+def _explicit_submission_times():
+    # auto_now_add would otherwise stamp every synthetic job with "now"
+    field = Job._meta.get_field("date_time_submission")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """Benchmark Job queries with and without the Job table indexes"""
+
+    help = (
+        "Seeds synthetic jobs, then times the job list, quota, and cost "
+        "report queries with and without the Job indexes. Everything runs "
+        "in a transaction which is rolled back, so the database is left "
+        "unchanged. Needs at least one user and one cluster partition with "
+        "an application installed to attach the synthetic jobs to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs", type=int, default=1000000,
+            help="Number of synthetic jobs to create",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Number of times to run each query",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def _seed(self, num_jobs, users, targets):
+        now = timezone.now()
+        statuses = ["c"] * 90 + ["e"] * 9 + ACTIVE_JOB_STATUSES
+
+        def jobs():
+            for i in range(num_jobs):
+                (application, partition) = random.choice(targets)
+                yield Job(
+                    name=f"synthetic-{i}",
+                    application=application,
+                    cluster_id=application.cluster_id,
+                    partition=partition,
+                    user=random.choice(users),
+                    number_of_nodes=1,
+                    ranks_per_node=1,
+                    date_time_submission=now
+                    - timedelta(seconds=random.randrange(365 * 86400)),
+                    status=random.choice(statuses),
+                    job_cost=Decimal(random.randrange(100000)) / 1000,
+                )
+
+        with _explicit_submission_times():
+            Job.objects.bulk_create(jobs(), batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Job._meta.db_table}")
+
+    def _queries(self, user, cluster):
+        month = (timezone.now() - timedelta(days=30), timezone.now())
+        return {
+            "user job list page": lambda: list(
+                Job.objects.filter(user=user).order_by(
+                    "-date_time_submission", "-pk"
+                )[:50]
+            ),
+            "admin job list page": lambda: list(
+                Job.objects.order_by("-date_time_submission", "-pk")[:50]
+            ),
+            "user active jobs": lambda: Job.objects.filter(
+                user=user, status__in=ACTIVE_JOB_STATUSES
+            ).exists(),
+            "all active jobs": lambda: Job.objects.filter(
+                status__in=ACTIVE_JOB_STATUSES
+            ).count(),
+            "user spend, last 30 days": lambda: Job.objects.filter(
+                user=user, date_time_submission__range=month
+            ).aggregate(Sum("job_cost"), Count("id")),
+            "cluster report, last 30 days": lambda: (
+                ClusterCostReport(cluster, month).by_user()
+            ),
+        }
+
+    def _time(self, queries, repeat):
+        results = {}
+        for (name, query) in queries.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                query()
+                timings.append(time.perf_counter() - start)
+            results[name] = statistics.median(timings)
+        return results
+
+    def _execute(self, statements):
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(str(statement))
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        users = list(User.objects.all())
+        targets = [
+            (application, partition)
+            for partition in ClusterPartition.objects.select_related(
+                "cluster"
+            )
+            for application in partition.cluster.application_set.all()
+        ]
+        if not (users and targets):
+            raise CommandError(
+                "Need at least one user and one cluster with a partition and "
+                "an application to attach synthetic jobs to"
+            )
+
+        # The schema editor is only used to render the index DDL; SQLite
+        # refuses to enter one inside a transaction.
+        editor = connection.schema_editor()
+        indexes = Job._meta.indexes
+        with transaction.atomic():
+            self.stdout.write(
+                f"Seeding {options['jobs']} synthetic jobs...", ending="\n"
+            )
+            start = time.perf_counter()
+            self._seed(options["jobs"], users, targets)
+            self.stdout.write(
+                f"Seeded in {time.perf_counter() - start:.1f}s", ending="\n"
+            )
+
+            (user, _) = max(
+                Job.objects.values_list("user").annotate(n=Count("id")),
+                key=lambda row: row[1],
+            )
+            user = User.objects.get(pk=user)
+            cluster = targets[0][1].cluster
+            queries = self._queries(user, cluster)
+
+            self._execute(index.remove_sql(Job, editor) for index in indexes)
+            before = self._time(queries, options["repeat"])
+            self._execute(index.create_sql(Job, editor) for index in indexes)
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Job._meta.db_table}")
+            after = self._time(queries, options["repeat"])
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{'Query':32} {'no indexes':>12} {'indexed':>12}", ending="\n"
+        )
+        for name in queries:
+            self.stdout.write(
+                f"{name:32} {before[name] * 1000:10.1f}ms "
+                f"{after[name] * 1000:10.1f}ms",
+                ending="\n",
+            )
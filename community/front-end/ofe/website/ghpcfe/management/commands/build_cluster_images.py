@@ -0,0 +1,73 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Build golden images for cluster compute nodes"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ghpcfe.cluster_manager import utils
+from ghpcfe.cluster_manager.clusterinfo import ClusterInfo
+from ghpcfe.models import Cluster
+
+
+class Command(BaseCommand):
+    """Bring running clusters' compute node images up to date"""
+
+    help = (
+        "Builds the compute node image of each given cluster (default: all "
+        "running clusters) if it is missing or out of date, and redeploys "
+        "the cluster to use it. Partitions with an image of their own are "
+        "left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "clusters", nargs="*", type=int, metavar="ID",
+            help="IDs of clusters whose images to build",
+        )
+
+    def _progress(self, cluster, image=None, **unused_data):
+        if image:
+            self.stdout.write(f"Cluster {cluster.id}: {image}", ending="\n")
+
+    def handle(self, *args, **options):
+        if options["clusters"]:
+            clusters = Cluster.objects.filter(pk__in=options["clusters"])
+            missing = set(options["clusters"]) - {c.id for c in clusters}
+            if missing:
+                raise CommandError(
+                    f"No clusters with IDs {', '.join(map(str, missing))}"
+                )
+        else:
+            clusters = Cluster.objects.filter(status="r")
+
+        failed = 0
+        for cluster in clusters:
+            self.stdout.write(
+                f"Updating image for cluster {cluster.id} ({cluster.name})",
+                ending="\n",
+            )
+            try:
+                with utils.progress_reporter(
+                    lambda cluster=cluster, **data: self._progress(
+                        cluster, **data
+                    )
+                ):
+                    ClusterInfo(cluster).build_golden_image()
+            except Exception as err:  # pylint: disable=broad-except
+                failed += 1
+                self.stderr.write(
+                    f"Cluster {cluster.id}: {err}", ending="\n"
+                )
+        if failed:
+            raise CommandError(f"Failed to build images for {failed} clusters")
@@ -0,0 +1,139 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent database load test"""
+
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from ghpcfe.models import ACTIVE_JOB_STATUSES, Job, Task, User
+
+
+class Command(BaseCommand):
+    """Mimic the front end's concurrent database traffic"""
+
+    help = (
+        "Runs a mix of reads (job listings) and short write transactions "
+        "(task records, as created by backend tasks and C2 callbacks) from "
+        "many threads, and reports throughput, latency and errors such as "
+        "'database is locked'. Run it once with each database backend (or "
+        "SQLite tuning setting) to compare them. Task records created are "
+        "removed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--seconds", type=int, default=30)
+        parser.add_argument(
+            "--write-fraction", type=float, default=0.3,
+            help="Fraction of operations which write",
+        )
+
+    def _read(self, user):
+        list(
+            Job.objects.filter(user=user)
+            .select_related("application__cluster", "partition")
+            .order_by("-date_time_submission", "-pk")[:50]
+        )
+        Job.objects.filter(status__in=ACTIVE_JOB_STATUSES).exists()
+
+    def _write(self, user, title):
+        task = Task.objects.create(owner=user, title=title, data={})
+        task.data = {"status": "running"}
+        task.save()
+        task.delete()
+
+    def _worker(self, worker_id, user, options, deadline, results):
+        latencies = {"read": [], "write": []}
+        errors = Counter()
+        title = f"db_load_test-{worker_id}"
+        while time.monotonic() < deadline:
+            kind = (
+                "write" if random.random() < options["write_fraction"]
+                else "read"
+            )
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    self._write(user, title)
+                else:
+                    self._read(user)
+                latencies[kind].append(time.perf_counter() - start)
+            except OperationalError as err:
+                errors[f"{kind}: {err}"] += 1
+        connection.close()
+        results[worker_id] = (latencies, errors)
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by("pk").first()
+        if not user:
+            raise CommandError("Need at least one user to own task records")
+        close_old_connections()
+
+        results = {}
+        deadline = time.monotonic() + options["seconds"]
+        threads = [
+            threading.Thread(
+                target=self._worker,
+                args=(i, user, options, deadline, results),
+            )
+            for i in range(options["threads"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Anything left behind by a failed delete
+        Task.objects.filter(title__startswith="db_load_test-").delete()
+
+        errors = Counter()
+        for (_, worker_errors) in results.values():
+            errors.update(worker_errors)
+
+        with connection.cursor() as cursor:
+            journal_mode = ""
+            if connection.vendor == "sqlite":
+                cursor.execute("PRAGMA journal_mode")
+                journal_mode = f" ({cursor.fetchone()[0]} journal)"
+        self.stdout.write(
+            f"Backend: {connection.vendor}{journal_mode}, "
+            f"{options['threads']} threads, {options['seconds']}s",
+            ending="\n",
+        )
+        for kind in ["read", "write"]:
+            latencies = sorted(
+                latency
+                for (worker, _) in results.values()
+                for latency in worker[kind]
+            )
+            if not latencies:
+                continue
+            self.stdout.write(
+                f"{kind:>6}s: {len(latencies)} "
+                f"({len(latencies) / options['seconds']:.1f}/s), "
+                f"median {statistics.median(latencies) * 1000:.1f}ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms",
+                ending="\n",
+            )
+        self.stdout.write(
+            f"Errors: {sum(errors.values())}", ending="\n"
+        )
+        for (error, count) in errors.most_common():
+            self.stdout.write(f"    {count:6d} {error}", ending="\n")
@@ -0,0 +1,134 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Populate the local Terraform provider mirror"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from ghpcfe.cluster_manager import utils
+
+
+class Command(BaseCommand):
+    """Mirror the Terraform providers used by the front end's deployments"""
+
+    help = (
+        "Downloads the Terraform providers needed by the VPC and workbench "
+        "templates, by any existing cluster, VPC, filesystem and workbench "
+        "deployments, and by any extra Terraform directories given, into "
+        "the local provider mirror, at the versions in their lock files. "
+        "Deployments then install those providers only from the mirror. "
+        "Needs registry access; re-run after upgrading the HPC Toolkit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "dirs", nargs="*", type=Path,
+            help="Extra Terraform directories whose providers to mirror",
+        )
+        parser.add_argument(
+            "--platform", action="append", default=None,
+            help="Platform(s) to mirror (default: linux_amd64)",
+        )
+
+    def _source_dirs(self):
+        base_dir = utils.load_config()["baseDir"]
+        templates = base_dir / "infrastructure_files"
+        dirs = [
+            templates / "vpc_tf" / "GCP",
+            templates / "workbench_tf" / "google",
+        ]
+        for deployments in ["clusters", "vpcs", "fs", "workbenches"]:
+            dirs.extend(
+                lock_file.parent
+                for lock_file in sorted(
+                    (base_dir / deployments).glob("**/.terraform.lock.hcl")
+                )
+                # Not those of modules installed into a deployment
+                if ".terraform" not in lock_file.parent.parts
+            )
+        return dirs
+
+    def _env(self):
+        # Fetch from the registry (via the cache), not the existing mirror
+        (cache_dir, _) = utils.terraform_plugin_dirs()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        env = os.environ.copy()
+        env.pop("TF_CLI_CONFIG_FILE", None)
+        env["TF_PLUGIN_CACHE_DIR"] = cache_dir.as_posix()
+        return env
+
+    def _mirror(self, source_dir, mirror_dir, platforms, env):
+        mirror_cmd = ["terraform", "providers", "mirror"]
+        mirror_cmd.extend(f"-platform={platform}" for platform in platforms)
+        mirror_cmd.append(mirror_dir.as_posix())
+
+        if (source_dir / ".terraform").is_dir():
+            subprocess.run(
+                mirror_cmd, cwd=source_dir, env=env, check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            return
+
+        # Templates need their modules installed for their providers to be
+        # found; do that in a scratch copy.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            work_dir = Path(tmp_dir) / "tf"
+            shutil.copytree(
+                source_dir, work_dir,
+                ignore=shutil.ignore_patterns("*.tfstate*", "*.tfvars"),
+            )
+            for cmdline in [
+                ["terraform", "init", "-backend=false", "-input=false"],
+                mirror_cmd,
+            ]:
+                subprocess.run(
+                    cmdline, cwd=work_dir, env=env, check=True,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                )
+
+    def handle(self, *args, **options):
+        (_, mirror_dir) = utils.terraform_plugin_dirs()
+        mirror_dir.mkdir(parents=True, exist_ok=True)
+        platforms = options["platform"] or ["linux_amd64"]
+        env = self._env()
+
+        failed = 0
+        for source_dir in self._source_dirs() + options["dirs"]:
+            if not source_dir.is_dir():
+                continue
+            self.stdout.write(f"Mirroring providers for {source_dir}",
+                              ending="\n")
+            try:
+                self._mirror(source_dir, mirror_dir, platforms, env)
+            except subprocess.CalledProcessError as cpe:
+                failed += 1
+                self.stderr.write(
+                    cpe.stderr.decode("utf-8", errors="replace"), ending="\n"
+                )
+
+        utils.write_terraform_cli_config()
+        providers = utils.mirrored_providers(mirror_dir)
+        self.stdout.write(
+            f"{len(providers)} providers in {mirror_dir}:", ending="\n"
+        )
+        for provider in providers:
+            self.stdout.write(f"    {provider}", ending="\n")
+        if failed:
+            raise CommandError(f"Failed to mirror providers for {failed} "
+                               "directories")
@@ -0,0 +1,76 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bring up a set of cloud resources and their prerequisites"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ghpcfe.cluster_manager.provisioning import Pipeline
+from ghpcfe.models import Cluster, Filesystem, VirtualNetwork, Workbench
+
+
+class Command(BaseCommand):
+    """Provision VPCs, filesystems, clusters and workbenches together"""
+
+    help = (
+        "Creates the given resources (already configured in the front end), "
+        "along with any VPCs and filesystems they need which aren't up yet. "
+        "Resources which don't depend on each other are created "
+        "concurrently. Each step's log is written to its own file."
+    )
+
+    def add_arguments(self, parser):
+        for (option, name) in [
+            ("--vpc", "VPC"),
+            ("--filesystem", "filesystem"),
+            ("--cluster", "cluster"),
+            ("--workbench", "workbench"),
+        ]:
+            parser.add_argument(
+                option, type=int, action="append", default=[],
+                metavar="ID", help=f"ID of a {name} to provision",
+            )
+        parser.add_argument(
+            "--concurrency", type=int, default=None,
+            help="Maximum concurrent steps "
+            "(config: provisioning_concurrency, default 4)",
+        )
+
+    def _progress(self, steps):
+        self.stdout.write(
+            "  ".join(f"{name}: {state}" for (name, state) in steps.items()),
+            ending="\n",
+        )
+
+    def handle(self, *args, **options):
+        pipeline = Pipeline(
+            max_workers=options["concurrency"], on_progress=self._progress
+        )
+        for (option, model, add) in [
+            ("vpc", VirtualNetwork, pipeline.add_vpc),
+            ("filesystem", Filesystem, pipeline.add_filesystem),
+            ("cluster", Cluster, pipeline.add_cluster),
+            ("workbench", Workbench, pipeline.add_workbench),
+        ]:
+            for pk in options[option]:
+                try:
+                    add(model.objects.get(pk=pk))
+                except model.DoesNotExist as err:
+                    raise CommandError(f"No {option} with ID {pk}") from err
+
+        if not pipeline.steps:
+            self.stdout.write("Nothing to provision", ending="\n")
+            return
+        self.stdout.write(f"Logs in {pipeline.log_dir}", ending="\n")
+        if not pipeline.run():
+            raise CommandError("Provisioning failed")
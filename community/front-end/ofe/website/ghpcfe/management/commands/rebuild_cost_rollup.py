@@ -0,0 +1,39 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rebuild the job cost rollup table"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ghpcfe.models import Job, JobCostRollup
+
+
+class Command(BaseCommand):
+    """Repopulate JobCostRollup from the Job table"""
+
+    help = (
+        "Rebuilds the per user/cluster/application/day job cost rollup from "
+        "the Job table. Run after enabling COST_ROLLUP_ENABLED."
+    )
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            JobCostRollup.objects.all().delete()
+            JobCostRollup.objects.bulk_create(
+                JobCostRollup.from_jobs(Job.objects.all()), batch_size=1000
+            )
+        self.stdout.write(
+            f"Rebuilt {JobCostRollup.objects.count()} cost rollup entries",
+            ending="\n",
+        )
@@ -0,0 +1,48 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rebuild the per-user quota ledger"""
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from ghpcfe.models import Job, User
+
+
+class Command(BaseCommand):
+    """Recompute User.quota_used from the Job table"""
+
+    help = (
+        "Recomputes each user's quota ledger balance from the cost of their "
+        "jobs. The migration adding the ledger does this once on upgrade; "
+        "run it to repair the ledger after editing jobs directly."
+    )
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            spend = dict(
+                Job.objects.values("user")
+                .annotate(spend=Sum("job_cost"))
+                .values_list("user", "spend")
+                .order_by()
+            )
+            users = list(User.objects.select_for_update())
+            for user in users:
+                user.quota_used = spend.get(user.id) or Decimal(0)
+            User.objects.bulk_update(users, ["quota_used"], batch_size=1000)
+        self.stdout.write(
+            f"Rebuilt quota ledger for {len(users)} users", ending="\n"
+        )
@@ -0,0 +1,53 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run queued backend tasks"""
+
+import signal
+
+from django.core.management.base import BaseCommand
+from ghpcfe.cluster_manager.task_queue import TaskWorker
+
+
+class Command(BaseCommand):
+    """Task worker process"""
+
+    help = (
+        "Runs queued backend tasks (cluster, VPC, filesystem and workbench "
+        "operations) until stopped. On SIGTERM or SIGINT, stops taking new "
+        "tasks and waits for running ones to finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Maximum concurrent tasks (config: task_workers, default 8)",
+        )
+
+    def handle(self, *args, **options):
+        worker = TaskWorker(max_workers=options["workers"])
+
+        def stop(signum, unused_frame):
+            self.stdout.write(
+                f"Received signal {signum}, stopping", ending="\n"
+            )
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(
+            f"Running tasks with up to {worker.max_workers} workers",
+            ending="\n",
+        )
+        worker.run()
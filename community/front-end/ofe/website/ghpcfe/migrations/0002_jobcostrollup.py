@@ -0,0 +1,43 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCostRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total_cost', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('num_jobs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='jobcostrollup',
+            name='application',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ghpcfe.application'),
+        ),
+        migrations.AddField(
+            model_name='jobcostrollup',
+            name='cluster',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ghpcfe.cluster'),
+        ),
+        migrations.AddField(
+            model_name='jobcostrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='jobcostrollup',
+            unique_together={('user', 'cluster', 'application', 'day')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0002_jobcostrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='quota_used',
+            field=models.DecimalField(decimal_places=3, default=0, help_text='Running total of reserved and settled job spend ($)', max_digits=12),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0003_user_quota_used'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['user', 'date_time_submission'], name='job_user_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['cluster', 'date_time_submission'], name='job_cluster_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['date_time_submission'], name='job_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status__in', ['p', 'q', 'd', 'r', 'u'])), fields=['status'], name='job_active_status_idx'),
+        ),
+    ]
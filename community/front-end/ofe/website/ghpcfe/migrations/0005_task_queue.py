@@ -0,0 +1,62 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0004_job_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='args',
+            field=models.JSONField(blank=True, default=list, help_text='Command arguments (see task_queue.encode_args)'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='cancel_requested',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='command',
+            field=models.CharField(blank=True, default='', help_text='Dotted path of the BackendAsyncView to run', max_length=256),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Last time the worker running this task checked in', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='max_attempts',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='not_before',
+            field=models.DateTimeField(blank=True, help_text="Don't start (or retry) the task before this time", null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='resource',
+            field=models.CharField(default='default', help_text='Resource type, for per-type concurrency limits', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='state',
+            field=models.CharField(choices=[('q', 'Queued'), ('r', 'Running'), ('e', 'Failed'), ('x', 'Cancelled')], default='q', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['state', 'resource'], name='task_state_idx'),
+        ),
+    ]
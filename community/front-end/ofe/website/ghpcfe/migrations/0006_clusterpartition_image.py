@@ -0,0 +1,19 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:39
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0005_task_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clusterpartition',
+            name='image',
+            field=models.CharField(blank=True, help_text='OS Image path, projects/<project>/global/images/<name> or projects/<project>/global/images/family/<family>', max_length=4096, validators=[django.core.validators.RegexValidator('(^|/)projects/[^/]+/global/images/(family/)?[^/]+$', message='Must be the path of an image or image family')]),
+        ),
+    ]
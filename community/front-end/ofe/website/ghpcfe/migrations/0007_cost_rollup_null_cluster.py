@@ -0,0 +1,57 @@
+# Generated by Django 3.2.12 on 2026-10-19 10:01
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_null_cluster_rows(apps, schema_editor):
+    """Merge rollup rows left with no cluster by deleting their clusters"""
+    JobCostRollup = apps.get_model("ghpcfe", "JobCostRollup")
+    duplicates = (
+        JobCostRollup.objects.filter(cluster__isnull=True)
+        .values("user", "application", "day")
+        .annotate(
+            rows=Count("id"),
+            total=Sum("total_cost"),
+            jobs=Sum("num_jobs"),
+        )
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for dup in duplicates:
+        rows = JobCostRollup.objects.filter(
+            cluster__isnull=True,
+            user=dup["user"],
+            application=dup["application"],
+            day=dup["day"],
+        ).order_by("id")
+        keep = rows.first()
+        rows.exclude(id=keep.id).delete()
+        keep.total_cost = dup["total"]
+        keep.num_jobs = dup["jobs"]
+        keep.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0006_clusterpartition_image'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='jobcostrollup',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='jobcostrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('cluster__isnull', False)), fields=('user', 'cluster', 'application', 'day'), name='rollup_unique_key'),
+        ),
+        migrations.RunPython(
+            merge_null_cluster_rows, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='jobcostrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('cluster__isnull', True)), fields=('user', 'application', 'day'), name='rollup_unique_key_no_cluster'),
+        ),
+    ]
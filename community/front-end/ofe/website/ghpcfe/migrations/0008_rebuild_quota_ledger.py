@@ -0,0 +1,37 @@
+# Generated by Django 3.2.12 on 2026-10-19 10:03
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def rebuild_quota_ledger(apps, schema_editor):
+    """Charge existing jobs to the new User.quota_used ledger
+
+    The same as the rebuild_quota_ledger command, which can't be used here
+    as it works on the current models.
+    """
+    Job = apps.get_model("ghpcfe", "Job")
+    User = apps.get_model("ghpcfe", "User")
+    spend = dict(
+        Job.objects.values("user")
+        .annotate(spend=Sum("job_cost"))
+        .values_list("user", "spend")
+        .order_by()
+    )
+    users = list(User.objects.filter(pk__in=spend))
+    for user in users:
+        user.quota_used = spend[user.pk] or Decimal(0)
+    User.objects.bulk_update(users, ["quota_used"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0007_cost_rollup_null_cluster'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_quota_ledger, migrations.RunPython.noop),
+    ]
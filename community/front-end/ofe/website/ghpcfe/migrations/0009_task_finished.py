@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-19 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0008_rebuild_quota_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='finished',
+            field=models.DateTimeField(blank=True, help_text='When the task failed or was cancelled', null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.12 on 2026-10-19 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghpcfe', '0009_task_finished'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheGeneration',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('generation', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -20,6 +20,7 @@ import re
 import ipaddress
 import uuid
 from decimal import Decimal
+from functools import cached_property
 
 import dill
 from allauth.socialaccount.models import SocialAccount
@@ -27,7 +28,9 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
@@ -90,6 +93,11 @@ def CIDRValidator(value):
     return value
 
 
+def stored_job_cost(cost):
+    """Round a cost as Job.job_cost will store it"""
+    return Decimal(str(cost)).quantize(Decimal("0.001"))
+
+
 class Role(models.Model):
     """Model representing different user roles"""
 
@@ -131,35 +139,27 @@ class User(AbstractUser):
         help_text="Maximum allowed spend ($)",
         default=0,
     )
+    quota_used = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        help_text="Running total of reserved and settled job spend ($)",
+        default=0,
+    )
 
     def total_spend(self, date_range=None, cluster_id=None):
         filters = {"user": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
         if cluster_id:
             filters["cluster"] = cluster_id
-
-        jobs = Job.objects.filter(**filters)
-
-        total_spend = Decimal(0)
-        for job in jobs:
-            total_spend += job.job_cost
-
-        return total_spend
+        return job_cost_totals(date_range, **filters)[0]
 
     def total_jobs(self, date_range=None, cluster_id=None):
         filters = {"user": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
         if cluster_id:
             filters["cluster"] = cluster_id
-
-        jobs = Job.objects.filter(**filters)
-
-        return len(jobs)
+        return job_cost_totals(date_range, **filters)[1]
 
     def quota_remaining(self):
-        return self.quota_amount - self.total_spend()
+        return self.quota_amount - self.quota_used
 
     def check_sufficient_quota_for_job(self, job_cost):
         # Quota checks
@@ -169,12 +169,40 @@ class User(AbstractUser):
             return False
 
         if self.quota_type == "l":
-            current_used = self.total_spend()
-            if (current_used + job_cost) < self.quota_amount:
+            if (self.quota_used + job_cost) < self.quota_amount:
                 return True
 
         return False
 
+    def reserve_quota(self, job_cost):
+        """Charge a job's predicted cost against the quota ledger
+
+        The check and the charge are a single conditional UPDATE, so
+        concurrent submissions cannot overspend.  Returns False, charging
+        nothing, if there is insufficient quota remaining.
+        """
+        if self.quota_type == "d":
+            return False
+
+        job_cost = stored_job_cost(job_cost)
+        users = User.objects.filter(pk=self.pk)
+        if self.quota_type == "l":
+            # Fudge to nearest cent to avoid "apparently equal" issues in user
+            # display
+            users = users.filter(
+                quota_used__lte=F("quota_amount") - job_cost - Decimal("0.005")
+            )
+        reserved = users.update(quota_used=F("quota_used") + job_cost)
+        self.refresh_from_db(fields=["quota_used"])
+        return bool(reserved)
+
+    def settle_quota(self, reserved_cost, actual_cost):
+        """Replace a job's reserved (predicted) cost with its actual cost"""
+        delta = stored_job_cost(actual_cost) - stored_job_cost(reserved_cost)
+        User.objects.filter(pk=self.pk).update(
+            quota_used=F("quota_used") + delta
+        )
+
     def get_avatar_url(self):
         """If using social login, return the Google profile picture if
         available"""
@@ -189,14 +217,24 @@ class User(AbstractUser):
             url = data["picture"]
         return url
 
+    @cached_property
+    def role_ids(self):
+        """IDs of this user's roles
+
+        Loaded once per User instance, so once per request for request.user
+        (or not at all if roles have been prefetched). Cleared when the
+        roles are changed through this instance - see signals.py.
+        """
+        return frozenset(role.id for role in self.roles.all())
+
     def has_viewer_role(self):
-        return bool(self.roles.filter(id=3).exists())
+        return Role.VIEWER in self.role_ids
 
     def has_normaluser_role(self):
-        return bool(self.roles.filter(id=2).exists())
+        return Role.NORMALUSER in self.role_ids
 
     def has_admin_role(self):
-        return bool(self.roles.filter(id=1).exists())
+        return Role.CLUSTERADMIN in self.role_ids
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -207,7 +245,8 @@ def user_post_save(  # pylint: disable=invalid-name,unused-argument
     **kwargs,
 ):
     """Initialise certain information for new users"""
-    if created:
+    # Users loaded by loaddata bring their own tokens and roles
+    if created and not kwargs.get("raw"):
         # generate API token
         Token.objects.create(user=instance)
         # by default set new user to 'ordinary user'
@@ -659,26 +698,10 @@ class Cluster(CloudResource):
         return Token.objects.get(user=self.owner)
 
     def total_cost(self, date_range=None):
-        # Django won't accept None on a kwarg to ignore it...
-        filters = {"cluster": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
-        jobs = Job.objects.filter(**filters)
-
-        total_cost = Decimal(0)
-        for job in jobs:
-            total_cost += job.job_cost
-
-        return total_cost
+        return job_cost_totals(date_range, cluster=self.id)[0]
 
     def total_jobs(self, date_range=None):
-        # Django won't accept None on a kwarg to ignore it...
-        filters = {"cluster": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
-        jobs = Job.objects.filter(**filters)
-
-        return len(jobs)
+        return job_cost_totals(date_range, cluster=self.id)[1]
 
     def __str__(self):
         """String for representing the Model object."""
@@ -733,7 +756,16 @@ class ClusterPartition(models.Model):
     )
     image = models.CharField(
         max_length=4096,
-        help_text="OS Image path",
+        help_text=(
+            "OS Image path, projects/<project>/global/images/<name> or "
+            "projects/<project>/global/images/family/<family>"
+        ),
+        validators=[
+            RegexValidator(
+                r"(^|/)projects/[^/]+/global/images/(family/)?[^/]+$",
+                message="Must be the path of an image or image family",
+            )
+        ],
         blank=True,
     )
     max_node_count = models.PositiveIntegerField(
@@ -886,26 +918,10 @@ class Application(models.Model):
         return f"{self.name} - {self.get_status_display()}"
 
     def total_spend(self, date_range=None):
-        # Django won't accept None on a kwarg to ignore it...
-        filters = {"application": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
-        jobs = Job.objects.filter(**filters)
-
-        total_spend = Decimal(0)
-        for job in jobs:
-            total_spend += job.job_cost
-
-        return total_spend
+        return job_cost_totals(date_range, application=self.id)[0]
 
     def total_jobs(self, date_range=None):
-        # Django won't accept None on a kwarg to ignore it...
-        filters = {"application": self.id}
-        if date_range:
-            filters["date_time_submission__range"] = date_range
-        jobs = Job.objects.filter(**filters)
-
-        return len(jobs)
+        return job_cost_totals(date_range, application=self.id)[1]
 
 
 class CustomInstallationApplication(Application):
@@ -971,6 +987,11 @@ class Benchmark(models.Model):
         return self.name
 
 
+# Statuses of jobs still in flight. Job status queries should use this exact
+# list so that the partial index on Job.status applies.
+ACTIVE_JOB_STATUSES = ["p", "q", "d", "r", "u"]
+
+
 class Job(models.Model):
     """Model representing a single run of an application"""
 
@@ -1157,12 +1178,160 @@ class Job(models.Model):
         null=True,
     )
 
+    class Meta:
+        # user, cluster, application and benchmark already get single column
+        # foreign key indexes
+        indexes = [
+            # Per-user listings and spend over a date range
+            models.Index(
+                fields=["user", "date_time_submission"],
+                name="job_user_submitted_idx",
+            ),
+            # Cluster cost reports over a date range
+            models.Index(
+                fields=["cluster", "date_time_submission"],
+                name="job_cluster_submitted_idx",
+            ),
+            # Admin job listing, newest first
+            models.Index(
+                fields=["date_time_submission"], name="job_submitted_idx"
+            ),
+            # Completed jobs dominate the table, so only index active ones
+            models.Index(
+                fields=["status"],
+                name="job_active_status_idx",
+                condition=Q(status__in=ACTIVE_JOB_STATUSES),
+            ),
+        ]
+
     def __str__(self):
         """String for representing the Model object."""
         return f"#{self.id} - '{self.name}' on {self.application.cluster}"
 
 
+class JobCostRollup(models.Model):
+    """Running job spend per user, cluster, application and submission day
+
+    Only maintained (by the Job signal handlers) when
+    settings.COST_ROLLUP_ENABLED is set.  Use the rebuild_cost_rollup
+    management command to (re)populate it from the Job table.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    # Mirrors Job.cluster, which is nulled when a cluster is deleted
+    cluster = models.ForeignKey(
+        Cluster,
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    application = models.ForeignKey(
+        Application,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    day = models.DateField()
+    total_cost = models.DecimalField(
+        max_digits=16,
+        decimal_places=3,
+        default=0,
+    )
+    num_jobs = models.IntegerField(default=0)
+
+    class Meta:
+        # A plain unique constraint treats every NULL cluster as distinct
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "cluster", "application", "day"],
+                condition=Q(cluster__isnull=False),
+                name="rollup_unique_key",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "application", "day"],
+                condition=Q(cluster__isnull=True),
+                name="rollup_unique_key_no_cluster",
+            ),
+        ]
+
+    @classmethod
+    def add(cls, key, cost, num_jobs):
+        """Adjust the totals for key (user_id, cluster_id, application_id, day)
+        """
+        (user_id, cluster_id, application_id, day) = key
+        filters = {
+            "user_id": user_id,
+            "cluster_id": cluster_id,
+            "application_id": application_id,
+            "day": day,
+        }
+        increment = {
+            "total_cost": F("total_cost") + cost,
+            "num_jobs": F("num_jobs") + num_jobs,
+        }
+        if cls.objects.filter(**filters).update(**increment):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    total_cost=cost, num_jobs=num_jobs, **filters
+                )
+        except IntegrityError:
+            # Somebody else created the row first
+            cls.objects.filter(**filters).update(**increment)
+
+    @classmethod
+    def from_jobs(cls, jobs):
+        """Unsaved rollup rows totalling the jobs of a Job queryset"""
+        rows = (
+            jobs.exclude(date_time_submission__isnull=True)
+            .annotate(day=TruncDate("date_time_submission"))
+            .values("user", "cluster", "application", "day")
+            .annotate(total_cost=Sum("job_cost"), num_jobs=Count("id"))
+            .order_by()
+        )
+        for row in rows.iterator():
+            yield cls(
+                user_id=row["user"],
+                cluster_id=row["cluster"],
+                application_id=row["application"],
+                day=row["day"],
+                total_cost=row["total_cost"],
+                num_jobs=row["num_jobs"],
+            )
+
+
+def job_cost_totals(date_range=None, **filters):
+    """Return (total cost, number of jobs) for the jobs matching filters
+
+    Uses the JobCostRollup table when enabled and no date range is given,
+    otherwise a single aggregate over the Job table.
+    """
+    if settings.COST_ROLLUP_ENABLED and not date_range:
+        totals = JobCostRollup.objects.filter(**filters).aggregate(
+            cost=Sum("total_cost"), jobs=Sum("num_jobs")
+        )
+    else:
+        # Django won't accept None on a kwarg to ignore it...
+        if date_range:
+            filters["date_time_submission__range"] = date_range
+        totals = Job.objects.filter(**filters).aggregate(
+            cost=Sum("job_cost"), jobs=Count("id")
+        )
+    return (totals["cost"] or Decimal(0), totals["jobs"] or 0)
+
+
 class Task(models.Model):
+    """A long running backend operation
+
+    Tasks with a command are queued for the task worker process (see
+    cluster_manager/task_queue.py); others just carry progress data for
+    the browser.
+    """
+
     owner = models.ForeignKey(
         User,
         help_text="Who is running the task",
@@ -1176,6 +1345,81 @@ class Task(models.Model):
         null=False,
         default=dict,
     )
+    command = models.CharField(
+        max_length=256,
+        blank=True,
+        default="",
+        help_text="Dotted path of the BackendAsyncView to run",
+    )
+    args = models.JSONField(
+        blank=True,
+        default=list,
+        help_text="Command arguments (see task_queue.encode_args)",
+    )
+    resource = models.CharField(
+        max_length=32,
+        default="default",
+        help_text="Resource type, for per-type concurrency limits",
+    )
+    TASK_STATE = (
+        ("q", "Queued"),
+        ("r", "Running"),
+        ("e", "Failed"),
+        ("x", "Cancelled"),
+    )
+    state = models.CharField(
+        max_length=1,
+        choices=TASK_STATE,
+        default="q",
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    not_before = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Don't start (or retry) the task before this time",
+    )
+    heartbeat = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Last time the worker running this task checked in",
+    )
+    finished = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="When the task failed or was cancelled",
+    )
+    cancel_requested = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "resource"], name="task_state_idx"),
+        ]
+
+
+class CacheGeneration(models.Model):
+    """Generation of an in-process cache shared by every process
+
+    The web server and the task worker each keep their own caches of cloud
+    listings (see cluster_manager/cloud_info.py).  Caches are keyed on their
+    generation, so bumping it here invalidates them in every process.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    generation = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def current(cls, name):
+        return (
+            cls.objects.filter(name=name)
+            .values_list("generation", flat=True)
+            .first()
+        ) or 0
+
+    @classmethod
+    def bump(cls, name):
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(generation=F("generation") + 1)
 
 
 class CallbackField(models.TextField):
@@ -15,7 +15,6 @@
 """Permission handling view mixin classes"""
 
 from rest_framework import permissions
-from .models import Role
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 
 
@@ -25,7 +24,7 @@ class CredentialPermission(permissions.BasePermission):
 
     def has_permission(self, request, view):   # pylint: disable=unused-argument
         permission = False
-        if Role.CLUSTERADMIN in [x.id for x in request.user.roles.all()]:
+        if request.user.has_admin_role():
             permission = True
         return permission
 
@@ -147,7 +147,16 @@ class TaskSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Task
-        fields = ("owner", "title", "data")
+        fields = (
+            "id",
+            "owner",
+            "title",
+            "data",
+            "state",
+            "resource",
+            "attempts",
+            "cancel_requested",
+        )
 
 
 class VirtualNetworkSerializer(serializers.ModelSerializer):
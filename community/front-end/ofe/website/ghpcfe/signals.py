@@ -14,19 +14,70 @@
 
 """Signal handlers for model state"""
 
-from django.db.models.signals import pre_save, post_delete
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import F, Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
-from .models import Cluster, VirtualNetwork
+from .cluster_manager import cloud_info
+from .models import (
+    Cluster,
+    Credential,
+    Job,
+    JobCostRollup,
+    User,
+    VirtualNetwork,
+    stored_job_cost,
+)
 
 # Pylint misses the sender decorator behaviour here
 #pylint: disable=unused-argument
 
+@receiver(connection_created)
+def tune_sqlite_connection(sender, **kwargs):
+    connection = kwargs["connection"]
+    if connection.vendor != "sqlite" or not settings.SQLITE_TUNING_ENABLED:
+        return
+    with connection.cursor() as cursor:
+        for (pragma, value) in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+# Saves with "raw" set come from loaddata (e.g. when moving to another
+# database), where related rows may not be loaded yet and derived state is
+# loaded along with everything else, so the save handlers skip them.
+
 @receiver(pre_save, sender=VirtualNetwork)
 def sync_vnet_subnet_state(sender, **kwargs):
+    if kwargs["raw"]:
+        return
     vpc = kwargs["instance"]
-    for sn in vpc.subnets.all():
-        sn.cloud_state = vpc.cloud_state
-        sn.save()
+    if vpc.pk is None:
+        return
+    # Only subnets whose state differs are written, in one statement
+    vpc.subnets.exclude(cloud_state=vpc.cloud_state).update(
+        cloud_state=vpc.cloud_state
+    )
+
+
+@receiver(m2m_changed, sender=User.roles.through)
+def reset_cached_roles(sender, **kwargs):
+    user = kwargs["instance"]
+    if isinstance(user, User):
+        user.__dict__.pop("role_ids", None)
+
+
+@receiver(post_delete, sender=Credential)
+def evict_credential_clients(sender, **kwargs):
+    credential = kwargs["instance"]
+    cloud_info.evict_gcp_clients(credential.detail)
 
 
 @receiver(post_delete, sender=Cluster)
@@ -39,20 +90,110 @@ def delete_cluster_extras(sender, **kwargs):
 
 @receiver(pre_save, sender=Cluster)
 def sync_cluster_fs_ip(sender, **kwargs):
+    if kwargs["raw"]:
+        return
     cluster = kwargs["instance"]
     if cluster.subnet:
         cluster.cloud_region = cluster.subnet.cloud_region
-    if cluster.shared_fs:
-        cluster.shared_fs.cloud_id = cluster.cloud_id
-        cluster.shared_fs.cloud_state = cluster.cloud_state
-        cluster.shared_fs.cloud_region = cluster.cloud_region
-        cluster.shared_fs.cloud_zone = cluster.cloud_zone
-        cluster.shared_fs.cloud_credential = cluster.cloud_credential
-        cluster.shared_fs.name = f"{cluster.name}-sharedfs"
-        cluster.shared_fs.internal_name = f"{cluster.name} SharedFS"
-        cluster.shared_fs.subnet = cluster.subnet
-        if cluster.controller_node:
-            cluster.shared_fs.hostname_or_ip = (
-                cluster.controller_node.internal_ip
-            )
-        cluster.shared_fs.save()
+    fs = cluster.shared_fs
+    if not fs:
+        return
+    wanted = {
+        "cloud_id": cluster.cloud_id,
+        "cloud_state": cluster.cloud_state,
+        "cloud_region": cluster.cloud_region,
+        "cloud_zone": cluster.cloud_zone,
+        "cloud_credential_id": cluster.cloud_credential_id,
+        "name": f"{cluster.name}-sharedfs",
+        "internal_name": f"{cluster.name} SharedFS",
+        "subnet_id": cluster.subnet_id,
+    }
+    if cluster.controller_node:
+        wanted["hostname_or_ip"] = cluster.controller_node.internal_ip
+    # Most cluster saves (status changes and the like) change none of these
+    changed = [
+        field for (field, value) in wanted.items()
+        if getattr(fs, field) != value
+    ]
+    if changed:
+        for field in changed:
+            setattr(fs, field, wanted[field])
+        fs.save(update_fields=changed)
+
+
+def _job_rollup_key(job):
+    return (
+        job.user_id,
+        job.cluster_id,
+        job.application_id,
+        job.date_time_submission.date(),
+    )
+
+
+@receiver(post_init, sender=Job)
+def snapshot_job_cost(sender, **kwargs):
+    job = kwargs["instance"]
+    if settings.COST_ROLLUP_ENABLED and job.pk and job.date_time_submission:
+        job._rollup_snapshot = (  # pylint: disable=protected-access
+            _job_rollup_key(job),
+            stored_job_cost(job.job_cost),
+        )
+
+
+@receiver(post_save, sender=Job)
+def update_job_cost_rollup(sender, **kwargs):
+    # Fixture loads (raw) bring their own JobCostRollup rows
+    if kwargs["raw"] or not settings.COST_ROLLUP_ENABLED:
+        return
+    job = kwargs["instance"]
+    new = (_job_rollup_key(job), stored_job_cost(job.job_cost))
+    old = getattr(job, "_rollup_snapshot", None)
+    if kwargs["created"] or not old:
+        JobCostRollup.add(new[0], new[1], 1)
+    elif old != new:
+        if old[0] == new[0]:
+            JobCostRollup.add(new[0], new[1] - old[1], 0)
+        else:
+            JobCostRollup.add(old[0], -old[1], -1)
+            JobCostRollup.add(new[0], new[1], 1)
+    job._rollup_snapshot = new  # pylint: disable=protected-access
+
+
+@receiver(post_delete, sender=Job)
+def remove_job_cost_rollup(sender, **kwargs):
+    if not settings.COST_ROLLUP_ENABLED:
+        return
+    job = kwargs["instance"]
+    JobCostRollup.add(_job_rollup_key(job), -stored_job_cost(job.job_cost), -1)
+
+
+@receiver(pre_delete, sender=Cluster)
+def delete_cluster_cost_rollup(sender, **kwargs):
+    # Nulling their cluster could clash with existing rows without one
+    JobCostRollup.objects.filter(cluster=kwargs["instance"]).delete()
+
+
+@receiver(post_delete, sender=Cluster)
+def rebuild_cluster_cost_rollup(sender, **kwargs):
+    # Jobs deleted along with the cluster have since adjusted rows under its
+    # old ID, and those which remain now have no cluster, so the rows for
+    # jobs without a cluster are rebuilt
+    if not settings.COST_ROLLUP_ENABLED:
+        return
+    cluster = kwargs["instance"]
+    JobCostRollup.objects.filter(
+        Q(cluster__isnull=True) | Q(cluster_id=cluster.pk)
+    ).delete()
+    JobCostRollup.objects.bulk_create(
+        JobCostRollup.from_jobs(Job.objects.filter(cluster__isnull=True)),
+        batch_size=1000,
+    )
+
+
+@receiver(post_delete, sender=Job)
+def refund_job_quota(sender, **kwargs):
+    # Keep the quota ledger equal to the cost of the user's remaining jobs
+    job = kwargs["instance"]
+    User.objects.filter(pk=job.user_id).update(
+        quota_used=F("quota_used") - stored_job_cost(job.job_cost)
+    )
@@ -0,0 +1,1243 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the ghpcfe app
+
+These use the test database and temporary files; nothing here talks to
+the cloud.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+import yaml
+from asgiref.sync import async_to_sync
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import QueryDict
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
+from django.views import generic
+from rest_framework import filters
+from rest_framework.request import Request
+
+from . import cost_report
+from .cluster_manager import (
+    blueprint,
+    cache_warmer,
+    cloud_info,
+    golden_image,
+    provisioning,
+    task_queue,
+    tfstate,
+    utils,
+)
+from .cluster_manager.clusterinfo import (
+    ClusterInfo,
+    _controller_module,
+    _login_module,
+)
+from .views.asyncview import BackendAsyncView, report_failed_tasks
+from .views.clusters import ClusterCostExportView
+from .views.jobs import BackendJobRun
+from .views.view_utils import (
+    KeysetListMixin,
+    OptionalCursorPagination,
+    get_date_range,
+)
+from .models import (
+    Application,
+    Cluster,
+    ClusterPartition,
+    ComputeInstance,
+    Credential,
+    Filesystem,
+    FilesystemImpl,
+    Job,
+    JobCostRollup,
+    Role,
+    Task,
+    User,
+    VirtualNetwork,
+    VirtualSubnet,
+)
+
+
+class FixtureMixin:
+    """Builds the minimum set of rows a cluster needs"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for role_id, _ in Role.ROLE_CHOICES:
+            Role.objects.get_or_create(id=role_id)
+        cls.admin = User.objects.create_superuser("admin", password="admin")
+        cls.user = User.objects.create_user("user", password="user")
+        cls.credential = Credential.objects.create(
+            name="cred", owner=cls.admin, detail="{}"
+        )
+        cls.vpc = VirtualNetwork.objects.create(
+            name="vpc",
+            cloud_credential=cls.credential,
+            cloud_region="us-central1",
+            cloud_state="m",
+        )
+        cls.subnet = VirtualSubnet.objects.create(
+            name="subnet",
+            vpc=cls.vpc,
+            cidr="10.0.0.0/16",
+            cloud_credential=cls.credential,
+            cloud_region="us-central1",
+            cloud_state="m",
+        )
+
+    @classmethod
+    def make_cluster(cls, name="cluster", **kwargs):
+        shared_fs = Filesystem.objects.create(
+            name=f"{name}-sharedfs",
+            subnet=cls.subnet,
+            vpc=cls.vpc,
+            impl_type=FilesystemImpl.BUILT_IN,
+            cloud_credential=cls.credential,
+            cloud_region="us-central1",
+        )
+        return Cluster.objects.create(
+            name=name,
+            owner=cls.admin,
+            subnet=cls.subnet,
+            shared_fs=shared_fs,
+            cloud_credential=cls.credential,
+            cloud_region="us-central1",
+            cloud_zone="us-central1-a",
+            **kwargs,
+        )
+
+    @classmethod
+    def make_partition(cls, cluster):
+        return ClusterPartition.objects.create(
+            name="batch", cluster=cluster, machine_type="c2-standard-60"
+        )
+
+    @classmethod
+    def make_application(cls, cluster):
+        return Application.objects.create(name="app", cluster=cluster)
+
+    @classmethod
+    def make_job(cls, application, partition, cost, submitted=None, **kwargs):
+        """A job submitted at submitted (default now) costing cost"""
+        job = Job.objects.create(
+            application=application,
+            cluster=kwargs.pop("cluster", partition.cluster),
+            name="job",
+            user=kwargs.pop("user", cls.user),
+            partition=partition,
+            number_of_nodes=1,
+            ranks_per_node=1,
+            run_script="#!/bin/bash",
+            job_cost=cost,
+            **kwargs,
+        )
+        if submitted:
+            # date_time_submission is auto_now_add
+            job.date_time_submission = submitted
+            job.save()
+        return job
+
+
+class SignalWriteTests(FixtureMixin, TestCase):
+    """Saves only write the derived rows which actually change"""
+
+    def test_cluster_status_save(self):
+        cluster = self.make_cluster()
+        cluster = Cluster.objects.select_related("shared_fs", "subnet").get(
+            pk=cluster.pk
+        )
+        cluster.status = "r"
+        # The CloudResource and Cluster rows, and no Filesystem write
+        with self.assertNumQueries(2):
+            cluster.save()
+
+    def test_cluster_state_save_updates_fs(self):
+        cluster = self.make_cluster()
+        cluster = Cluster.objects.select_related("shared_fs", "subnet").get(
+            pk=cluster.pk
+        )
+        cluster.cloud_state = "m"
+        # Plus the shared filesystem's CloudResource row
+        with self.assertNumQueries(3):
+            cluster.save()
+        cluster.shared_fs.refresh_from_db()
+        self.assertEqual(cluster.shared_fs.cloud_state, "m")
+
+    def test_vpc_save(self):
+        vpc = VirtualNetwork.objects.get(pk=self.vpc.pk)
+        # Finding the subnets to update, which matches none here
+        with self.assertNumQueries(3):
+            vpc.save()
+        vpc.cloud_state = "dm"
+        # Plus one UPDATE of all of the subnets
+        with self.assertNumQueries(4):
+            vpc.save()
+        self.assertEqual(
+            VirtualSubnet.objects.get(pk=self.subnet.pk).cloud_state, "dm"
+        )
+
+
+def _tf_instance(name, ip):
+    return {
+        "attributes": {
+            "name": name,
+            "machine_type": "n2-standard-2",
+            "network_interface": [
+                {"network_ip": ip, "access_config": [{"nat_ip": None}]}
+            ],
+            "service_account": [{"email": "sa@example.com"}],
+        }
+    }
+
+
+def _tf_state(module, instances):
+    return {
+        "module": module,
+        "mode": "managed",
+        "type": "google_compute_instance_from_template",
+        "name": "slurm_instance",
+        "instances": instances,
+    }
+
+
+class ImportInstancesTests(FixtureMixin, TestCase):
+    """Node records follow the instances in the Terraform state"""
+
+    def _import(self, cluster, logins):
+        state = tfstate.TerraformState(
+            {
+                "resources": [
+                    _tf_state(
+                        _controller_module,
+                        [_tf_instance("ctrl", "10.0.0.2")],
+                    ),
+                    _tf_state(_login_module, logins),
+                ]
+            }
+        )
+        ClusterInfo(cluster).import_instances(state)
+
+    def test_import_login_nodes(self):
+        cluster = self.make_cluster(num_login_nodes=2)
+        self._import(
+            cluster,
+            [
+                _tf_instance("login0", "10.0.0.3"),
+                _tf_instance("login1", "10.0.0.4"),
+            ],
+        )
+        cluster.refresh_from_db()
+        self.assertEqual(cluster.controller_node.cloud_id, "ctrl")
+        self.assertEqual(
+            sorted(cluster.login_nodes.values_list("cloud_id", "internal_ip")),
+            [("login0", "10.0.0.3"), ("login1", "10.0.0.4")],
+        )
+        self.assertEqual(ComputeInstance.objects.count(), 3)
+
+    def test_reimport(self):
+        cluster = self.make_cluster(num_login_nodes=2)
+        self._import(
+            cluster,
+            [
+                _tf_instance("login0", "10.0.0.3"),
+                _tf_instance("login1", "10.0.0.4"),
+            ],
+        )
+        cluster.refresh_from_db()
+        self._import(
+            cluster,
+            [
+                _tf_instance("login0", "10.0.0.5"),
+                _tf_instance("login2", "10.0.0.6"),
+            ],
+        )
+        self.assertEqual(
+            sorted(cluster.login_nodes.values_list("cloud_id", "internal_ip")),
+            [("login0", "10.0.0.5"), ("login2", "10.0.0.6")],
+        )
+        # An unchanged state only reads the controller and login nodes
+        # (the other two queries are the transaction's savepoint)
+        cluster.refresh_from_db()
+        with self.assertNumQueries(4):
+            self._import(
+                cluster,
+                [
+                    _tf_instance("login0", "10.0.0.5"),
+                    _tf_instance("login2", "10.0.0.6"),
+                ],
+            )
+
+
+class TerraformStateTests(SimpleTestCase):
+    """Terraform state files are indexed, cached and read-only"""
+
+    state = {
+        "outputs": {"cluster_id": {"value": "abc"}},
+        "resources": [
+            _tf_state(_login_module, [_tf_instance("login0", "10.0.0.3")]),
+            {
+                "module": _login_module,
+                "mode": "data",
+                "type": "google_compute_image",
+                "name": "slurm_instance",
+                "instances": [{}],
+            },
+            {
+                "mode": "managed",
+                "type": "google_storage_bucket",
+                "name": "bucket",
+                "instances": [{"attributes": {"name": "bucket"}}],
+            },
+        ],
+    }
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_file = Path(tmpdir.name) / "terraform.tfstate"
+        self.state_file.write_text(json.dumps(self.state), encoding="utf-8")
+
+    def test_index(self):
+        state = tfstate.load(self.state_file)
+        self.assertEqual(state.output("cluster_id"), "abc")
+        self.assertIsNone(state.output("missing"))
+        # The data source of the same name isn't indexed
+        self.assertEqual(
+            len(state.resources(_login_module, "slurm_instance")), 1
+        )
+        self.assertEqual(
+            state.instances(_login_module, "slurm_instance")[0]["attributes"][
+                "name"
+            ],
+            "login0",
+        )
+        self.assertEqual(
+            state.instances(
+                _login_module, "slurm_instance", "google_compute_image"
+            ),
+            (),
+        )
+        # Resources of the root module
+        self.assertIsNotNone(
+            state.resource(None, "google_storage_bucket", "bucket")
+        )
+
+    def test_read_only(self):
+        state = tfstate.load(self.state_file)
+        with self.assertRaises(TypeError):
+            state.outputs["cluster_id"] = "changed"
+        instance = state.instances(_login_module, "slurm_instance")[0]
+        with self.assertRaises(TypeError):
+            instance["attributes"]["name"] = "changed"
+
+    def test_cache(self):
+        state = tfstate.load(self.state_file)
+        self.assertIs(tfstate.load(self.state_file), state)
+        # A change of size is noticed even within the mtime resolution
+        changed = dict(self.state, outputs={"cluster_id": {"value": "abcd"}})
+        self.state_file.write_text(json.dumps(changed), encoding="utf-8")
+        self.assertEqual(
+            tfstate.load_outputs(self.state_file)["cluster_id"], "abcd"
+        )
+
+
+class TerraformCLIConfigTests(SimpleTestCase):
+    """The shared Terraform CLI config"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache_dir = Path(tmpdir.name) / "cache"
+        self.mirror_dir = Path(tmpdir.name) / "mirror"
+        self.providers = self.mirror_dir / "registry.terraform.io/hashicorp"
+        (self.providers / "google").mkdir(parents=True)
+        for (name, value) in [
+            ("terraform_plugin_dirs", (self.cache_dir, self.mirror_dir)),
+            ("terraform_version", (1, 5, 7)),
+        ]:
+            patcher = mock.patch.object(utils, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_config(self):
+        config = utils.write_terraform_cli_config().read_text()
+        self.assertIn("plugin_cache_may_break_dependency_lock_file", config)
+        self.assertIn(
+            'include = ["registry.terraform.io/hashicorp/google"]', config
+        )
+        # Mirrored providers don't need the registry
+        self.assertIn(
+            'exclude = ["registry.terraform.io/hashicorp/google"]', config
+        )
+
+    def test_registry_fallback(self):
+        with mock.patch.dict(
+            utils.load_config()["server"],
+            {"terraform_registry_fallback": True},
+        ):
+            config = utils.write_terraform_cli_config().read_text()
+        self.assertIn("  direct {\n  }", config)
+        self.assertNotIn("exclude", config)
+
+    def test_old_terraform(self):
+        utils.terraform_version.return_value = (1, 3, 9)
+        config = utils.write_terraform_cli_config().read_text()
+        self.assertNotIn("plugin_cache_may_break_dependency_lock_file", config)
+
+    def test_unchanged(self):
+        config_file = utils.write_terraform_cli_config()
+        with mock.patch.object(Path, "replace") as replace:
+            self.assertEqual(utils.write_terraform_cli_config(), config_file)
+            replace.assert_not_called()
+            (self.providers / "null").mkdir()
+            utils.write_terraform_cli_config()
+            replace.assert_called_once()
+
+
+class TerraformPlanTests(SimpleTestCase):
+    """Applying a saved plan reports progress against its change count"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.target_dir = Path(tmpdir.name)
+        (self.target_dir / "main.tf").write_text("")
+
+    def _plan(self, command_dir, command, arguments, extra_env=None):
+        (command_dir / "tfplan").write_text("plan")
+        summary = {"type": "change_summary", "changes": {"add": 3, "change": 1}}
+        (command_dir / "terraform_plan_log.json").write_text(
+            json.dumps({"type": "version"}) + "\n" + json.dumps(summary)
+        )
+
+    def _apply(self):
+        events = [
+            {"type": "apply_complete", "hook": {"resource": {"addr": "a"}}},
+        ]
+        proc = mock.MagicMock()
+        proc.stdout = [json.dumps(event) + "\n" for event in events]
+        proc.wait.return_value = 0
+        reports = []
+        with mock.patch.object(utils.subprocess, "Popen") as popen:
+            popen.return_value.__enter__.return_value = proc
+            with open(os.devnull, "w", encoding="utf-8") as devnull:
+                utils._stream_terraform(  # pylint: disable=protected-access
+                    ["terraform", "apply", "-json", "tfplan"],
+                    self.target_dir,
+                    {},
+                    devnull,
+                    None,
+                    lambda **data: reports.append(data["terraform"]),
+                )
+        return reports[-1]
+
+    def test_apply_saved_plan(self):
+        with mock.patch.object(utils, "run_terraform", side_effect=self._plan):
+            utils.plan_terraform(self.target_dir)
+        progress = self._apply()
+        self.assertEqual((progress["done"], progress["planned"]), (1, 4))
+
+    def test_no_saved_plan(self):
+        # Not another deployment's count
+        progress = self._apply()
+        self.assertEqual(progress["planned"], 0)
+
+
+class BlueprintTests(SimpleTestCase):
+    """Blueprints serialize to stable, correctly quoted YAML"""
+
+    def _blueprint(self, script):
+        bp = blueprint.Blueprint(
+            "cluster", {"project_id": "project", "deployment_name": "c1"}
+        )
+        bp.add(
+            blueprint.Module(
+                "modules/network/pre-existing-vpc",
+                "hpc_network",
+                settings={"network_name": "yes", "startup_script": script},
+            ),
+            *blueprint.partition_modules(
+                "batch",
+                ("hpc_network",),
+                "regions/us-central1/subnetworks/subnet",
+                "batch",
+                False,
+                True,
+                False,
+                "c2-standard-60",
+                4,
+                image="projects/p/global/images/family/f",
+            ),
+        )
+        return bp
+
+    def test_round_trip(self):
+        script = "#!/bin/bash\necho 'a: b' # comment\n"
+        text = self._blueprint(script).to_yaml()
+        self.assertEqual(text, self._blueprint(script).to_yaml())
+        parsed = yaml.safe_load(text)
+        modules = parsed["deployment_groups"][0]["modules"]
+        # Strings which look like other YAML types stay strings
+        self.assertEqual(modules[0]["settings"]["network_name"], "yes")
+        self.assertEqual(modules[0]["settings"]["startup_script"], script)
+        self.assertEqual(modules[1]["use"], ["batch-group", "hpc_network"])
+        self.assertEqual(
+            modules[2]["settings"]["instance_image"],
+            {"family": "f", "project": "p"},
+        )
+
+    def test_partition_modules_cached(self):
+        args = ("p", ("net",), "subnet", "p", False, True, False, "n2", 2)
+        self.assertIs(
+            blueprint.partition_modules(*args),
+            blueprint.partition_modules(*args),
+        )
+
+    def test_instance_image(self):
+        self.assertEqual(
+            blueprint.instance_image(
+                "https://www.googleapis.com/compute/v1/projects/p/global/"
+                "images/img"
+            ),
+            {"name": "img", "project": "p"},
+        )
+        with self.assertRaises(ValueError):
+            blueprint.instance_image("img")
+
+
+@override_settings(COST_ROLLUP_ENABLED=True)
+class CostRollupTests(FixtureMixin, TestCase):
+    """JobCostRollup follows job changes"""
+
+    def setUp(self):
+        self.cluster = self.make_cluster()
+        self.partition = self.make_partition(self.cluster)
+        self.application = self.make_application(self.cluster)
+
+    def assertRollupMatchesJobs(self):  # pylint: disable=invalid-name
+        """The rollup has the totals rebuild_cost_rollup would give"""
+        fields = ("user", "cluster", "application", "day")
+        rebuilt = sorted(
+            (
+                row.user_id,
+                row.cluster_id,
+                row.application_id,
+                row.day,
+                row.total_cost,
+                row.num_jobs,
+            )
+            for row in JobCostRollup.from_jobs(Job.objects.all())
+        )
+        # Rows emptied by job changes are left in place
+        self.assertEqual(
+            sorted(
+                JobCostRollup.objects.exclude(num_jobs=0).values_list(
+                    *fields, "total_cost", "num_jobs"
+                )
+            ),
+            rebuilt,
+        )
+
+    def test_job_changes(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        job = self.make_job(self.application, self.partition, "1.5")
+        self.make_job(self.application, self.partition, "2.25")
+        other = self.make_job(
+            self.application, self.partition, "4", submitted=yesterday
+        )
+        self.assertRollupMatchesJobs()
+        row = JobCostRollup.objects.get(day=timezone.now().date())
+        self.assertEqual(row.total_cost, Decimal("3.75"))
+        self.assertEqual(row.num_jobs, 2)
+
+        job.job_cost = Decimal("10")
+        job.save()
+        other.date_time_submission = timezone.now()
+        other.save()
+        self.assertRollupMatchesJobs()
+        job.delete()
+        self.assertRollupMatchesJobs()
+        self.assertEqual(
+            JobCostRollup.objects.get(day=timezone.now().date()).num_jobs, 2
+        )
+
+    def test_cluster_delete(self):
+        # Jobs on other clusters survive their deletion with no cluster
+        for name in ("other1", "other2"):
+            other = self.make_cluster(name)
+            self.make_job(
+                self.application, self.partition, "1", cluster=other
+            )
+            # Deleted with the cluster
+            self.make_job(
+                self.application, self.make_partition(other), "8"
+            )
+        self.assertEqual(JobCostRollup.objects.count(), 2)
+        for name in ("other1", "other2"):
+            Cluster.objects.get(name=name).delete()
+        row = JobCostRollup.objects.get()
+        self.assertIsNone(row.cluster_id)
+        self.assertEqual(
+            (row.total_cost, row.num_jobs), (Decimal("2"), 2)
+        )
+        self.assertRollupMatchesJobs()
+
+
+class CostReportTests(FixtureMixin, TestCase):
+    """Cluster cost report breakdowns"""
+
+    def setUp(self):
+        self.cluster = self.make_cluster()
+        self.partition = self.make_partition(self.cluster)
+        self.application = self.make_application(self.cluster)
+        self.idle = Application.objects.create(
+            name="idle", cluster=self.cluster
+        )
+        self.today = timezone.now()
+        self.yesterday = self.today - datetime.timedelta(days=1)
+        self.make_job(self.application, self.partition, "1")
+        self.make_job(
+            self.application, self.partition, "2", submitted=self.yesterday
+        )
+        self.make_job(
+            self.application, self.partition, "4", user=self.admin
+        )
+        # Another cluster's jobs aren't counted
+        other = self.make_cluster("other")
+        self.make_job(
+            self.make_application(other), self.make_partition(other), "8"
+        )
+
+    def test_totals(self):
+        report = cost_report.ClusterCostReport(self.cluster)
+        self.assertEqual(report.totals(), (Decimal("7"), 3))
+        report = cost_report.ClusterCostReport(self.cluster, user=self.user)
+        self.assertEqual(report.totals(), (Decimal("3"), 2))
+        report = cost_report.ClusterCostReport(
+            self.cluster,
+            date_range=(
+                self.today - datetime.timedelta(hours=1),
+                self.today + datetime.timedelta(hours=1),
+            ),
+        )
+        self.assertEqual(report.totals(), (Decimal("5"), 2))
+
+    def test_breakdowns(self):
+        report = cost_report.ClusterCostReport(self.cluster)
+        self.assertEqual(
+            [
+                (row["username"], row["spend"], row["jobs"])
+                for row in report.by_user()
+            ],
+            [("admin", Decimal("4"), 1), ("user", Decimal("3"), 2)],
+        )
+        # Applications without jobs are listed too
+        self.assertEqual(
+            [
+                (app.name, app.spend, app.jobs)
+                for app in report.by_application()
+            ],
+            [("app", Decimal("7"), 3), ("idle", Decimal("0"), 0)],
+        )
+        self.assertEqual(
+            [
+                (row["partition_name"], row["jobs"])
+                for row in report.by_partition()
+            ],
+            [("batch", 3)],
+        )
+        self.assertEqual(
+            [(row["day"], row["spend"]) for row in report.by_day()],
+            [
+                (self.yesterday.date(), Decimal("2")),
+                (self.today.date(), Decimal("5")),
+            ],
+        )
+
+    def test_export_batches(self):
+        report = cost_report.ClusterCostReport(self.cluster)
+        batches = list(report.export_batches(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        ids = [row[0] for batch in batches for row in batch]
+        self.assertEqual(ids, sorted(ids))
+
+    def _export(self, query):
+        request = RequestFactory().get(f"/?{query}")
+        request.user = self.admin
+        response = ClusterCostExportView.as_view()(request, pk=self.cluster.pk)
+
+        # As under ASGI, the response is sent from an event loop, where the
+        # database can't be used
+        async def read():
+            return b"".join(response.streaming_content)
+
+        return (response, async_to_sync(read)())
+
+    def test_export_csv(self):
+        (response, content) = self._export("user=%d" % self.user.pk)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="report.csv"', response["Content-Disposition"])
+        rows = content.decode().splitlines()
+        self.assertEqual(
+            rows[0],
+            "Job ID,User,Application,Partition,Number of Nodes,"
+            "Ranks per Node,Runtime (sec),Node Price (per hour),Job Cost,"
+            "Submitted",
+        )
+        self.assertEqual(len(rows), 3)
+
+    def test_export_jsonl_gzip(self):
+        (response, content) = self._export("format=jsonl&gzip=1")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        rows = [
+            json.loads(line)
+            for line in gzip.decompress(content).decode().splitlines()
+        ]
+        self.assertEqual(
+            sorted(row["job_cost"] for row in rows), ["1.000", "2.000", "4.000"]
+        )
+
+
+class QuotaLedgerTests(FixtureMixin, TestCase):
+    """User.quota_used tracks reserved and settled job costs"""
+
+    def setUp(self):
+        self.cluster = self.make_cluster()
+        self.partition = self.make_partition(self.cluster)
+        self.application = self.make_application(self.cluster)
+        # Jobs of users without a Google account are only run for admins
+        self.user = self.admin
+        User.objects.filter(pk=self.user.pk).update(
+            quota_type="l", quota_amount=10
+        )
+        self.user.refresh_from_db()
+
+    def test_reserve(self):
+        self.assertTrue(self.user.reserve_quota(6))
+        self.assertEqual(self.user.quota_used, Decimal(6))
+        self.assertFalse(self.user.reserve_quota(5))
+        self.assertEqual(self.user.quota_used, Decimal(6))
+        self.user.quota_type = "d"
+        self.assertFalse(self.user.reserve_quota(1))
+
+    def _run_job(self, job, *messages):
+        """Runs job through BackendJobRun, then replays messages to it"""
+        request = RequestFactory().get("/")
+        request.user = self.user
+        with mock.patch("ghpcfe.views.jobs.c2") as c2, mock.patch(
+            "ghpcfe.views.jobs.messages"
+        ), mock.patch("ghpcfe.views.jobs.reverse", return_value="/"):
+            BackendJobRun.as_view()(request, pk=job.pk)
+        response = c2.send_command.call_args.kwargs["on_response"]
+        for message in messages:
+            response(
+                dict(message, job_id=job.pk, cluster_id=self.cluster.id)
+            )
+        job.refresh_from_db()
+        self.user.refresh_from_db()
+
+    def test_settle(self):
+        self.assertTrue(self.user.reserve_quota(6))
+        job = self.make_job(
+            self.application,
+            self.partition,
+            "6",
+            user=self.user,
+            node_price="2",
+        )
+        finished = {"status": "c", "job_runtime": 1800}
+        # Repeated and late messages change nothing once it has finished
+        self._run_job(
+            job,
+            {"status": "r"},
+            finished,
+            dict(finished, job_runtime=3600),
+            {"status": "r"},
+        )
+        self.assertEqual(job.status, "c")
+        self.assertEqual(job.job_cost, Decimal(1))
+        self.assertEqual(self.user.quota_used, Decimal(1))
+
+    def test_delete_refunds(self):
+        self.assertTrue(self.user.reserve_quota(6))
+        job = self.make_job(
+            self.application, self.partition, "6", user=self.user
+        )
+        job.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.quota_used, Decimal(0))
+
+
+class _JobPages(KeysetListMixin, generic.ListView):
+    model = Job
+    sort_fields = ["id", "name", "date_time_submission"]
+
+
+class _JobAPI:
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ["name", "status"]
+    ordering = ["name"]
+
+
+class PaginationTests(FixtureMixin, TestCase):
+    """Keyset and cursor pagination visit every row once, in order"""
+
+    def setUp(self):
+        cluster = self.make_cluster()
+        partition = self.make_partition(cluster)
+        application = self.make_application(cluster)
+        start = timezone.now()
+        for i in range(7):
+            job = self.make_job(
+                application,
+                partition,
+                "1",
+                # Duplicate submission times, and some never submitted
+                submitted=start + datetime.timedelta(hours=i // 2),
+            )
+            if i in (1, 4):
+                Job.objects.filter(pk=job.pk).update(date_time_submission=None)
+
+    @staticmethod
+    def _page(query):
+        """IDs of the jobs on the page for query, and the view"""
+        view = _JobPages()
+        view.setup(RequestFactory().get(f"/?{query}"))
+        (_, _, jobs, _) = view.paginate_queryset(view.get_queryset(), 2)
+        return ([job.pk for job in jobs], view)
+
+    def _walk(self, sort):
+        """IDs of the jobs on each page, following the next page links"""
+        (page, view) = self._page(f"sort={sort}")
+        pages = [page]
+        # Bounded, in case a broken cursor repeats pages
+        while view.next_page_url and len(pages) < 10:
+            (page, view) = self._page(view.next_page_url[1:])
+            pages.append(page)
+        return (pages, view)
+
+    def _expected(self, sort):
+        field = sort.lstrip("-")
+        jobs = sorted(
+            Job.objects.all(),
+            key=lambda job: (
+                getattr(job, field) is not None,
+                getattr(job, field) or 0,
+                job.pk,
+            ),
+            reverse=sort.startswith("-"),
+        )
+        return [job.pk for job in jobs]
+
+    def test_keyset(self):
+        for sort in ["date_time_submission", "-date_time_submission",
+                     "name", "-id"]:
+            (pages, _) = self._walk(sort)
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+            self.assertEqual(
+                [pk for page in pages for pk in page], self._expected(sort)
+            )
+
+    def test_keyset_previous(self):
+        (pages, view) = self._walk("-date_time_submission")
+        backward = [pages[-1]]
+        while view.previous_page_url and len(backward) < 10:
+            (page, view) = self._page(view.previous_page_url[1:])
+            backward.insert(0, page)
+        self.assertEqual(backward, pages)
+
+    def test_invalid_dates_ignored(self):
+        self.assertIsNone(get_date_range(QueryDict("start=2024-02-30")))
+        (start, end) = get_date_range(
+            QueryDict("start=2024-02-30&end=2024-03-01")
+        )
+        self.assertEqual(start.date(), datetime.date.min)
+        self.assertEqual(end.date(), datetime.date(2024, 3, 1))
+
+    def test_cursor_ordering(self):
+        paginator = OptionalCursorPagination()
+        # All jobs have the same name, so only the pk orders them
+        request = Request(RequestFactory().get("/?page_size=2"))
+        self.assertEqual(
+            paginator.get_ordering(request, Job.objects.all(), _JobAPI()),
+            ("name", "pk"),
+        )
+        seen = []
+        while request and len(seen) < 20:
+            paginator = OptionalCursorPagination()
+            seen.extend(
+                job.pk
+                for job in paginator.paginate_queryset(
+                    Job.objects.all(), request, _JobAPI()
+                )
+            )
+            link = paginator.get_next_link()
+            request = (
+                Request(RequestFactory().get(link.split("testserver")[1]))
+                if link
+                else None
+            )
+        self.assertEqual(
+            seen, sorted(Job.objects.values_list("pk", flat=True))
+        )
+
+
+class _TaskCommand(BackendAsyncView):
+    """Test task command, which fails if given fail=True"""
+
+    calls = []
+
+    def cmd(self, task_id, token, cluster, fail=False):
+        self.calls.append((task_id, token, cluster.pk))
+        if fail:
+            raise RuntimeError("Terraform failed")
+
+
+class TaskQueueTests(FixtureMixin, TestCase):
+    """Queued tasks run once, and failures don't leave resources stuck"""
+
+    # pylint: disable=protected-access
+
+    def setUp(self):
+        self.cluster = self.make_cluster(status="c", cloud_state="cm")
+        _TaskCommand.calls = []
+        self.worker = task_queue.TaskWorker(poll_interval=0)
+
+    def _enqueue(self, *args, **kwargs):
+        return task_queue.enqueue(
+            self.admin, "Start Cluster", _TaskCommand, (self.cluster, *args),
+            resource="cluster", **kwargs
+        )
+
+    def _run_next(self):
+        task_id = self.worker._claim()
+        self.assertIsNotNone(task_id)
+        self.worker._run(task_id)
+        return task_id
+
+    def test_success(self):
+        task = self._enqueue()
+        self.assertEqual(self._run_next(), task.pk)
+        self.assertEqual(
+            _TaskCommand.calls,
+            [(task.pk, self.admin.auth_token.key, self.cluster.pk)],
+        )
+        self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+        self.assertIsNone(self.worker._claim())
+
+    def test_failure_marks_resources(self):
+        task = self._enqueue(True)
+        self._run_next()
+        task.refresh_from_db()
+        self.assertEqual(task.state, "e")
+        self.assertEqual(task.data["error"], "Terraform failed")
+        self.assertIsNotNone(task.finished)
+        self.cluster.refresh_from_db()
+        self.assertEqual(
+            (self.cluster.status, self.cluster.cloud_state), ("e", "um")
+        )
+
+        request = RequestFactory().get("/")
+        request._messages = CookieStorage(request)
+        report_failed_tasks(request, self.cluster)
+        self.assertEqual(
+            [str(message) for message in get_messages(request)],
+            ["Start Cluster failed (Terraform failed)"],
+        )
+        # Only reported once
+        self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+
+    def test_retry(self):
+        task = self._enqueue(True, max_attempts=2)
+        self._run_next()
+        task.refresh_from_db()
+        self.assertEqual((task.state, task.attempts), ("q", 1))
+        # Retried after a delay, leaving the cluster as it is meanwhile
+        self.assertIsNone(self.worker._claim())
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.status, "c")
+
+    def test_recover_orphans(self):
+        task = self._enqueue()
+        Task.objects.filter(pk=task.pk).update(
+            state="r",
+            attempts=1,
+            heartbeat=timezone.now() - datetime.timedelta(hours=1),
+        )
+        task_queue.recover_orphans()
+        task.refresh_from_db()
+        self.assertEqual(task.state, "e")
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.cloud_state, "um")
+
+    def test_recover_orphans_after_restart(self):
+        # A worker restarted straight after a crash sees the old worker's
+        # task with a fresh heartbeat, so only finds it orphaned later
+        task = self._enqueue()
+        Task.objects.filter(pk=task.pk).update(
+            state="r", attempts=1, heartbeat=timezone.now()
+        )
+        polls = []
+
+        def poll(unused_timeout):
+            polls.append(Task.objects.get(pk=task.pk).state)
+            if len(polls) == 1:
+                Task.objects.filter(pk=task.pk).update(
+                    heartbeat=timezone.now() - datetime.timedelta(hours=1)
+                )
+            else:
+                self.worker.stopping.set()
+
+        with mock.patch.object(task_queue, "_recover_interval", 0):
+            with mock.patch.object(self.worker.stopping, "wait", poll):
+                self.worker.run()
+        self.assertEqual(polls, ["r", "e"])
+
+    def test_recover_orphans_exclude(self):
+        task = self._enqueue()
+        Task.objects.filter(pk=task.pk).update(
+            state="r", heartbeat=timezone.now() - datetime.timedelta(hours=1)
+        )
+        task_queue.recover_orphans(exclude={task.pk})
+        task.refresh_from_db()
+        self.assertEqual(task.state, "r")
+
+    def test_cancel_queued(self):
+        task = self._enqueue()
+        task_queue.cancel(task.pk)
+        task.refresh_from_db()
+        self.assertEqual(task.state, "x")
+        self.assertIsNone(self.worker._claim())
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.status, "e")
+
+    def test_purge_finished(self):
+        old = self._enqueue()
+        recent = self._enqueue()
+        queued = self._enqueue()
+        Task.objects.filter(pk=old.pk).update(
+            state="e", finished=timezone.now() - datetime.timedelta(days=2)
+        )
+        Task.objects.filter(pk=recent.pk).update(
+            state="e", finished=timezone.now()
+        )
+        task_queue.purge_finished()
+        self.assertEqual(
+            sorted(Task.objects.values_list("pk", flat=True)),
+            [recent.pk, queued.pk],
+        )
+
+
+class ProvisioningTests(FixtureMixin, TestCase):
+    """Pipeline steps only provision resources which are free to be"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.pipeline = provisioning.Pipeline(log_dir=Path(tmpdir.name))
+        patcher = mock.patch.object(provisioning, "cm_vpc")
+        self.cm_vpc = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cm_vpc.get_terraform_dir.return_value = Path(tmpdir.name)
+
+    def _vpc_step(self, cloud_state):
+        VirtualNetwork.objects.filter(pk=self.vpc.pk).update(
+            cloud_state=cloud_state
+        )
+        self.vpc.refresh_from_db()
+        return self.pipeline.steps[self.pipeline.add_vpc(self.vpc)]
+
+    def _vpc_state(self):
+        return VirtualNetwork.objects.get(pk=self.vpc.pk).cloud_state
+
+    def test_ready(self):
+        self.assertIsNone(self.pipeline.add_vpc(self.vpc))
+
+    def test_provision(self):
+        step = self._vpc_step("nm")
+        states = []
+        self.cm_vpc.start_vpc.side_effect = (
+            lambda vpc: states.append(self._vpc_state())
+        )
+        step.func()
+        # Creating while Terraform runs
+        self.assertEqual(states, ["cm"])
+        self.assertEqual(self._vpc_state(), "m")
+
+    def test_failure(self):
+        step = self._vpc_step("nm")
+        self.cm_vpc.start_vpc.side_effect = RuntimeError("apply failed")
+        with self.assertRaisesMessage(RuntimeError, "apply failed"):
+            step.func()
+        self.assertEqual(self._vpc_state(), "um")
+
+    def test_busy(self):
+        for state in ["cm", "dm"]:
+            with self.subTest(state=state):
+                self.pipeline.steps.clear()
+                step = self._vpc_step(state)
+                with self.assertRaisesMessage(RuntimeError, "is busy"):
+                    step.func()
+                self.cm_vpc.start_vpc.assert_not_called()
+                self.assertEqual(self._vpc_state(), state)
+
+    def test_destroyed(self):
+        step = self._vpc_step("xm")
+        with self.assertRaisesMessage(RuntimeError, "is destroyed"):
+            step.func()
+        self.cm_vpc.start_vpc.assert_not_called()
+        self.assertEqual(self._vpc_state(), "xm")
+
+
+class GoldenImageTests(FixtureMixin, TestCase):
+    """Golden images and their builder VMs are cleaned up"""
+
+    def setUp(self):
+        patcher = mock.patch.object(golden_image, "cloud_info")
+        self.cloud_info = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cluster = self.make_cluster(
+            status="r", cloud_state="m", cloud_id="cluster-abc"
+        )
+
+    def test_builder_deleted_after_failed_create(self):
+        self.cloud_info.gcp_create_instance.side_effect = RuntimeError(
+            "operation failed"
+        )
+        builder = golden_image.ImageBuilder(
+            self.cluster, "#!/bin/bash", "base-image", "sa@example.com"
+        )
+        with self.assertRaisesMessage(RuntimeError, "operation failed"):
+            builder.build("0123456789abcdef")
+        self.cloud_info.gcp_delete_instance.assert_called_once_with(
+            "{}", "us-central1-a", "cluster-abc-imgbuild-0123456789ab"
+        )
+
+    def test_image_deleted_with_cluster(self):
+        ClusterInfo(self.cluster).import_instances(
+            tfstate.TerraformState(
+                {
+                    "resources": [
+                        _tf_state(
+                            _controller_module,
+                            [_tf_instance("ctrl", "10.0.0.2")],
+                        )
+                    ]
+                }
+            )
+        )
+        self.cluster.refresh_from_db()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        ci = ClusterInfo(self.cluster)
+        ci.cluster_dir = Path(tmpdir.name)
+        image_file = ci.cluster_dir / "golden_image.json"
+        image_file.write_text(
+            json.dumps(
+                {"hash": "abc", "image": "projects/p/global/images/img-abc"}
+            )
+        )
+
+        with mock.patch(
+            "ghpcfe.cluster_manager.clusterinfo.utils.run_terraform"
+        ), mock.patch("ghpcfe.cluster_manager.clusterinfo.c2"):
+            ci.stop_cluster()
+
+        self.cloud_info.gcp_delete_image.assert_called_once_with(
+            "{}", "img-abc"
+        )
+        self.assertFalse(image_file.exists())
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.status, "d")
+
+
+class DiscoveryCacheTests(TestCase):
+    """Subnet listings are invalidated in every process"""
+
+    def setUp(self):
+        cloud_info._get_gcp_subnets.cache_clear()
+        self.addCleanup(cloud_info._get_gcp_subnets.cache_clear)
+        client = mock.Mock()
+        client.subnetworks().listUsable().execute.return_value = {}
+        client.subnetworks().listUsable_next.return_value = None
+        self.list_usable = client.subnetworks().listUsable
+        self.list_usable.reset_mock()
+        patcher = mock.patch.object(
+            cloud_info, "_get_gcp_client", return_value=("project", client)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalidated_elsewhere(self):
+        cloud_info.get_subnets("GCP", "{}")
+        cloud_info.get_subnets("GCP", "{}")
+        self.assertEqual(self.list_usable.call_count, 1)
+        # As the task worker does, without clearing this process's cache
+        with mock.patch.object(cloud_info._get_gcp_subnets, "cache_clear"):
+            cloud_info.invalidate_subnet_cache()
+        cloud_info.get_subnets("GCP", "{}")
+        self.assertEqual(self.list_usable.call_count, 2)
+
+
+class CacheWarmerTests(SimpleTestCase):
+    """The warmer fills the caches before they roll over"""
+
+    def test_ttl(self):
+        with mock.patch.object(cloud_info.time, "time", return_value=86000):
+            self.assertEqual(cloud_info._get_ttl_hash(), 0)
+            self.assertEqual(cloud_info.next_ttl_rollover(), 400)
+            with cloud_info.ttl_offset(401):
+                self.assertEqual(cloud_info._get_ttl_hash(), 1)
+            self.assertEqual(cloud_info._get_ttl_hash(), 0)
+
+    def _refresh(self, rollover):
+        class Stop(Exception):
+            pass
+
+        for (target, name, kwargs) in [
+            (cloud_info, "next_ttl_rollover", {"return_value": rollover}),
+            (cache_warmer, "connection", {}),
+            (cache_warmer.time, "sleep", {"side_effect": Stop}),
+        ]:
+            patcher = mock.patch.object(target, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch.object(cache_warmer, "warm_caches") as warm_caches:
+            with self.assertRaises(Stop):
+                cache_warmer._refresh_loop(3600)
+        return warm_caches.call_args_list
+
+    def test_refresh_ahead(self):
+        self.assertEqual(
+            self._refresh(100), [mock.call(), mock.call(ahead=101)]
+        )
+
+    def test_refresh(self):
+        self.assertEqual(self._refresh(7200), [mock.call()])
@@ -31,7 +31,7 @@ from .views.vpc import *
 from .views.filesystems import *
 from .views.gcpfilestore import *
 from .views.grafana import GrafanaProxyView, GrafanaView
-from .views.asyncview import RunningTasksViewSet
+from .views.asyncview import RunningTasksViewSet, TaskProgressView
 
 handler403 = "ghpcfe.views.error_pages.custom_error_403"
 
@@ -405,6 +405,11 @@ urlpatterns += [
         BackendDestroyVPC.as_view(),
         name="backend-destroy-vpc",
     ),
+    path(
+        "backend/task-progress/<int:pk>",
+        TaskProgressView.as_view(),
+        name="task-progress",
+    ),
     path(
         "backend/cluster-create/<int:pk>",
         BackendCreateCluster.as_view(),
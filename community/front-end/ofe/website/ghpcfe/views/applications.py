@@ -21,6 +21,7 @@ from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.urls import reverse_lazy
 from django.views import generic
+from rest_framework import filters
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -39,48 +40,62 @@ from ..models import CustomInstallationApplication
 from ..models import SpackApplication
 from ..serializers import ApplicationSerializer
 from .view_utils import GCSFile
+from .view_utils import KeysetListMixin
+from .view_utils import OptionalCursorPagination
+from .view_utils import QueryParamFilter
 from .view_utils import StreamingFileView
 
 logger = logging.getLogger(__name__)
 
+APPLICATION_SORT_FIELDS = ["id", "name", "version", "status"]
+APPLICATION_FILTER_FIELDS = {"status": "status", "cluster": "cluster"}
 
-class ApplicationListView(LoginRequiredMixin, generic.ListView):
+
+class ApplicationListView(
+    LoginRequiredMixin, KeysetListMixin, generic.ListView
+):
     """Custom ListView for Application model"""
 
     model = Application
     template_name = "application/list.html"
+    sort_fields = APPLICATION_SORT_FIELDS
+    default_sort = "name"
+    filter_fields = APPLICATION_FILTER_FIELDS
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Joining the subclass tables lets the type checks below, and the
+        # template, run without a query per application
+        queryset = (
+            super()
+            .get_queryset()
+            .select_related(
+                "cluster",
+                "spackapplication",
+                "custominstallationapplication",
+                "install_loc__fs_export__filesystem",
+            )
+        )
         if self.request.user.has_admin_role():
-            pass
-        else:
-            wanted_items = set()
-            for application in queryset:
-                cluster = application.cluster
-                if (
-                    self.request.user in cluster.authorised_users.all()
-                    and cluster.status == "r"
-                    and application.status == "r"
-                ):
-                    wanted_items.add(application.pk)
-            queryset = queryset.filter(pk__in=wanted_items)
-        for item in queryset:
+            return queryset
+        return queryset.filter(
+            cluster__authorised_users=self.request.user,
+            cluster__status="r",
+            status="r",
+        )
+
+    def get_context_data(self, *args, **kwargs):
+        loading = int(
+            Application.objects.filter(status__in=["p", "q", "i"]).exists()
+        )
+        context = super().get_context_data(*args, **kwargs)
+        # Only label the applications on the current page
+        for item in context["object_list"]:
             if hasattr(item, "spackapplication"):
                 item.type = "spack"
             elif hasattr(item, "custominstallationapplication"):
                 item.type = "custom"
             else:
                 item.type = "pre-installed"
-        return queryset
-
-    def get_context_data(self, *args, **kwargs):
-        loading = 0
-        for application in Application.objects.all():
-            if application.status in ["p", "q", "i"]:
-                loading = 1
-                break
-        context = super().get_context_data(*args, **kwargs)
         context["loading"] = loading
         context["navtab"] = "application"
         short_status_messages = {
@@ -348,6 +363,11 @@ class ApplicationViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = Application.objects.all().order_by("name")
     serializer_class = ApplicationSerializer
+    pagination_class = OptionalCursorPagination
+    filter_backends = [QueryParamFilter, filters.OrderingFilter]
+    filter_fields = APPLICATION_FILTER_FIELDS
+    ordering_fields = APPLICATION_SORT_FIELDS
+    ordering = ["name"]
 
 
 class SpackPackageViewSet(viewsets.ViewSet):
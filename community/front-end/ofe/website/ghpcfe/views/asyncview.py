@@ -13,20 +13,27 @@
 # limitations under the License.
 """ asyncviews.py """
 import asyncio
-import functools
+import hashlib
+import json
 import logging
 
 from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
 from django.core import exceptions
+from django.http import JsonResponse
 from django.utils.decorators import classonlymethod
+from django.utils.module_loading import import_string
 from django.views import generic
 from rest_framework import viewsets
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.authtoken.models import Token
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
-from ..models import Cluster, Role, Task
+from ..cluster_manager import task_queue
+from ..models import Cluster, Task
 from ..serializers import TaskSerializer
 
 logger = logging.getLogger(__name__)
@@ -38,22 +45,44 @@ class RunningTasksViewSet(viewsets.ModelViewSet):
     serializer_class = TaskSerializer
     authentication_classes = [SessionAuthentication, TokenAuthentication]
 
-
-def _consume_task(record, task):
-    logger.info("Task %s complete.", task.get_name(), exc_info=task.exception())
-    if record:
-        logger.info(
-            "    destroying task record %d-%s.  Data: %s",
-            record.id,
-            record.title,
-            record.data
+    @action(methods=["post"], detail=True)
+    def cancel(self, request, pk=None):
+        task = self.get_object()
+        if task.owner != request.user and not request.user.has_admin_role():
+            raise exceptions.PermissionDenied
+        task_queue.cancel(task.pk)
+        return Response(TaskSerializer(Task.objects.get(pk=task.pk)).data)
+
+
+def report_failed_tasks(request, instance):
+    """Show the errors of instance's failed tasks as messages
+
+    Each is shown once; the task is deleted once reported.
+    """
+    for task in task_queue.failed_tasks_for(instance):
+        try:
+            error_message = import_string(task.command).task_error_message
+        except ImportError:
+            error_message = BackendAsyncView.task_error_message
+        messages.error(
+            request,
+            error_message.format(
+                title=task.title, error=task.data.get("error", "unknown")
+            ),
         )
-        asyncio.create_task(sync_to_async(record.delete)())
+        task.delete()
 
 
 class BackendAsyncView(generic.View):
     """Template class for backend async operations"""
 
+    # Concurrency limit group and attempts for queued tasks (see task_queue)
+    task_resource = "default"
+    task_max_attempts = 1
+    # Shown on the resource's page if the task fails (see
+    # report_failed_tasks)
+    task_error_message = "{title} failed ({error})"
+
     @classonlymethod
     def as_view(cls, **initkwargs):
         view = super().as_view(**initkwargs)
@@ -63,25 +92,25 @@ class BackendAsyncView(generic.View):
     @sync_to_async
     def test_user_access_to_cluster(self, user, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
-        if user not in cluster.authorised_users.all():
+        if not cluster.authorised_users.filter(pk=user.pk).exists():
             raise exceptions.PermissionDenied
 
     @sync_to_async
     def test_user_is_cluster_admin(self, user):
-        if Role.CLUSTERADMIN not in [x.id for x in user.roles.all()]:
+        if not user.has_admin_role():
             raise exceptions.PermissionDenied
 
     @sync_to_async
-    def make_task_record(self, user, title):
-        task_data = self.get_task_record_data(self.request)
-        t = Task.objects.create(owner=user, title=title, data=task_data)
-        t.save()
-        return t
-
-    @sync_to_async
-    def get_user_token(self, user):
-        token = Token.objects.get(user=user)
-        return token.key
+    def make_task_record(self, user, title, args):
+        return task_queue.enqueue(
+            user,
+            title,
+            type(self),
+            args,
+            resource=self.task_resource,
+            max_attempts=self.task_max_attempts,
+            data=self.get_task_record_data(self.request),
+        )
 
     @sync_to_async
     def set_cluster_status_async(self, cluster_id, status):
@@ -96,13 +125,55 @@ class BackendAsyncView(generic.View):
         """Called from a syncronous context"""
         return {}
 
-    async def _cmd(self, *args, **kwargs):
-        await sync_to_async(self.cmd, thread_sensitive=False)(*args, **kwargs)
+    async def create_task(self, title, *args):
+        """Queue self.cmd(task_id, token, *args) for the task worker
 
-    async def create_task(self, title, *args, **kwargs):
-        logger.info("Creating task %s", title)
-        token = await self.get_user_token(self.request.user)
-        record = await self.make_task_record(self.request.user, title=title)
-        task = asyncio.create_task(self._cmd(record.pk, token, *args, **kwargs))
-        task.add_done_callback(functools.partial(_consume_task, record))
-        return record
+        Model instance arguments are re-fetched when the task runs, and
+        cmd() runs without a request.
+        """
+        logger.info("Queueing task %s", title)
+        return await self.make_task_record(self.request.user, title, args)
+
+
+class TaskProgressView(BackendAsyncView):
+    """Long-poll for changes to a task's progress
+
+    Returns as soon as the task's data differs from the version given in
+    the 'since' parameter (or after a timeout), so the browser sees
+    progress as it happens without holding a worker thread.  Tasks are
+    deleted when they complete, which is reported as state "done".
+    """
+
+    poll_interval = 1
+    timeout = 25
+
+    @sync_to_async
+    def get_orm(self, task_id):
+        task = Task.objects.filter(pk=task_id).first()
+        if not task:
+            return None
+        return (task.owner_id, task.state, task.data)
+
+    async def get(self, request, pk):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path)
+        is_admin = await sync_to_async(request.user.has_admin_role)()
+
+        since = request.GET.get("since", "")
+        waited = 0
+        while True:
+            task = await self.get_orm(pk)
+            if not task:
+                return JsonResponse({"state": "done", "version": ""})
+            (owner_id, state, data) = task
+            if owner_id != request.user.id and not is_admin:
+                raise exceptions.PermissionDenied
+            version = hashlib.sha1(
+                json.dumps([state, data], sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            if version != since or waited >= self.timeout:
+                return JsonResponse(
+                    {"state": state, "version": version, "data": data}
+                )
+            await asyncio.sleep(self.poll_interval)
+            waited += self.poll_interval
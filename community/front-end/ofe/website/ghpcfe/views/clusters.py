@@ -14,10 +14,9 @@
 
 """ clusters.py """
 
-import csv
 import json
 from asgiref.sync import sync_to_async
-from rest_framework import viewsets
+from rest_framework import filters, viewsets
 from rest_framework.authentication import (
     SessionAuthentication,
     TokenAuthentication,
@@ -32,10 +31,11 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import ValidationError
 from django.http import (
-    HttpResponse,
+    HttpResponseBadRequest,
     HttpResponseRedirect,
     JsonResponse,
     HttpResponseNotFound,
+    FileResponse,
 )
 from django.urls import reverse
 from django.forms import inlineformset_factory
@@ -51,19 +51,26 @@ from ..models import (
     FilesystemExport,
     MountPoint,
     FilesystemImpl,
-    Role,
     ClusterPartition,
     VirtualSubnet,
     Task,
-    User,
 )
 from ..serializers import ClusterSerializer
+from .. import cost_report
 from ..forms import ClusterForm, ClusterMountPointForm, ClusterPartitionForm
-from ..cluster_manager import cloud_info, c2, utils
+from ..cluster_manager import cloud_info, c2, provisioning, task_queue, utils
 from ..cluster_manager.clusterinfo import ClusterInfo
-from ..views.asyncview import BackendAsyncView
-
-from .view_utils import TerraformLogFile, GCSFile, StreamingFileView
+from ..views.asyncview import BackendAsyncView, report_failed_tasks
+
+from .view_utils import (
+    TerraformLogFile,
+    GCSFile,
+    KeysetListMixin,
+    OptionalCursorPagination,
+    QueryParamFilter,
+    StreamingFileView,
+    get_date_range,
+)
 
 import logging
 import secrets
@@ -71,31 +78,30 @@ import secrets
 logger = logging.getLogger(__name__)
 
 
-class ClusterListView(LoginRequiredMixin, generic.ListView):
+class ClusterListView(LoginRequiredMixin, KeysetListMixin, generic.ListView):
     """Custom ListView for Cluster model"""
 
     model = Cluster
     template_name = "cluster/list.html"
+    sort_fields = ["id", "name", "status"]
+    default_sort = "name"
+    filter_fields = {"status": "status"}
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = (
+            super()
+            .get_queryset()
+            .select_related("controller_node")
+            .prefetch_related("login_nodes")
+        )
         if self.request.user.has_admin_role():
             return qs
-        wanted_items = set()
-        for cluster in qs:
-            if (
-                self.request.user in cluster.authorised_users.all()
-                and cluster.status == "r"
-            ):
-                wanted_items.add(cluster.pk)
-        return qs.filter(pk__in=wanted_items)
+        return qs.filter(authorised_users=self.request.user, status="r")
 
     def get_context_data(self, *args, **kwargs):
-        loading = 0
-        for cluster in self.get_queryset():
-            if cluster.status in ["c", "i", "t"]:
-                loading = 1
-                break
+        loading = int(
+            self.get_queryset().filter(status__in=["c", "i", "t"]).exists()
+        )
         admin_view = 0
         if self.request.user.has_admin_role():
             admin_view = 1
@@ -119,6 +125,11 @@ class ClusterDetailView(LoginRequiredMixin, generic.DetailView):
         context = super().get_context_data(**kwargs)
         context["navtab"] = "cluster"
         context["admin_view"] = admin_view
+        report_failed_tasks(self.request, self.object)
+        # Shows progress of whatever is being done to the cluster
+        context["task"] = next(
+            iter(task_queue.active_tasks_for(self.object)), None
+        )
         # Perform extra query to populate instance types data
         # context['cluster_instance_types'] = \
         #     ClusterInstanceType.objects.filter(cluster=self.kwargs['pk'])
@@ -561,28 +572,16 @@ class ClusterCostView(LoginRequiredMixin, generic.DetailView):
         context = super().get_context_data(**kwargs)
         context["navtab"] = "cluster"
 
-        cluster_users = []
-        for user in User.objects.all():
-            spend = user.total_spend(cluster_id=context["cluster"].id)
-            if spend > 0:
-                cluster_users.append(
-                    (
-                        spend,
-                        user.total_jobs(cluster_id=context["cluster"].id),
-                        user,
-                    )
-                )
-
-        cluster_apps = []
-        for app in Application.objects.filter(cluster=context["cluster"].id):
-            cluster_apps.append((app.total_spend(), app))
-
-        context["users_by_spend"] = sorted(
-            cluster_users, key=lambda x: x[0], reverse=True
-        )
-        context["apps_by_spend"] = sorted(
-            cluster_apps, key=lambda x: x[0], reverse=True
+        report = cost_report.ClusterCostReport(
+            context["cluster"], get_date_range(self.request.GET)
         )
+        (context["total_cost"], context["total_jobs"]) = report.totals()
+        context["users_by_spend"] = report.by_user()
+        context["apps_by_spend"] = report.by_application()
+        context["partitions_by_spend"] = report.by_partition()
+        context["spend_by_day"] = report.by_day()
+        context["start"] = self.request.GET.get("start", "")
+        context["end"] = self.request.GET.get("end", "")
         return context
 
 
@@ -662,25 +661,43 @@ class ClusterLogView(LoginRequiredMixin, generic.DetailView):
 
 
 class ClusterCostExportView(LoginRequiredMixin, generic.DetailView):
-    """Export raw cost data per cluster as CSV"""
+    """Export raw cost data per cluster
+
+    CSV by default, or JSON Lines/Parquet with ?format=jsonl or
+    ?format=parquet.  Accepts the same start/end date filters as the cost
+    page, a user (ID) filter, and gzip=1 to compress CSV or JSON Lines.
+    """
 
     model = Cluster
 
     def get(self, request, *args, **kwargs):
-        response = HttpResponse(content_type="text/csv")
-        writer = csv.writer(response)
-        writer.writerow(["Job ID", "User", "Application", "Partition",
-                         "Number of Nodes", "Ranks per Node", "Runtime (sec)",
-                         "Node Price (per hour)", "Job Cost"])
-
-        for job in Job.objects.filter(
-                cluster=self.kwargs["pk"]).values_list("id", "user__username",
-                "application__name", "partition__name", "number_of_nodes",
-                "ranks_per_node", "runtime", "node_price", "job_cost"):
-            writer.writerow(job)
+        export_format = request.GET.get("format", "csv")
+        if export_format not in cost_report.EXPORT_FORMATS:
+            return HttpResponseBadRequest(
+                f"Unsupported export format '{export_format}'"
+            )
+        user = request.GET.get("user") or None
+        if user and not user.isdigit():
+            return HttpResponseBadRequest("Invalid user ID")
 
-        response["Content-Disposition"] = "attachment; filename='report.csv'"
-        return response
+        report = cost_report.ClusterCostReport(
+            self.get_object(), get_date_range(request.GET), user=user
+        )
+        (encoder, content_type, extension) = cost_report.EXPORT_FORMATS[
+            export_format
+        ]
+        stream = encoder(report.export_batches())
+        # Parquet is compressed internally
+        if request.GET.get("gzip") == "1" and export_format != "parquet":
+            stream = cost_report.gzip_stream(stream)
+            (content_type, extension) = ("application/gzip", f"{extension}.gz")
+
+        return FileResponse(
+            cost_report.spool(stream),
+            as_attachment=True,
+            filename=f"report.{extension}",
+            content_type=content_type,
+        )
 
 
 # For APIs
@@ -692,10 +709,15 @@ class ClusterViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
     # queryset = Cluster.objects.all().order_by('name')
     serializer_class = ClusterSerializer
+    pagination_class = OptionalCursorPagination
+    filter_backends = [QueryParamFilter, filters.OrderingFilter]
+    filter_fields = {"status": "status"}
+    ordering_fields = ["id", "name", "status"]
+    ordering = ["name"]
 
     def get_queryset(self):
         # cluster admins can see all the clusters
-        if Role.CLUSTERADMIN in [x.id for x in self.request.user.roles.all()]:
+        if self.request.user.has_admin_role():
             queryset = Cluster.objects.all().order_by("name")
         # ordinary user can only see clusters authorised to use
         else:
@@ -884,6 +906,8 @@ class DiskAvailabilityViewSet(viewsets.ViewSet):
 class BackendCreateCluster(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "cluster"
+
     @sync_to_async
     def get_orm(self, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
@@ -911,6 +935,8 @@ class BackendCreateCluster(BackendAsyncView):
 class BackendUpdateClusterTerraform(BackendAsyncView):
     """View to apply DB changes to Terraform"""
 
+    task_resource = "cluster"
+
     @sync_to_async
     def get_orm(self, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
@@ -937,14 +963,26 @@ class BackendUpdateClusterTerraform(BackendAsyncView):
 class BackendStartCluster(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "cluster"
+
     @sync_to_async
     def get_orm(self, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
         return (cluster,)
 
-    def cmd(self, unused_task_id, unused_token, cluster):
-        ci = ClusterInfo(cluster)
-        ci.start_cluster()
+    def cmd(self, task_id, unused_token, cluster):
+        # Also brings up the cluster's VPC and filesystems if they aren't yet,
+        # concurrently where they don't depend on each other
+        pipeline = provisioning.Pipeline(
+            on_progress=lambda steps: task_queue.report_progress(
+                task_id, steps=steps
+            )
+        )
+        pipeline.add_cluster(cluster)
+        if not pipeline.run():
+            raise RuntimeError(
+                f"Provisioning failed, see logs in {pipeline.log_dir}"
+            )
 
     async def get(self, request, pk):
         """this will invoke the background tasks and return immediately"""
@@ -963,6 +1001,10 @@ class BackendStartCluster(BackendAsyncView):
 class BackendDestroyCluster(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "cluster"
+    # Teardown is safe to retry after transient failures
+    task_max_attempts = 2
+
     @sync_to_async
     def get_orm(self, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
@@ -1017,6 +1059,8 @@ class BackendSyncCluster(LoginRequiredMixin, generic.View):
 class BackendAuthUserGCP(BackendAsyncView):
     """Backend handler to authorise GCP users on the cluster"""
 
+    task_resource = "cluster"
+
     @sync_to_async
     def get_orm(self, cluster_id):
         cluster = Cluster.objects.get(pk=cluster_id)
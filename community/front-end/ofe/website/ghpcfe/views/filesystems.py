@@ -271,6 +271,10 @@ class FilesystemTFLogView(StreamingFileView):
 class BackendDestroyFilesystem(BackendAsyncView):
     """A view to make async call to destroy a filesystem"""
 
+    task_resource = "filesystem"
+    # Teardown is safe to retry after transient failures
+    task_max_attempts = 2
+
     @sync_to_async
     def get_orm(self, fs_id):
         fs = Filesystem.objects.get(pk=fs_id)
@@ -298,6 +302,8 @@ class BackendDestroyFilesystem(BackendAsyncView):
 class BackendCreateFilesystem(BackendAsyncView):
     """A view to make async call to create a new filesystem"""
 
+    task_resource = "filesystem"
+
     @sync_to_async
     def get_orm(self, fs_id):
         fs = Filesystem.objects.get(pk=fs_id)
@@ -323,6 +329,8 @@ class BackendCreateFilesystem(BackendAsyncView):
 class BackendUpdateFilesystem(BackendAsyncView):
     """A view to make async call to update a filesystem"""
 
+    task_resource = "filesystem"
+
     @sync_to_async
     def get_orm(self, fs_id):
         fs = Filesystem.objects.get(pk=fs_id)
@@ -346,6 +354,8 @@ class BackendUpdateFilesystem(BackendAsyncView):
 class BackendStartFilesystem(BackendAsyncView):
     """A view to make async call to start a filesystem"""
 
+    task_resource = "filesystem"
+
     @sync_to_async
     def get_orm(self, fs_id):
         fs = Filesystem.objects.get(pk=fs_id)
@@ -26,6 +26,7 @@ from ..models import (
     FilesystemExport,
 )
 from ..forms import FilestoreForm
+from .asyncview import report_failed_tasks
 
 
 # detail views
@@ -42,6 +43,8 @@ class GCPFilestoreFilesystemDetailView(LoginRequiredMixin, generic.DetailView):
         context["exports"] = FilesystemExport.objects.filter(
             filesystem=self.kwargs["pk"]
         )
+        # Filesystem tasks are given the parent Filesystem
+        report_failed_tasks(self.request, self.object.filesystem_ptr)
         return context
 
 
@@ -15,51 +15,74 @@
 """ jobs.py """
 
 from decimal import Decimal
-from rest_framework import viewsets
+from rest_framework import filters, viewsets
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 from django.shortcuts import get_object_or_404
 from ..permissions import SuperUserRequiredMixin
-from ..models import Application, Job, Role, Cluster
+from ..models import ACTIVE_JOB_STATUSES, Application, Job, Cluster
 from ..serializers import JobSerializer
 from ..forms import JobForm
 from ..cluster_manager import c2, cloud_info, utils
-from .view_utils import GCSFile, StreamingFileView
+from .view_utils import (
+    GCSFile,
+    KeysetListMixin,
+    OptionalCursorPagination,
+    QueryParamFilter,
+    StreamingFileView,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
-
-class JobListView(LoginRequiredMixin, generic.ListView):
+JOB_SORT_FIELDS = [
+    "id",
+    "name",
+    "date_time_submission",
+    "status",
+    "job_cost",
+]
+JOB_FILTER_FIELDS = {
+    "status": "status",
+    "cluster": "cluster",
+    "user": "user",
+    "application": "application",
+    "benchmark": "benchmark",
+}
+
+
+class JobListView(LoginRequiredMixin, KeysetListMixin, generic.ListView):
     """Custom ListView for Job model"""
 
     template_name = "job/list.html"
+    sort_fields = JOB_SORT_FIELDS
+    default_sort = "-date_time_submission"
+    filter_fields = JOB_FILTER_FIELDS
+    date_filter_field = "date_time_submission"
 
     def get_queryset(self):
         jobs = Job.objects.filter(
             user=self.request.user
         )  # user only sees its own jobs
-        roles = []
-        for role in list(self.request.user.roles.all()):
-            roles.append(role.id)
-        if Role.CLUSTERADMIN in roles:
+        if self.request.user.has_admin_role():
             jobs = Job.objects.all()  # admin gets to see everything
-        return jobs
+        return jobs.select_related("application__cluster", "partition")
 
     def get_context_data(self, *args, **kwargs):
-        loading = 0
-        jobs = self.get_queryset()
-        for job in jobs:
-            if job.status in ["p", "q", "d", "r", "u"]:
-                loading = 1
-                break
+        loading = int(
+            self.get_queryset()
+            .filter(status__in=ACTIVE_JOB_STATUSES)
+            .exists()
+        )
         context = super().get_context_data(*args, **kwargs)
         context["loading"] = loading
         context["navtab"] = "job"
+        context["status_choices"] = Job.JOB_STATUS
         return context
 
 
@@ -175,22 +198,17 @@ class JobCreateView2(LoginRequiredMixin, generic.CreateView):
                 None, "Error: Cannot submit job. User quota disabled"
             )
             return self.form_invalid(form)
-        if self.object.user.quota_type == "l":
-            quota_remaining = (
-                self.object.user.quota_amount - self.object.user.total_spend()
-            )
-            # Fudge to nearest cent to avoid "apparently equal" issues in user
-            # display
-            if self.object.job_cost > (quota_remaining - Decimal(0.005)):
+
+        with transaction.atomic():
+            if not self.object.user.reserve_quota(self.object.job_cost):
                 form.add_error(
                     None,
                     "Error: Insufficient quota remaining (have "
-                    f"${quota_remaining:0.2f}, job would require "
-                    f"${self.object.job_cost:0.2f})",
+                    f"${self.object.user.quota_remaining():0.2f}, job would "
+                    f"require ${self.object.job_cost:0.2f})",
                 )
                 return self.form_invalid(form)
-
-        self.object.save()
+            self.object.save()
         return HttpResponseRedirect(self.get_success_url())
 
     def get_initial(self):
@@ -207,9 +225,7 @@ class JobCreateView2(LoginRequiredMixin, generic.CreateView):
         cluster = get_object_or_404(Cluster, pk=self.kwargs["cluster"])
 
         context["user_quota_type"] = self.request.user.quota_type
-        context["user_quota_remaining"] = (
-            self.request.user.quota_amount - self.request.user.total_spend()
-        )
+        context["user_quota_remaining"] = self.request.user.quota_remaining()
 
         context["application"] = application
         context["cluster"] = cluster
@@ -271,22 +287,17 @@ class JobRerunView(LoginRequiredMixin, generic.CreateView):
                 None, "Error: Cannot submit job. User quota disabled"
             )
             return self.form_invalid(form)
-        if self.object.user.quota_type == "l":
-            quota_remaining = (
-                self.object.user.quota_amount - self.object.user.total_spend()
-            )
-            # Fudge to nearest cent to avoid "apparently equal" issues in user
-            # display
-            if self.object.job_cost > (quota_remaining - Decimal(0.005)):
+
+        with transaction.atomic():
+            if not self.object.user.reserve_quota(self.object.job_cost):
                 form.add_error(
                     None,
                     "Error: Insufficient quota remaining (have "
-                    f"${quota_remaining:0.2f}, job would require "
-                    f"${self.object.job_cost:0.2f})",
+                    f"${self.object.user.quota_remaining():0.2f}, job would "
+                    f"require ${self.object.job_cost:0.2f})",
                 )
                 return self.form_invalid(form)
-
-        self.object.save()
+            self.object.save()
         return HttpResponseRedirect(self.get_success_url())
 
     def get_initial(self):
@@ -413,6 +424,12 @@ class JobViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = Job.objects.all().order_by("name")
     serializer_class = JobSerializer
+    pagination_class = OptionalCursorPagination
+    filter_backends = [QueryParamFilter, filters.OrderingFilter]
+    filter_fields = JOB_FILTER_FIELDS
+    date_filter_field = "date_time_submission"
+    ordering_fields = JOB_SORT_FIELDS
+    ordering = ["name"]
 
 
 # Other supporting views
@@ -460,26 +477,37 @@ class BackendJobRun(LoginRequiredMixin, generic.View):
                     message.get("job_id"),
                 )
 
-            job = Job.objects.get(pk=pk)
-            job.status = message["status"]
-            logger.info(
-                "Processing job message, id %d, status %s", pk, job.status
-            )
-
-            if "slurm_job_id" in message and not job.slurm_jobid:
-                job.slurm_jobid = message["slurm_job_id"]
-
-            if job.status in ["c", "e"]:
-                job.runtime = message.get("job_runtime", None)
-                job.result_unit = message.get("result_unit", "")
-                job.result_value = message.get("result_value", None)
-                job.job_cost = (
-                    job.number_of_nodes
-                    * job.runtime
-                    / Decimal(3600)
-                    * job.node_price
+            with transaction.atomic():
+                # Locked, so that a repeated message can't settle it twice
+                job = Job.objects.select_for_update().get(pk=pk)
+                if job.status in ["c", "e"]:
+                    logger.info(
+                        "Ignoring message for finished job %d, status %s",
+                        pk,
+                        message["status"],
+                    )
+                    return
+                job.status = message["status"]
+                logger.info(
+                    "Processing job message, id %d, status %s", pk, job.status
                 )
-            job.save()
+
+                if "slurm_job_id" in message and not job.slurm_jobid:
+                    job.slurm_jobid = message["slurm_job_id"]
+
+                if job.status in ["c", "e"]:
+                    job.runtime = message.get("job_runtime", None)
+                    job.result_unit = message.get("result_unit", "")
+                    job.result_value = message.get("result_value", None)
+                    reserved_cost = job.job_cost
+                    job.job_cost = (
+                        job.number_of_nodes
+                        * job.runtime
+                        / Decimal(3600)
+                        * job.node_price
+                    )
+                    job.user.settle_quota(reserved_cost, job.job_cost)
+                job.save()
 
         # N.B not base64 encoding the job script because the pubsub library uses
         # protobuf anyway
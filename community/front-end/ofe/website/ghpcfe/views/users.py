@@ -27,6 +27,7 @@ from ..permissions import SuperUserRequiredMixin
 # list views
 class UserListView(SuperUserRequiredMixin, generic.ListView):
     model = User
+    queryset = User.objects.prefetch_related("roles")
     template_name = "user/list.html"
 
     def get_context_data(self, **kwargs):
@@ -14,10 +14,19 @@
 
 """Common helpers used in multiple views"""
 
+import base64
+import binascii
+import json
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
 from pathlib import Path
 
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
 from django.http import HttpResponseNotFound, FileResponse
+from django.utils.dateparse import parse_date
 from django.views import generic
+from rest_framework import filters, pagination
 
 from ..cluster_manager import cloud_info
 
@@ -41,6 +50,9 @@ class LocalFile:
     def exists(self):
         return self.get_file().exists()
 
+    def open_if_exists(self):
+        return self.open() if self.exists() else None
+
     def get_filename(self):
         return self.get_file().name
 
@@ -98,6 +110,14 @@ class GCSFile:
             mode="rb", chunk_size=4096
         )
 
+    def open_if_exists(self):
+        logger.debug(
+            "Attempting to open gs://%s%s", self.bucket, self.get_path()
+        )
+        return cloud_info.gcs_open_blob(
+            self.bucket, self.get_path(), chunk_size=4096
+        )
+
     def get_filename(self):
         return self.basepath.split("/")[-1]
 
@@ -108,9 +128,10 @@ class StreamingFileView(generic.base.View):
     def get(self, request, *args, **kwargs):
         try:
             file_info = self.get_file_info()
-            if file_info.exists():
+            stream = file_info.open_if_exists()
+            if stream:
                 return FileResponse(
-                    file_info.open(),
+                    stream,
                     filename=file_info.get_filename(),
                     as_attachment=False,
                     content_type="text/plain",
@@ -121,3 +142,239 @@ class StreamingFileView(generic.base.View):
         except Exception as err: # pylint: disable=broad-except
             logger.warning("Exception trying to stream file", exc_info=err)
             return HttpResponseNotFound("Log file not found")
+
+
+def _date_param(params, name):
+    try:
+        return parse_date(params.get(name, ""))
+    except ValueError:
+        # Well formed but not a real date, e.g. 2024-02-30
+        logger.debug("Ignoring invalid %s date", name)
+        return None
+
+
+def get_date_range(params):
+    """(start, end) datetimes covering the whole days given by the 'start'
+    and 'end' request parameters, or None if neither is set
+
+    Invalid dates are ignored, as for filter_by_params.
+    """
+    start = _date_param(params, "start")
+    end = _date_param(params, "end")
+    if not (start or end):
+        return None
+    return (
+        datetime.combine(start or date.min, time.min, tzinfo=timezone.utc),
+        datetime.combine(end or date.max, time.max, tzinfo=timezone.utc),
+    )
+
+
+def filter_by_params(queryset, params, filter_fields, date_field=None):
+    """Narrow queryset by request parameters
+
+    filter_fields maps parameter names to field lookups; a parameter may be
+    repeated to match any of several values. If date_field is set, the
+    'start'/'end' parameters restrict it to a range of days. Malformed
+    values are ignored rather than treated as errors.
+    """
+    for (param, lookup) in filter_fields.items():
+        values = [value for value in params.getlist(param) if value]
+        if not values:
+            continue
+        try:
+            queryset = queryset.filter(**{f"{lookup}__in": values})
+        except (ValueError, ValidationError):
+            logger.debug("Ignoring invalid %s filter %s", param, values)
+    if date_field:
+        date_range = get_date_range(params)
+        if date_range:
+            queryset = queryset.filter(**{f"{date_field}__range": date_range})
+    return queryset
+
+
+class KeysetListMixin:
+    """ListView mixin providing filtering, sorting and keyset pagination
+
+    Rather than counting and OFFSETing into the result set, each page
+    continues from the sort key of the last row shown, so the cost of
+    rendering a page does not depend on the size of the table. Views list
+    the fields users may sort on in sort_fields, and the request parameters
+    they may filter on in filter_fields (see filter_by_params).  Rows with
+    no value for the sort field (NULL) sort below all others.
+    """
+
+    paginate_by = 50
+    sort_fields = ["id"]
+    default_sort = "-id"
+    filter_fields = {}
+    date_filter_field = None
+
+    def get_sort(self):
+        sort = self.request.GET.get("sort", self.default_sort)
+        if sort.lstrip("-") not in self.sort_fields:
+            return self.default_sort
+        return sort
+
+    @staticmethod
+    def _encode_cursor(obj, field):
+        value = getattr(obj, field)
+        if isinstance(value, date):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        return base64.urlsafe_b64encode(
+            json.dumps([value, obj.pk]).encode()
+        ).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            (value, pk) = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return (value, pk)
+        except (binascii.Error, TypeError, ValueError):
+            return None
+
+    def _get_cursor(self):
+        """Returns ((sort value, pk), backwards) from the request"""
+        for (param, backwards) in [("after", False), ("before", True)]:
+            if param in self.request.GET:
+                cursor = self._decode_cursor(self.request.GET[param])
+                if cursor:
+                    return (cursor, backwards)
+        return (None, False)
+
+    def _page_url(self, param=None, cursor=None, **changes):
+        params = self.request.GET.copy()
+        params.pop("after", None)
+        params.pop("before", None)
+        params.pop("page", None)
+        if param:
+            params[param] = cursor
+        for (key, value) in changes.items():
+            params[key] = value
+        return f"?{params.urlencode()}"
+
+    def paginate_queryset(self, queryset, page_size):
+        queryset = filter_by_params(
+            queryset, self.request.GET, self.filter_fields,
+            self.date_filter_field
+        )
+        sort = self.get_sort()
+        field = sort.lstrip("-")
+        (cursor, backwards) = self._get_cursor()
+        descending = sort.startswith("-") != backwards
+        (op, prefix) = ("lt", "-") if descending else ("gt", "")
+        if field in ["id", "pk"]:
+            queryset = queryset.order_by(f"{prefix}pk")
+        elif descending:
+            queryset = queryset.order_by(
+                F(field).desc(nulls_last=True), "-pk"
+            )
+        else:
+            queryset = queryset.order_by(
+                F(field).asc(nulls_first=True), "pk"
+            )
+
+        if cursor:
+            (value, pk) = cursor
+            after = Q(**{f"pk__{op}": pk})
+            if field not in ["id", "pk"]:
+                is_null = Q(**{f"{field}__isnull": True})
+                if value is None:
+                    after = is_null & after
+                    if not descending:
+                        after |= ~is_null
+                else:
+                    after = Q(**{f"{field}__{op}": value}) | (
+                        Q(**{field: value}) & after
+                    )
+                    if descending:
+                        after |= is_null
+            try:
+                queryset = queryset.filter(after)
+            except (ValueError, ValidationError):
+                logger.debug("Ignoring invalid page cursor")
+                (cursor, backwards) = (None, False)
+
+        object_list = list(queryset[: page_size + 1])
+        has_more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if backwards:
+            object_list.reverse()
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else bool(cursor)
+
+        self.next_page_url = None
+        self.previous_page_url = None
+        if object_list and has_next:
+            self.next_page_url = self._page_url(
+                "after", self._encode_cursor(object_list[-1], field)
+            )
+        if object_list and has_previous:
+            self.previous_page_url = self._page_url(
+                "before", self._encode_cursor(object_list[0], field)
+            )
+        return (None, None, object_list, has_next or has_previous)
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        sort = self.get_sort()
+        context["sort"] = sort
+        # Clicking the current sort column reverses it
+        context["sort_urls"] = {
+            field: self._page_url(
+                sort=f"-{field}" if sort == field else field
+            )
+            for field in self.sort_fields
+        }
+        context["first_page_url"] = self._page_url()
+        context["next_page_url"] = getattr(self, "next_page_url", None)
+        context["previous_page_url"] = getattr(
+            self, "previous_page_url", None
+        )
+        context["filters"] = {
+            param: self.request.GET.get(param, "")
+            for param in [*self.filter_fields, "start", "end"]
+        }
+        return context
+
+
+class OptionalCursorPagination(pagination.CursorPagination):
+    """Cursor pagination for the REST API
+
+    Only applied when the client asks for it with a 'page_size' or 'cursor'
+    parameter, so that existing clients (e.g. the CLI) which expect a plain
+    list keep working.
+    """
+
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        # The cursor holds only the first field, with an offset past rows
+        # which share its value, so the order must be total
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not {"pk", "-pk", "id", "-id"} & set(ordering):
+            ordering += ("pk",)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not {"cursor", self.page_size_query_param} & set(
+            request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class QueryParamFilter(filters.BaseFilterBackend):
+    """REST API filter backend applying the view's filter_fields and
+    date_filter_field, as for KeysetListMixin"""
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_by_params(
+            queryset,
+            request.query_params,
+            getattr(view, "filter_fields", {}),
+            getattr(view, "date_filter_field", None),
+        )
@@ -41,7 +41,7 @@ from ..cluster_manager.vpc import (
     start_vpc,
     destroy_vpc,
 )
-from ..views.asyncview import BackendAsyncView
+from ..views.asyncview import BackendAsyncView, report_failed_tasks
 from ..serializers import VirtualNetworkSerializer, VirtualSubnetSerializer
 from ..permissions import SuperUserRequiredMixin
 from collections import defaultdict
@@ -82,6 +82,7 @@ class VPCDetailView(SuperUserRequiredMixin, generic.DetailView):
         """Perform extra query to populate instance types data"""
         context = super().get_context_data(**kwargs)
         context["navtab"] = "vpc"
+        report_failed_tasks(self.request, self.object)
         context["subnets"] = VirtualSubnet.objects.filter(vpc=self.kwargs["pk"])
         vpc = get_object_or_404(VirtualNetwork, pk=self.kwargs["pk"])
 
@@ -489,6 +490,8 @@ class VirtualSubnetView(SuperUserRequiredMixin, generic.TemplateView):
 class BackendCreateVPC(BackendAsyncView):
     """A view to make async call to create a new VirtualNetwork"""
 
+    task_resource = "vpc"
+
     @sync_to_async
     def get_orm(self, vpc_id):
         vpc = VirtualNetwork.objects.get(pk=vpc_id)
@@ -512,6 +515,8 @@ class BackendCreateVPC(BackendAsyncView):
 class BackendStartVPC(BackendAsyncView):
     """A view to make async call to create a new VirtualNetwork"""
 
+    task_resource = "vpc"
+
     @sync_to_async
     def get_orm(self, vpc_id):
         vpc = VirtualNetwork.objects.get(pk=vpc_id)
@@ -539,6 +544,11 @@ class BackendStartVPC(BackendAsyncView):
 class BackendDestroyVPC(BackendAsyncView):
     """A view to make async call to destroy a VirtualNetwork"""
 
+    task_resource = "vpc"
+    # Teardown is safe to retry after transient failures
+    task_max_attempts = 2
+    task_error_message = "Cannot destroy VPC - unexpected error ({error})"
+
     @sync_to_async
     def get_orm(self, vpc_id):
         vpc = VirtualNetwork.objects.get(pk=vpc_id)
@@ -556,17 +566,12 @@ class BackendDestroyVPC(BackendAsyncView):
 
     def cmd(self, unused_task_id, unused_token, vpc):
 
+        # Runs in the task worker, so there is no request to attach messages
+        # to; an error fails the task, and VPCDetailView reports it.
         if not vpc.in_use():
-            try:
-                destroy_vpc(vpc)
-                vpc.cloud_state = "xm"
-                vpc.save()
-            except Exception as err: # pylint: disable=broad-except
-                messages.add_message(
-                    self.request,
-                    messages.ERROR,
-                    f"Cannot destroy VPC - unexpected error ({err})",
-                )
+            destroy_vpc(vpc)
+            vpc.cloud_state = "xm"
+            vpc.save()
 
     async def get(self, request, pk):
         """this will invoke the background tasks and return immediately"""
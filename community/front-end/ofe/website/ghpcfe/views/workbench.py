@@ -43,7 +43,7 @@ from ..models import (
 from ..forms import WorkbenchForm, WorkbenchMountPointForm
 from ..cluster_manager import cloud_info
 from ..cluster_manager.workbenchinfo import WorkbenchInfo
-from .asyncview import BackendAsyncView
+from .asyncview import BackendAsyncView, report_failed_tasks
 
 
 class WorkbenchListView(LoginRequiredMixin, generic.ListView):
@@ -74,6 +74,7 @@ class WorkbenchDetailView(LoginRequiredMixin, generic.DetailView):
         """Perform extra query to populate instance types data"""
         context = super().get_context_data(**kwargs)
         context["navtab"] = "workbench"
+        report_failed_tasks(self.request, self.object)
 
         return context
 
@@ -316,6 +317,8 @@ class WorkbenchDestroyView(LoginRequiredMixin, generic.DetailView):
 class BackendCreateWorkbench(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "workbench"
+
     @sync_to_async
     def get_orm(self, workbench_id):
         workbench = Workbench.objects.get(pk=workbench_id)
@@ -343,6 +346,8 @@ class BackendCreateWorkbench(BackendAsyncView):
 class BackendStartWorkbench(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "workbench"
+
     @sync_to_async
     def get_orm(self, workbench_id):
         workbench = Workbench.objects.get(pk=workbench_id)
@@ -369,6 +374,10 @@ class BackendStartWorkbench(BackendAsyncView):
 class BackendDestroyWorkbench(BackendAsyncView):
     """Backend handler for workbench teardown"""
 
+    task_resource = "workbench"
+    # Teardown is safe to retry after transient failures
+    task_max_attempts = 2
+
     @sync_to_async
     def get_orm(self, workbench_id):
         workbench = Workbench.objects.get(pk=workbench_id)
@@ -395,6 +404,8 @@ class BackendDestroyWorkbench(BackendAsyncView):
 class BackendUpdateWorkbench(BackendAsyncView):
     """A view to make async call to create a new cluster"""
 
+    task_resource = "workbench"
+
     @sync_to_async
     def get_orm(self, workbench_id):
         workbench = Workbench.objects.get(pk=workbench_id)
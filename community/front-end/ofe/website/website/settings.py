@@ -148,13 +148,56 @@ WSGI_APPLICATION = "website.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# SQLite by default.  Set DJANGO_DB_ENGINE=postgresql, along with the other
+# DJANGO_DB_* variables, to use a PostgreSQL server instead - see
+# docs/AdvancedAdmin.md for migrating an existing SQLite database.
+if os.environ.get("DJANGO_DB_ENGINE", "sqlite3") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DJANGO_DB_NAME", "ghpcfe"),
+            "USER": os.environ.get("DJANGO_DB_USER", "ghpcfe"),
+            "PASSWORD": os.environ.get("DJANGO_DB_PASSWORD", ""),
+            "HOST": os.environ.get("DJANGO_DB_HOST", "localhost"),
+            "PORT": os.environ.get("DJANGO_DB_PORT", "5432"),
+            # Reuse each thread's connection for this many seconds, rather
+            # than reconnecting for every request and C2 message
+            "CONN_MAX_AGE": int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", "60")),
+            # pgbouncer in transaction pooling mode can't support server side
+            # cursors, as a cursor may outlive the server connection
+            "DISABLE_SERVER_SIDE_CURSORS": (
+                os.environ.get("DJANGO_DB_PGBOUNCER", "") == "1"
+            ),
+        }
     }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+# Opt-in tuning for SQLite (set DJANGO_DB_SQLITE_TUNING=1), applied to each
+# new connection by ghpcfe.signals.  In WAL mode pages can still be read while
+# C2 callbacks and backend tasks are writing; the database file must be on a
+# local disk.
+SQLITE_TUNING_ENABLED = os.environ.get("DJANGO_DB_SQLITE_TUNING", "") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Durable at checkpoints rather than every commit - safe with WAL
+    "synchronous": "NORMAL",
+    # Milliseconds to wait for a lock before failing
+    "busy_timeout": 10000,
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative values are in KiB
+    "cache_size": -64 * 1024,
 }
 
+# Maintain the JobCostRollup table and use it for un-ranged spend totals.
+# After enabling on an existing install, run `manage.py rebuild_cost_rollup`.
+COST_ROLLUP_ENABLED = False
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 